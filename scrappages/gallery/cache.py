@@ -0,0 +1,258 @@
+import functools
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+from scrappages.replicas import acache_fills_pinned, cache_fills_pinned, pin_cache_fills, primary_reads
+
+# response cache for anonymous GETs on the read-only gallery endpoints
+#
+# every cached response belongs to one or more namespaces
+#   feed          GET /scraps/
+#   tag:<name>    GET /scraps/tagged/<name>
+#   scrap:<sid>   GET /scraps/<sid>, GET /scraps/<sid>/comments
+# each namespace has a generation token stored in the cache, and entry keys
+# include the current tokens, so invalidating a namespace is a single write
+# of a fresh token (stale entries just age out of the LRU)
+#
+# gallery/signals.py invalidates the namespaces touched by a Scrap, Comment,
+# Tag or like change
+#
+# acache_anonymous_get() is the same cache for async views
+# (gallery/async_views.py), entries are shared between the two
+#
+# cached_version() keeps the version lookup of a conditional GET
+# (gallery/conditional.py) in the same namespaces, so a cached GET of a
+# detail endpoint runs no query at all
+#
+# with read replicas, the responses cached right after an invalidation are
+# read from the primary (see scrappages/replicas.py)
+
+STATS_HITS = "stats:hits"
+STATS_MISSES = "stats:misses"
+
+
+def get_cache():
+    return caches[getattr(settings, "GALLERY_CACHE_ALIAS", "gallery")]
+
+
+def _generation_key(namespace):
+    # tag names come straight from the URL, keep odd characters out of keys
+    return "gen:" + hashlib.sha256(namespace.encode("utf-8")).hexdigest()
+
+
+def _generations(cache, namespaces):
+    keys = [_generation_key(ns) for ns in namespaces]
+    found = cache.get_many(keys)
+
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+async def _agenerations(cache, namespaces):
+    keys = [_generation_key(ns) for ns in namespaces]
+    found = await cache.aget_many(keys)
+
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        await cache.aset_many(missing, timeout=None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def _response_key(request, generations):
+    # the bodies hold absolute URLs, so scheme and host are part of the key
+    url = request.build_absolute_uri()
+    return "response:" + hashlib.sha256(
+        ":".join([url] + generations).encode("utf-8")).hexdigest()
+
+
+def _version_key(version, kwargs, generations):
+    parts = [version.__module__, version.__qualname__]
+    parts += [f"{name}={value}" for name, value in sorted(kwargs.items())]
+    return "version:" + hashlib.sha256(
+        ":".join(parts + generations).encode("utf-8")).hexdigest()
+
+
+def invalidate(*namespaces):
+    """
+    drops the namespaces once the current transaction (if any) commits
+    a GET in between would refill them with the rows from before the write
+    """
+    def drop():
+        # pinned first, so no refill after the drop reads a replica
+        pin_cache_fills()
+        get_cache().set_many(
+            {_generation_key(ns): uuid.uuid4().hex for ns in namespaces},
+            timeout=None
+        )
+
+    if namespaces:
+        transaction.on_commit(drop)
+
+
+def invalidate_scrap(sid, extra_tag_names=()):
+    """
+    drops everything showing scrap sid: its own pages, the feed and the
+    pages of its tags (plus extra_tag_names, e.g. a tag that was just removed)
+    """
+    from .models import Tag
+
+    tag_names = set(extra_tag_names)
+    tag_names.update(Tag.objects.filter(scrap_id=sid).values_list("label__name", flat=True))
+    invalidate("feed", f"scrap:{sid}", *[f"tag:{name}" for name in tag_names])
+
+
+def _count(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # first hit/miss, or the counter got evicted
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+async def _acount(cache, key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 0, timeout=None)
+        await cache.aincr(key)
+
+
+def _cached_headers(response):
+    headers = {}
+    if response.has_header("Link"):
+        headers["Link"] = response["Link"]
+    return headers
+
+
+def get_stats():
+    cache = get_cache()
+    counts = cache.get_many([STATS_HITS, STATS_MISSES])
+    hits = counts.get(STATS_HITS, 0)
+    misses = counts.get(STATS_MISSES, 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([STATS_HITS, STATS_MISSES])
+
+
+def cached_version(namespaces):
+    """
+    caches what version(**view_kwargs) returns (None too) until one of
+    namespaces(**view_kwargs) is invalidated
+    """
+    def decorator(version):
+        @functools.wraps(version)
+        def wrapper(**kwargs):
+            cache = get_cache()
+            key = _version_key(version, kwargs, _generations(cache, namespaces(**kwargs)))
+
+            entry = cache.get(key)
+            if entry is None:
+                with primary_reads(cache_fills_pinned()):
+                    entry = {"version": version(**kwargs)}
+                cache.set(key, entry)
+            return entry["version"]
+
+        return wrapper
+    return decorator
+
+
+def acached_version(namespaces):
+    """
+    cached_version() for coroutine functions
+    """
+    def decorator(version):
+        @functools.wraps(version)
+        async def wrapper(**kwargs):
+            cache = get_cache()
+            key = _version_key(version, kwargs, await _agenerations(cache, namespaces(**kwargs)))
+
+            entry = await cache.aget(key)
+            if entry is None:
+                with primary_reads(await acache_fills_pinned()):
+                    entry = {"version": await version(**kwargs)}
+                await cache.aset(key, entry)
+            return entry["version"]
+
+        return wrapper
+    return decorator
+
+
+def cache_anonymous_get(namespaces):
+    """
+    caches the data and headers of successful anonymous GET responses
+    namespaces(**view_kwargs) names the namespaces the response belongs to
+    responses carry X-Cache: HIT or MISS
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = _response_key(request, _generations(cache, namespaces(**kwargs)))
+
+            entry = cache.get(key)
+            if entry is not None:
+                _count(cache, STATS_HITS)
+                response = Response(data=entry["data"], headers=entry["headers"])
+                response["X-Cache"] = "HIT"
+                return response
+
+            _count(cache, STATS_MISSES)
+            with primary_reads(cache_fills_pinned()):
+                response = view(request, *args, **kwargs)
+            # streamed responses are never cached
+            if response.status_code == 200 and isinstance(response, Response):
+                cache.set(key, {"data": response.data, "headers": _cached_headers(response)})
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+    return decorator
+
+
+def acache_anonymous_get(namespaces):
+    """
+    cache_anonymous_get() for async views
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or request.user.is_authenticated:
+                return await view(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = _response_key(request, await _agenerations(cache, namespaces(**kwargs)))
+
+            entry = await cache.aget(key)
+            if entry is not None:
+                await _acount(cache, STATS_HITS)
+                response = Response(data=entry["data"], headers=entry["headers"])
+                response["X-Cache"] = "HIT"
+                return response
+
+            await _acount(cache, STATS_MISSES)
+            with primary_reads(await acache_fills_pinned()):
+                response = await view(request, *args, **kwargs)
+            if response.status_code == 200 and isinstance(response, Response):
+                await cache.aset(key, {"data": response.data, "headers": _cached_headers(response)})
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,83 @@
+import datetime
+import functools
+import hashlib
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+
+# conditional GET (ETag / Last-Modified / 304) for the detail endpoints
+#
+# version(**view_kwargs) does one cheap lookup and returns
+# (last_modified, [values the ETag is derived from]), or None if the
+# resource doesn't exist; when the client's copy is still current the view
+# (and its serialize and count queries) never runs
+#
+# aconditional() is the same for async views (gallery/async_views.py), with
+# version a coroutine function
+
+
+def _etag(found):
+    parts = ":".join(str(part) for part in found[1])
+    return '"' + hashlib.sha1(parts.encode("utf-8")).hexdigest() + '"'
+
+
+def conditional(version):
+    def decorator(view):
+        def lookup(request, **kwargs):
+            # etag and last-modified come from the same row, fetch it once
+            if not hasattr(request, "_resource_version"):
+                request._resource_version = version(**kwargs)
+            return request._resource_version
+
+        def etag(request, *args, **kwargs):
+            found = lookup(request, **kwargs)
+            return None if found is None else _etag(found)
+
+        def last_modified(request, *args, **kwargs):
+            found = lookup(request, **kwargs)
+            return None if found is None else found[0]
+
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # writes don't pay for the extra lookup
+            if request.method in ("GET", "HEAD"):
+                return conditional_view(request, *args, **kwargs)
+            return view(request, *args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def aconditional(version):
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await view(request, *args, **kwargs)
+
+            # the headers django's condition() would set
+            found = await version(**kwargs)
+            etag = last_modified = None
+            if found is not None:
+                etag = _etag(found)
+                modified = found[0]
+                if not timezone.is_aware(modified):
+                    modified = timezone.make_aware(modified, datetime.timezone.utc)
+                last_modified = int(modified.timestamp())
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+
+            if last_modified and not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(last_modified)
+            if etag:
+                response.headers.setdefault("ETag", etag)
+            return response
+
+        return wrapper
+    return decorator
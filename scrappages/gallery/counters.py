@@ -0,0 +1,74 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# denormalized counters on Scrap and Comment
+#   Scrap.num_likes      <- Scrap.likers
+#   Scrap.num_comments   <- Scrap.comments (replies included)
+#   Comment.num_likes    <- Comment.likers
+#   Comment.num_replies  <- Comment.replies
+# gallery/signals.py keeps them up to date as rows change,
+# the reconcile_counters command repairs any drift
+
+
+def count_of(model, field):
+    """
+    correlated subquery counting the rows of model whose field points at
+    the outer row, e.g. count_of(Comment, "scrap") for Scrap.num_comments
+    """
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("*"))
+            .values("n")
+        ),
+        Value(0)
+    )
+
+
+def counter_fields(model):
+    # counter field -> (related model, field on it pointing back)
+    from .models import Scrap, Comment
+
+    if model is Scrap:
+        return {
+            "num_likes": (Scrap.likers.through, "scrap"),
+            "num_comments": (Comment, "scrap"),
+        }
+    return {
+        "num_likes": (Comment.likers.through, "comment"),
+        "num_replies": (Comment, "reply_to"),
+    }
+
+
+def refresh_likes(model, pks):
+    # recount in a single UPDATE so concurrent likes can't lose an increment
+    through, field = counter_fields(model)["num_likes"]
+    model.objects.filter(pk__in=pks).update(num_likes=count_of(through, field))
+
+
+def bump(model, pk, field, delta):
+    if pk is not None:
+        model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def reconcile(model):
+    """
+    recounts every counter on model, returns the number of rows that had drifted
+    """
+    fields = counter_fields(model)
+    actual = {f"actual_{name}": count_of(*source) for name, source in fields.items()}
+
+    drifted = Q()
+    for name in fields:
+        drifted |= ~Q(**{name: F(f"actual_{name}")})
+
+    pks = list(
+        model.objects.annotate(**actual).filter(drifted).values_list("pk", flat=True)
+    )
+    if pks:
+        model.objects.filter(pk__in=pks).update(
+            **{name: count_of(*source) for name, source in fields.items()}
+        )
+    return len(pks)
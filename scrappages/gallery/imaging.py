@@ -0,0 +1,86 @@
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+# resized variants of image scraps, so feeds can show small previews
+# instead of the original upload
+#   variant field -> (longest side in pixels, Pillow format, extension)
+# GIFs (animated or not) get still variants made from their first frame
+
+VARIANTS = {
+    "thumbnail": (256, "JPEG", "jpg"),
+    "medium": (1024, "JPEG", "jpg"),
+    "webp": (1600, "WEBP", "webp"),
+}
+
+
+def variant_name(original, variant, ext):
+    # store next to the original: user__x/cat.png -> user__x/cat__thumbnail.jpg
+    stem = os.path.splitext(os.path.basename(original))[0]
+    return f"{stem}__{variant}.{ext}"
+
+
+def _still(image):
+    # first frame only, with orientation from EXIF applied
+    image.seek(0)
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def _flatten(image):
+    # JPEG has no alpha channel, put transparent images on white
+    if image.mode != "RGBA":
+        return image
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def render_variant(image, size, fmt):
+    resized = image.copy()
+    resized.thumbnail((size, size), Image.LANCZOS)
+
+    if fmt == "JPEG":
+        resized = _flatten(resized)
+        options = {"quality": 85, "optimize": True, "progressive": True}
+    else:
+        options = {"quality": 80, "method": 4}
+
+    out = BytesIO()
+    resized.save(out, format=fmt, **options)
+    return out.getvalue()
+
+
+def generate_variants(scrap):
+    """
+    renders and stores every variant of an image scrap, replacing any old ones
+    returns the names of the variant fields that were written
+    """
+    if scrap.file_type != "image":
+        return []
+
+    with scrap.file.open("rb") as f:
+        with Image.open(f) as opened:
+            image = _still(opened)
+
+    written = []
+    for variant, (size, fmt, ext) in VARIANTS.items():
+        if fmt == "WEBP" and not features.check("webp"):
+            continue
+
+        field = getattr(scrap, variant)
+        if field:
+            field.delete(save=False)
+        field.save(
+            variant_name(scrap.file.name, variant, ext),
+            ContentFile(render_variant(image, size, fmt)),
+            save=False
+        )
+        written.append(variant)
+
+    if written:
+        scrap.save(update_fields=written + ["time_updated"])
+    return written
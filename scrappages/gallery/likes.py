@@ -0,0 +1,111 @@
+from django.db import connection, transaction
+from .cache import invalidate_scrap
+from .counters import bump
+from .models import Scrap
+from .scores import refresh_scores
+
+# what the requesting user has liked, for the list endpoints
+#
+# mark_liked(request, rows) sets row.liked_by_me on a page of scraps or
+# comments with a single
+#   SELECT scrap_id FROM gallery_scrap_likers WHERE user_id = ? AND scrap_id IN (...)
+# and scrap_context()/comment_context() add it to the response as "liked_by_me"
+# anonymous users haven't liked anything, that costs no query at all
+#
+# like()/unlike() change a like with a single statement each, the
+# (row, user) unique constraint on the likers table decides who wins
+#   INSERT ... ON CONFLICT DO NOTHING / DELETE ... WHERE row = ? AND user = ?
+# and the num_likes counter moves in the same transaction, only if a row
+# actually changed; a double tap, however the requests interleave, counts once
+
+
+def _liked_query(user, model, ids):
+    if not user.is_authenticated or not ids:
+        return None
+    field = f"{model._meta.model_name}_id"
+    return model.likers.through.objects.filter(
+        user=user, **{f"{field}__in": ids}).values_list(field, flat=True)
+
+
+def liked_ids(user, model, ids):
+    """
+    the ids (out of ids) of the model rows user has liked
+    """
+    query = _liked_query(user, model, ids)
+    return set() if query is None else set(query)
+
+
+def _mark(rows, liked):
+    for row in rows:
+        row.liked_by_me = row.pk in liked
+    return rows
+
+
+def mark_liked(request, rows):
+    """
+    sets liked_by_me on every row (all Scraps or all Comments), returns rows
+    """
+    rows = list(rows)
+    if not rows:
+        return rows
+    return _mark(rows, liked_ids(request.user, type(rows[0]), [row.pk for row in rows]))
+
+
+async def amark_liked(request, rows):
+    """
+    mark_liked() for async views
+    """
+    rows = list(rows)
+    if not rows:
+        return rows
+    query = _liked_query(request.user, type(rows[0]), [row.pk for row in rows])
+    liked = set() if query is None else {pk async for pk in query}
+    return _mark(rows, liked)
+
+
+def _likers(model):
+    return model.likers.through, f"{model._meta.model_name}_id"
+
+
+def _changed(model, obj):
+    # what the m2m_changed handler in gallery/signals.py does for add/remove
+    if model is Scrap:
+        refresh_scores([obj.pk], create=False)
+        invalidate_scrap(obj.pk)
+    else:
+        invalidate_scrap(obj.scrap_id)
+
+
+def like(obj, user):
+    """
+    user likes obj (a Scrap or a Comment), False if they already did
+    """
+    model = type(obj)
+    through, field = _likers(model)
+    qn = connection.ops.quote_name
+    sql = (f"INSERT INTO {qn(through._meta.db_table)} ({qn(field)}, {qn('user_id')}) "
+           f"VALUES (%s, %s) ON CONFLICT DO NOTHING")
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [obj.pk, user.pk])
+            created = cursor.rowcount == 1
+        if created:
+            bump(model, obj.pk, "num_likes", 1)
+            _changed(model, obj)
+    return created
+
+
+def unlike(obj, user):
+    """
+    user takes back their like of obj, False if there was none
+    """
+    model = type(obj)
+    through, field = _likers(model)
+
+    with transaction.atomic():
+        deleted = through.objects.filter(**{field: obj.pk, "user_id": user.pk}).delete()[0]
+        if deleted:
+            bump(model, obj.pk, "num_likes", -1)
+            _changed(model, obj)
+    return bool(deleted)
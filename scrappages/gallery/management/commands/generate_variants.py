@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from gallery.imaging import generate_variants
+from gallery.models import Scrap
+
+
+class Command(BaseCommand):
+    help = "Renders the thumbnail/medium/WebP variants of image scraps that don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="re-render every image scrap, not just the ones missing variants",
+        )
+
+    def handle(self, *args, **options):
+        scraps = Scrap.objects.filter(file_type="image").order_by("id")
+        if not options["all"]:
+            scraps = scraps.filter(thumbnail="")
+
+        done = 0
+        for scrap in scraps.iterator():
+            try:
+                generate_variants(scrap)
+                done += 1
+            except Exception as e:
+                self.stderr.write(f"Scrap {scrap.id}: {e}")
+
+        self.stdout.write(f"Rendered variants for {done} scrap(s)")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from gallery.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Recomputes the full-text search index of every scrap"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--read-files",
+            action="store_true",
+            help="also re-read the contents of every text scrap",
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index(read_files=options["read_files"])
+        self.stdout.write(f"Indexed {count} scrap(s)")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from gallery.counters import reconcile
+from gallery.models import Scrap, Comment
+
+
+class Command(BaseCommand):
+    help = "Recounts the like/comment/reply counters on Scrap and Comment and fixes any that drifted"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            scraps = reconcile(Scrap)
+            comments = reconcile(Comment)
+
+        self.stdout.write(f"Reconciled {scraps} scrap(s) and {comments} comment(s)")
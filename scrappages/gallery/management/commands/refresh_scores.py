@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from gallery.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = "Recomputes the hot feed score of every scrap"
+
+    def handle(self, *args, **options):
+        count = refresh_scores()
+        self.stdout.write(f"Scored {count} scrap(s)")
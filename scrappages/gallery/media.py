@@ -0,0 +1,182 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .storage import is_blob
+
+# serving uploaded media (replaces django.conf.urls.static.static)
+#
+# with MEDIA_IMMUTABLE_URLS on, media_url() adds ?v=<version> to the URLs in
+# Scrap.serialize() / Profile.get_profile_picture_url(), the version comes
+# from the owner's time_updated (variants are re-rendered under the same
+# name, but that always touches time_updated); content-addressed blobs
+# (gallery/storage.py) need no version at all
+# blob URLs, and URLs whose ?v= is the version media_url() gives out right
+# now (one lookup of the file's owner), are served with Cache-Control:
+# immutable; anything else has to revalidate, a stale or made-up ?v= must
+# not pin old bytes in caches
+#
+# MEDIA_ACCEL hands the byte transfer to the front server
+#   ""          files are sent from Python (with Range support), only while
+#               developing (MEDIA_SERVE in settings.py)
+#   "nginx"     X-Accel-Redirect: MEDIA_ACCEL_PREFIX + path, e.g.
+#                   location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+#   "sendfile"  X-Sendfile: <absolute path> (Apache mod_xsendfile, lighttpd)
+# either way the front server deals with Range requests itself
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def media_url(field, updated=None):
+    """
+    URL of a stored file, versioned if MEDIA_IMMUTABLE_URLS is on
+    updated is the time_updated of the row the file belongs to
+    """
+    if not field:
+        return None
+    url = field.url
+    if (getattr(settings, "MEDIA_IMMUTABLE_URLS", False)
+            and updated is not None and not is_blob(field.name)):
+        url += f"?v={media_version(updated)}"
+    return url
+
+
+def media_version(updated):
+    return f"{int(updated.timestamp() * 1000000):x}"
+
+
+def _owner_updated(path):
+    # time_updated of the row the file at path belongs to, or None
+    from django.db.models import Q
+    from profiles.models import Profile
+    from .models import Scrap
+
+    updated = Scrap.objects.filter(
+        Q(file=path) | Q(thumbnail=path) | Q(medium=path) | Q(webp=path)
+    ).values_list("time_updated", flat=True).first()
+    if updated is None:
+        updated = Profile.objects.filter(profile_picture=path).values_list(
+            "time_updated", flat=True).first()
+    return updated
+
+
+def _immutable(request, path):
+    if is_blob(path):
+        return True
+    if not getattr(settings, "MEDIA_IMMUTABLE_URLS", False) or "v" not in request.GET:
+        return False
+    updated = _owner_updated(path)
+    return updated is not None and request.GET["v"] == media_version(updated)
+
+
+def _etag(stat):
+    return quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+
+
+def _byte_range(header, size):
+    """
+    (start, end) inclusive for a single-range Range header, None to ignore
+    the header (serve the whole file), or False if it can't be satisfied
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        # multiple ranges or another unit, the full file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # suffix range, the last n bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length, block_size=64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, path):
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponse(status=405, headers={"Allow": "GET, HEAD"})
+
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        # path escapes MEDIA_ROOT
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    stat = os.stat(full_path)
+    etag = _etag(stat)
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMMUTABLE if _immutable(request, path) else REVALIDATE,
+    }
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    accel = getattr(settings, "MEDIA_ACCEL", "")
+    if accel:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if accel == "nginx":
+            prefix = getattr(settings, "MEDIA_ACCEL_PREFIX", "/protected-media/")
+            response["X-Accel-Redirect"] = prefix + quote(path)
+        else:
+            response["X-Sendfile"] = full_path
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if range_header and request.headers.get("If-Range", etag) == etag:
+        byte_range = _byte_range(range_header, size)
+
+    if byte_range is False:
+        headers["Content-Range"] = f"bytes */{size}"
+        return HttpResponse(status=416, headers=headers)
+
+    if byte_range is None:
+        response = FileResponse(
+            open(full_path, "rb"), content_type=content_type, headers=headers)
+    else:
+        start, end = byte_range
+        response = FileResponse(
+            _read_range(full_path, start, end - start + 1),
+            status=206, content_type=content_type, headers=headers)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    return response
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scrap',
+            index=models.Index(fields=['-time_updated', '-id'], name='scrap_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scrap',
+            index=models.Index(fields=['user', '-time_updated', '-id'], name='scrap_user_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:01
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("*"))
+            .values("n")
+        ),
+        Value(0)
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Scrap = apps.get_model("gallery", "Scrap")
+    Comment = apps.get_model("gallery", "Comment")
+
+    Scrap.objects.update(
+        num_likes=count_of(Scrap.likers.through, "scrap"),
+        num_comments=count_of(Comment, "scrap"),
+    )
+    Comment.objects.update(
+        num_likes=count_of(Comment.likers.through, "comment"),
+        num_replies=count_of(Comment, "reply_to"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0002_scrap_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='num_likes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='num_replies',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrap',
+            name='num_comments',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scrap',
+            name='num_likes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
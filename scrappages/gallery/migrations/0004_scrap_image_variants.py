@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:10
+
+from django.db import migrations, models
+import gallery.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0003_scrap_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrap',
+            name='medium',
+            field=models.FileField(blank=True, upload_to=gallery.models.user_directory_path),
+        ),
+        migrations.AddField(
+            model_name='scrap',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to=gallery.models.user_directory_path),
+        ),
+        migrations.AddField(
+            model_name='scrap',
+            name='webp',
+            field=models.FileField(blank=True, upload_to=gallery.models.user_directory_path),
+        ),
+    ]
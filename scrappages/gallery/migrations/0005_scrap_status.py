@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0004_scrap_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrap',
+            name='status',
+            field=models.CharField(default='ready', max_length=10),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0005_scrap_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refs', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
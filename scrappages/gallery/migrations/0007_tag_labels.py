@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0006_blob_dedup_storage'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='tag',
+            name='unique_scrap_tag_combination',
+        ),
+        migrations.CreateModel(
+            name='TagLabel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='label',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tags', to='gallery.taglabel'),
+        ),
+    ]
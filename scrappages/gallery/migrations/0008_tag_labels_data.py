@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:12
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+# data only, between the schema changes of 0007 and 0009: postgres won't
+# alter a table with pending deferred-constraint triggers from the same
+# transaction
+
+
+def move_names_to_labels(apps, schema_editor):
+    Tag = apps.get_model("gallery", "Tag")
+    TagLabel = apps.get_model("gallery", "TagLabel")
+
+    names = Tag.objects.order_by().values_list("name", flat=True).distinct()
+    TagLabel.objects.bulk_create(
+        [TagLabel(name=name) for name in names.iterator()], batch_size=1000)
+    # a single UPDATE
+    Tag.objects.update(label=Subquery(
+        TagLabel.objects.filter(name=OuterRef("name")).values("id")[:1]))
+
+
+def move_labels_to_names(apps, schema_editor):
+    Tag = apps.get_model("gallery", "Tag")
+    TagLabel = apps.get_model("gallery", "TagLabel")
+
+    Tag.objects.update(name=Subquery(
+        TagLabel.objects.filter(id=OuterRef("label_id")).values("name")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0007_tag_labels'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_names_to_labels, move_labels_to_names),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:33
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# GIN indexes are Postgres only, other databases search without one
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from django.conf import settings
+    from django.contrib.postgres.search import SearchVector
+
+    Scrap = apps.get_model("gallery", "Scrap")
+    config = getattr(settings, "SEARCH_CONFIG", "english")
+    # text scrap contents are filled in by rebuild_search_index --read-files
+    Scrap.objects.update(search_vector=(
+        SearchVector("title", weight="A", config=config)
+        + SearchVector("description", weight="B", config=config)
+    ))
+    schema_editor.execute(
+        "CREATE INDEX scrap_search_idx ON gallery_scrap USING gin (search_vector)")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS scrap_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0009_tag_labels_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrap',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.AddField(
+            model_name='scrap',
+            name='text_content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:34
+
+import math
+from datetime import datetime, timezone
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_scores(apps, schema_editor):
+    from django.conf import settings
+
+    Scrap = apps.get_model("gallery", "Scrap")
+    ScrapScore = apps.get_model("gallery", "ScrapScore")
+
+    # as in gallery/scores.py at the time of writing
+    epoch = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    half_life = getattr(settings, "HOT_HALF_LIFE_HOURS", 12) * 3600
+
+    scores = []
+    rows = Scrap.objects.values_list("id", "time_posted", "num_likes", "num_comments")
+    for sid, time_posted, num_likes, num_comments in rows.iterator():
+        hot = (math.log10(1 + num_likes + 2 * num_comments)
+               + (time_posted - epoch).total_seconds() / half_life * math.log10(2))
+        scores.append(ScrapScore(scrap_id=sid, hot=hot))
+    ScrapScore.objects.bulk_create(scores, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0010_scrap_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapScore',
+            fields=[
+                ('scrap', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='gallery.scrap')),
+                ('hot', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='scrapscore',
+            index=models.Index(fields=['-hot', '-scrap'], name='scrap_hot_idx'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# everyone's own scraps go into their timeline
+def backfill_own_scraps(apps, schema_editor):
+    Scrap = apps.get_model("gallery", "Scrap")
+    TimelineEntry = apps.get_model("gallery", "TimelineEntry")
+
+    rows = Scrap.objects.values_list("id", "user_id", "time_posted")
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(scrap_id=sid, user_id=uid, time_posted=time_posted)
+         for sid, uid, time_posted in rows.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gallery', '0011_scrap_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_posted', models.DateTimeField()),
+                ('scrap', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='gallery.scrap')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-time_posted', '-scrap'], name='timeline_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'scrap'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(backfill_own_scraps, migrations.RunPython.noop),
+    ]
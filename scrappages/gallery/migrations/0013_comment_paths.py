@@ -0,0 +1,44 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:46
+
+from django.db import migrations, models
+from django.utils.http import int_to_base36
+
+
+# replies always come after what they reply to, so in id order every
+# parent's path is known before its replies need it
+def backfill_paths(apps, schema_editor):
+    Comment = apps.get_model("gallery", "Comment")
+
+    paths = {}
+    depths = {}
+    batch = []
+    rows = Comment.objects.order_by("id").values_list("id", "reply_to_id")
+    for cid, parent in rows.iterator():
+        parent_path = paths.get(parent, "")
+        paths[cid] = f"{parent_path}{int_to_base36(cid)}/"
+        depths[cid] = depths[parent] + 1 if parent is not None else 0
+        batch.append(Comment(id=cid, path=paths[cid], depth=depths[cid]))
+        if len(batch) == 1000:
+            Comment.objects.bulk_update(batch, ["path", "depth"])
+            batch = []
+    Comment.objects.bulk_update(batch, ["path", "depth"])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0012_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1500),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth.models import User
 import datetime
+from .media import media_url
+from .storage import select_media_storage
 
 # Create your models here.
 def user_directory_path(instance, filename):
@@ -17,6 +20,29 @@ def get_sentinel_user():
     )[0]
 
 
+class ScrapQuerySet(models.QuerySet):
+    def for_serialization(self):
+        # everything Scrap.serialize() touches, loaded in a fixed number of
+        # queries no matter how many scraps are in the page
+        # (the search columns can be large and are never shown)
+        return self.select_related("user").prefetch_related("tags").defer(
+            "text_content", "search_vector")
+
+
+def save_keeping_counters(instance, counters, args, kwargs):
+    # counters are only ever written with UPDATE ... SET n = n + 1 style
+    # queries, so a plain save() of a stale instance must not overwrite them
+    if (not instance._state.adding and not args and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None):
+        deferred = instance.get_deferred_fields()
+        kwargs["update_fields"] = [
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in counters
+            and field.attname not in deferred
+        ]
+    return args, kwargs
+
+
 # User
 #   scraps
 #   comments
@@ -32,6 +58,8 @@ class Scrap(models.Model):
         related_name="scraps"
     )
 
+    objects = ScrapQuerySet.as_manager()
+
     title = models.CharField(
         max_length=100
     )
@@ -50,7 +78,34 @@ class Scrap(models.Model):
 
     # only TXT, PNG, JPG, GIF allowed
     file = models.FileField(
-        upload_to=user_directory_path
+        upload_to=user_directory_path,
+        storage=select_media_storage
+    )
+
+    # resized previews of image scraps, see gallery/imaging.py
+    thumbnail = models.FileField(
+        upload_to=user_directory_path,
+        storage=select_media_storage,
+        blank=True
+    )
+
+    medium = models.FileField(
+        upload_to=user_directory_path,
+        storage=select_media_storage,
+        blank=True
+    )
+
+    webp = models.FileField(
+        upload_to=user_directory_path,
+        storage=select_media_storage,
+        blank=True
+    )
+
+    # processing until the upload job (gallery/tasks.py) has verified the
+    # image and rendered its variants, failed if the image didn't verify
+    status = models.CharField(
+        max_length=10,
+        default="ready"
     )
 
     # in case I need it
@@ -65,6 +120,40 @@ class Scrap(models.Model):
         related_name="scrap_likes"
     )
 
+    # denormalized counters, see gallery/counters.py
+    num_likes = models.IntegerField(
+        default=0
+    )
+
+    num_comments = models.IntegerField(
+        default=0
+    )
+
+    # full-text search, see gallery/search.py
+    # the contents of text scraps, read once on upload
+    text_content = models.TextField(
+        default="",
+        blank=True
+    )
+
+    # title, description and text_content (Postgres only, GIN indexed)
+    # written by UPDATEs in gallery/search.py, never by save()
+    search_vector = SearchVectorField(
+        null=True
+    )
+
+    # the feeds page newest first on (time_updated, id)
+    # see gallery/pagination.py
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-time_updated", "-id"], name="scrap_feed_idx"
+            ),
+            models.Index(
+                fields=["user", "-time_updated", "-id"], name="scrap_user_feed_idx"
+            )
+        ]
+
     # comments
     def serialize(self):
         return {
@@ -74,8 +163,12 @@ class Scrap(models.Model):
             "description": self.description,
             "time_posted": self.time_posted,
             "time_updated": self.time_updated,
-            "file_url": self.file.url,
+            "file_url": media_url(self.file, self.time_updated),
+            "thumbnail_url": media_url(self.thumbnail, self.time_updated),
+            "medium_url": media_url(self.medium, self.time_updated),
+            "webp_url": media_url(self.webp, self.time_updated),
             "file_type": self.file_type,
+            "status": self.status,
             "tags": self.get_tags()
         }
         # manually get num_comments, num_likes
@@ -86,15 +179,21 @@ class Scrap(models.Model):
             ans.append(tag.serialize())
         return ans
 
+    def save(self, *args, **kwargs):
+        args, kwargs = save_keeping_counters(
+            self, ("num_likes", "num_comments", "search_vector"), args, kwargs)
+        super(Scrap, self).save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
         # get and delete file
-        try:
-            # attempt to delete the file
-            if self.file:
-                self.file.delete(save=False)
-        except:
-            # idk the file doesn't exist I suppose
-            pass
+        for field in [self.file, self.thumbnail, self.medium, self.webp]:
+            try:
+                # attempt to delete the file
+                if field:
+                    field.delete(save=False)
+            except:
+                # idk the file doesn't exist I suppose
+                pass
 
         super(Scrap, self).delete(*args, **kwargs)
 
@@ -136,6 +235,32 @@ class Comment(models.Model):
         related_name="comment_likes"
     )
 
+    # denormalized counters, see gallery/counters.py
+    num_likes = models.IntegerField(
+        default=0
+    )
+
+    num_replies = models.IntegerField(
+        default=0
+    )
+
+    # materialized path, see gallery/threads.py
+    # the base 36 ids from the top level comment down to this one, each
+    # followed by a "/", e.g. "1a/2f/" is reply 2f to comment 1a
+    # set once on insert, replies never move
+    path = models.CharField(
+        max_length=1500,
+        default="",
+        db_index=True,
+        editable=False
+    )
+
+    # 0 for comments on the scrap itself
+    depth = models.IntegerField(
+        default=0,
+        editable=False
+    )
+
     def serialize(self):
         return {
             "id": self.id,
@@ -143,15 +268,133 @@ class Comment(models.Model):
             "user": self.user.username,
             "time_posted": self.time_posted,
             "time_updated": self.time_updated,
-            "scrap_id": self.scrap.id,
-            "reply_to_id": None if (not self.reply_to) else self.reply_to.id
+            "scrap_id": self.scrap_id,
+            "reply_to_id": self.reply_to_id
         }
         # manually get num_likes
 
+    def save(self, *args, **kwargs):
+        args, kwargs = save_keeping_counters(
+            self, ("num_likes", "num_replies"), args, kwargs)
+        adding = self._state.adding
+        if adding and self.reply_to_id is not None:
+            self.depth = self.reply_to.depth + 1
+        super(Comment, self).save(*args, **kwargs)
 
-class Tag(models.Model):
+        if adding:
+            # the path ends in our own id, which we only know now
+            from .threads import comment_path
+            self.path = comment_path(self)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    def descendants(self):
+        # every reply below this one, one indexed prefix scan
+        return Comment.objects.filter(path__startswith=self.path).exclude(pk=self.pk)
+
+    def subtree_size(self):
+        # this comment and all the replies below it
+        return Comment.objects.filter(path__startswith=self.path).count()
+
+    def delete(self, *args, **kwargs):
+        if not self.path:
+            # built by hand, without the row's path
+            return super(Comment, self).delete(*args, **kwargs)
+        # the replies go with it in one DELETE, see gallery/threads.py
+        from .threads import delete_subtree
+        return delete_subtree(self)
+
+
+# the hot feed, see gallery/scores.py
+class ScrapScore(models.Model):
+    scrap = models.OneToOneField(
+        'Scrap',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="score"
+    )
+
+    hot = models.FloatField(
+        default=0
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-hot", "-scrap"], name="scrap_hot_idx"
+            )
+        ]
+
+
+# GET /scraps/home, see gallery/timeline.py
+class TimelineEntry(models.Model):
+    # covered by the timeline index
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline",
+        db_index=False
+    )
+
+    scrap = models.ForeignKey(
+        'Scrap',
+        on_delete=models.CASCADE,
+        related_name="timeline_entries"
+    )
+
+    # copied from the scrap, timelines page newest first on (time_posted, scrap)
+    time_posted = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "scrap"], name="unique_timeline_entry"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-time_posted", "-scrap"], name="timeline_idx"
+            )
+        ]
+
+
+# every distinct tag name, once
+class TagLabel(models.Model):
     name = models.CharField(
-        max_length=64
+        max_length=64,
+        unique=True
+    )
+
+
+def get_tag_labels(names):
+    """
+    name -> TagLabel for every name, creating the missing labels
+    two queries however many names
+    """
+    TagLabel.objects.bulk_create(
+        [TagLabel(name=name) for name in names], ignore_conflicts=True)
+    return {label.name: label for label in TagLabel.objects.filter(name__in=names)}
+
+
+def get_tag_label(name):
+    return TagLabel.objects.get_or_create(name=name)[0]
+
+
+class TagManager(models.Manager):
+    # scrap.tags and prefetch_related("tags") use this too
+    def get_queryset(self):
+        return super().get_queryset().select_related("label")
+
+
+# a scrap <-> label pair
+# the name lives on the label: Tag(label=get_tag_label(name), scrap=...),
+# and queries go through label__name
+class Tag(models.Model):
+    # the (label, scrap) unique constraint is the tag -> scraps index
+    label = models.ForeignKey(
+        TagLabel,
+        on_delete=models.PROTECT,
+        related_name="tags",
+        db_index=False
     )
 
     scrap = models.ForeignKey(
@@ -160,10 +403,12 @@ class Tag(models.Model):
         related_name="tags"
     )
 
+    objects = TagManager()
+
     def serialize(self):
         return {
-            "name": self.name,
-            "scrap_id": self.scrap.id
+            "name": self.label.name,
+            "scrap_id": self.scrap_id
         }
 
     # apparently Django only supports single primary keys
@@ -171,6 +416,24 @@ class Tag(models.Model):
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=["name", "scrap"], name="unique_scrap_tag_combination"
+                fields=["label", "scrap"], name="unique_scrap_tag_combination"
             )
         ]
+
+
+# one row per stored file of DedupFileSystemStorage, see gallery/storage.py
+class Blob(models.Model):
+    # blobs/<h[:2]>/<h[2:4]>/<sha256>.<ext>
+    name = models.CharField(
+        max_length=100,
+        primary_key=True
+    )
+
+    # number of file fields pointing at it
+    refs = models.IntegerField(
+        default=0
+    )
+
+    size = models.BigIntegerField(
+        default=0
+    )
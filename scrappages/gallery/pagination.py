@@ -0,0 +1,157 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# keyset (cursor) pagination for the scrap feeds
+# pages are ordered newest first on (time_updated, id), so fetching a page
+# is one bounded range scan over the feed index instead of an OFFSET scan
+
+# ?page_size=N picks the page size (capped at SCRAPS_MAX_PAGE_SIZE)
+# ?cursor=... is an opaque token taken from the Link header of a previous page
+
+FEED_KEYS = ("time_updated", "id")
+# ?sort=hot, see gallery/scores.py
+# both keys on ScrapScore, so pages come straight off its (hot, scrap) index
+HOT_KEYS = ("score__hot", "score__scrap_id")
+# GET /scraps/home pages over TimelineEntry, see gallery/timeline.py
+TIMELINE_KEYS = ("time_posted", "scrap_id")
+
+
+def get_page_size(request):
+    default = getattr(settings, "SCRAPS_PAGE_SIZE", 50)
+    maximum = getattr(settings, "SCRAPS_MAX_PAGE_SIZE", 200)
+
+    page_size = request.query_params.get("page_size")
+    if page_size is None:
+        return default
+
+    try:
+        page_size = int(page_size)
+    except ValueError:
+        raise ValueError("Invalid; page_size must be a positive integer")
+    if page_size < 1:
+        raise ValueError("Invalid; page_size must be a positive integer")
+    return min(page_size, maximum)
+
+
+def encode_cursor(values, reverse=False):
+    # full precision isoformat: truncating microseconds would skip rows
+    values = [v.isoformat() if hasattr(v, "isoformat") else v for v in values]
+    payload = json.dumps({"v": values, "r": reverse}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values = payload["v"]
+        reverse = bool(payload["r"])
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise ValueError("Invalid; malformed cursor")
+
+    if not isinstance(values, list):
+        raise ValueError("Invalid; malformed cursor")
+
+    # datetimes go over the wire as ISO strings
+    decoded = []
+    for value in values:
+        if isinstance(value, str):
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError("Invalid; malformed cursor")
+            value = parsed
+        decoded.append(value)
+    return decoded, reverse
+
+
+def _after(keys, values, lookup):
+    # rows strictly past (values) in lexicographic order of keys
+    # e.g. (a < x) OR (a = x AND b < y)
+    condition = Q()
+    equal = {}
+    for key, value in zip(keys, values):
+        condition |= Q(**equal, **{f"{key}__{lookup}": value})
+        equal[key] = value
+    return condition
+
+
+def _row_values(row, keys):
+    values = []
+    for key in keys:
+        value = row
+        for part in key.split("__"):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+def _link(request, cursor, rel):
+    params = request.query_params.copy()
+    params["cursor"] = cursor
+    url = request.build_absolute_uri(request.path + "?" + params.urlencode())
+    return f'<{url}>; rel="{rel}"'
+
+
+def _page_query(request, queryset, keys):
+    page_size = get_page_size(request)
+    cursor = request.query_params.get("cursor")
+
+    reverse = False
+    if cursor:
+        values, reverse = decode_cursor(cursor)
+        if len(values) != len(keys):
+            raise ValueError("Invalid; malformed cursor")
+        queryset = queryset.filter(_after(keys, values, "gt" if reverse else "lt"))
+
+    if reverse:
+        queryset = queryset.order_by(*keys)
+    else:
+        queryset = queryset.order_by(*[f"-{key}" for key in keys])
+
+    # one extra row tells us whether there is another page
+    return queryset[:page_size + 1], (page_size, cursor, reverse)
+
+
+def _page(request, rows, keys, state):
+    page_size, cursor, reverse = state
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    has_next = has_more if not reverse else True
+    has_prev = bool(cursor) if not reverse else has_more
+
+    links = []
+    if rows and has_next:
+        links.append(_link(request, encode_cursor(_row_values(rows[-1], keys)), "next"))
+    if rows and has_prev:
+        links.append(_link(request, encode_cursor(_row_values(rows[0], keys), reverse=True), "prev"))
+
+    headers = {}
+    if links:
+        headers["Link"] = ", ".join(links)
+    return rows, headers
+
+
+def paginate(request, queryset, keys=FEED_KEYS):
+    """
+    returns one page of queryset (newest first on keys) and the response
+    headers pointing at the neighbouring pages
+    - Link: <...>; rel="next", <...>; rel="prev"
+    raises ValueError on a bad page_size or cursor
+    """
+    queryset, state = _page_query(request, queryset, keys)
+    return _page(request, list(queryset), keys, state)
+
+
+async def apaginate(request, queryset, keys=FEED_KEYS):
+    """
+    paginate() for async views
+    """
+    queryset, state = _page_query(request, queryset, keys)
+    return _page(request, [row async for row in queryset], keys, state)
@@ -0,0 +1,70 @@
+import math
+from datetime import datetime, timezone
+from django.conf import settings
+
+# precomputed "hot" scores for GET /scraps/?sort=hot
+#
+#   hot = log10(1 + likes + COMMENT_WEIGHT * comments)
+#         + (time_posted - EPOCH) / half life * log10(2)
+#
+# i.e. every half life of age costs a scrap half its engagement, the same
+# decay as weighting each like/comment by 2^(-age / half life), except that
+# ages only ever grow together, so a score never has to be recomputed just
+# because time passed: it only changes with the scrap's own counters
+#
+# gallery/signals.py refreshes a scrap's score whenever its likes or comments
+# change, the refresh_scores command recomputes all of them (e.g. after
+# changing HOT_HALF_LIFE_HOURS)
+# the feed itself is one scan of the ScrapScore (hot, scrap) index
+
+COMMENT_WEIGHT = 2
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+# scores written per query by refresh_scores()
+BATCH_SIZE = 1000
+
+
+def get_half_life():
+    return getattr(settings, "HOT_HALF_LIFE_HOURS", 12) * 3600
+
+
+def hot_score(time_posted, num_likes, num_comments):
+    engagement = 1 + max(num_likes, 0) + COMMENT_WEIGHT * max(num_comments, 0)
+    age = (time_posted - EPOCH).total_seconds()
+    return math.log10(engagement) + age / get_half_life() * math.log10(2)
+
+
+def refresh_scores(scrap_ids=None, create=True):
+    """
+    recomputes the scores of scrap_ids (every scrap if None) from their
+    counters, two queries per BATCH_SIZE scraps
+    create=False only updates existing scores, for signals that may fire
+    while the scrap (and its score) is being deleted
+    returns the number of scores computed
+    """
+    from .models import Scrap, ScrapScore
+
+    rows = Scrap.objects.order_by().values_list(
+        "id", "time_posted", "num_likes", "num_comments")
+    if scrap_ids is not None:
+        rows = rows.filter(id__in=list(scrap_ids))
+
+    written = 0
+    batch = []
+    for sid, time_posted, num_likes, num_comments in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ScrapScore(scrap_id=sid, hot=hot_score(time_posted, num_likes, num_comments)))
+        if len(batch) >= BATCH_SIZE:
+            written += _write(ScrapScore, batch, create)
+            batch = []
+    if batch:
+        written += _write(ScrapScore, batch, create)
+    return written
+
+
+def _write(ScrapScore, batch, create):
+    if create:
+        ScrapScore.objects.bulk_create(
+            batch, update_conflicts=True, unique_fields=["scrap"], update_fields=["hot"])
+    else:
+        ScrapScore.objects.bulk_update(batch, ["hot"])
+    return len(batch)
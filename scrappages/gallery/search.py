@@ -0,0 +1,172 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+from .models import Scrap, Tag, TagLabel
+
+# boolean tag search, GET /scraps/search?tags=a,b&any=c,d&exclude=e
+#   tags      the scrap has every one of these
+#   any       the scrap has at least one of these
+#   exclude   the scrap has none of these
+#
+# every part is a subquery on the (label, scrap) index of Tag producing a set
+# of scrap ids, e.g. tags=a,b is
+#   SELECT scrap_id FROM gallery_tag WHERE label_id IN (a, b)
+#   GROUP BY scrap_id HAVING COUNT(*) = 2
+# so a search costs one query however many tags it names (instead of a join
+# per tag), and the parts are combined with IN / NOT IN
+
+MAX_SEARCH_TAGS = 20
+
+
+def scrap_ids_with(label_ids, every=False):
+    ids = Tag.objects.filter(label_id__in=label_ids).values("scrap_id")
+    if every:
+        # Tag is unique on (label, scrap), so a full count means all of them
+        ids = ids.annotate(n=Count("label_id")).filter(n=len(label_ids)).values("scrap_id")
+    return ids
+
+
+def tag_search(all_of=(), any_of=(), none_of=()):
+    """
+    scraps matching the tag expression, unordered
+    """
+    names = set(all_of) | set(any_of) | set(none_of)
+    labels = dict(TagLabel.objects.filter(name__in=names).values_list("name", "id"))
+
+    scraps = Scrap.objects.all()
+    if all_of:
+        if not set(all_of) <= labels.keys():
+            # a tag nobody uses
+            return Scrap.objects.none()
+        scraps = scraps.filter(
+            id__in=scrap_ids_with([labels[name] for name in all_of], every=True))
+    if any_of:
+        found = [labels[name] for name in any_of if name in labels]
+        if not found:
+            return Scrap.objects.none()
+        scraps = scraps.filter(id__in=scrap_ids_with(found))
+    if none_of:
+        found = [labels[name] for name in none_of if name in labels]
+        if found:
+            scraps = scraps.exclude(id__in=scrap_ids_with(found))
+    return scraps
+
+
+# full-text search, GET /scraps/search?q=...
+#
+# on Postgres Scrap.search_vector holds
+#   title (weight A) + description (B) + contents of text scraps (C)
+# behind a GIN index (migration 0010); the post_save signal in
+# gallery/signals.py refreshes just the saved row when a save() changed the
+# title or description,
+# the rebuild_search_index command redoes every row
+# results are ranked with ts_rank, q uses web search syntax
+# ("quoted phrases", or, -not)
+#
+# other databases (SQLite in tests) fall back to icontains on every word,
+# ranked by which fields matched
+
+SEARCH_FIELDS = ("title", "description", "text_content")
+
+# characters of a text scrap that get indexed
+SEARCH_TEXT_LIMIT = 100000
+
+MAX_SEARCH_QUERY_LENGTH = 200
+
+
+def uses_tsvector():
+    return connection.vendor == "postgresql"
+
+
+def get_search_config():
+    return getattr(settings, "SEARCH_CONFIG", "english")
+
+
+def read_text_content(scrap):
+    if scrap.file_type != "text" or not scrap.file:
+        return ""
+    try:
+        with scrap.file.open("rb") as f:
+            data = f.read(SEARCH_TEXT_LIMIT * 4)
+    except OSError:
+        return ""
+    # NUL isn't allowed in Postgres text
+    return data.decode("utf-8", errors="replace")[:SEARCH_TEXT_LIMIT].replace("\x00", "")
+
+
+def search_vector():
+    config = get_search_config()
+    return (
+        SearchVector("title", weight="A", config=config)
+        + SearchVector("description", weight="B", config=config)
+        + SearchVector("text_content", weight="C", config=config)
+    )
+
+
+def update_search_index(scrap, read_file=False):
+    """
+    brings one scrap's search columns up to date
+    read_file re-reads the contents of a text scrap
+    """
+    row = Scrap.objects.filter(pk=scrap.pk)
+    if read_file:
+        scrap.text_content = read_text_content(scrap)
+        row.update(text_content=scrap.text_content)
+    # a separate UPDATE: within one, SET expressions see the old text_content
+    if uses_tsvector():
+        row.update(search_vector=search_vector())
+    remember_indexed(scrap)
+
+
+# save() only ever writes title and description of SEARCH_FIELDS
+# (text_content is written here), so comparing them with the values the
+# instance was loaded with tells whether a save() needs a reindex
+def _indexed_values(scrap):
+    return (scrap.__dict__.get("title"), scrap.__dict__.get("description"))
+
+
+def remember_indexed(scrap):
+    scrap._indexed_values = _indexed_values(scrap)
+
+
+def needs_reindex(scrap, update_fields):
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return False
+    return getattr(scrap, "_indexed_values", None) != _indexed_values(scrap)
+
+
+def rebuild_search_index(read_files=False):
+    if read_files:
+        for scrap in Scrap.objects.filter(file_type="text").only("id", "file", "file_type").iterator():
+            Scrap.objects.filter(pk=scrap.pk).update(text_content=read_text_content(scrap))
+    if uses_tsvector():
+        return Scrap.objects.update(search_vector=search_vector())
+    return Scrap.objects.count()
+
+
+def text_search(scraps, q):
+    """
+    scraps matching q, annotated with rank (higher is better)
+    """
+    if uses_tsvector():
+        query = SearchQuery(q, search_type="websearch", config=get_search_config())
+        # double precision, so ranks survive the round trip through a cursor
+        return scraps.filter(search_vector=query).annotate(
+            rank=Cast(SearchRank(F("search_vector"), query), FloatField()))
+
+    words = q.split()
+    for word in words:
+        scraps = scraps.filter(
+            Q(title__icontains=word) | Q(description__icontains=word)
+            | Q(text_content__icontains=word))
+
+    weights = {"title": 1.0, "description": 0.4, "text_content": 0.1}
+    rank = Value(0.0)
+    for field, weight in weights.items():
+        for word in words:
+            rank = rank + Case(
+                When(**{f"{field}__icontains": word}, then=Value(weight)),
+                default=Value(0.0), output_field=FloatField())
+    return scraps.annotate(rank=rank)
@@ -0,0 +1,124 @@
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+from gallery.cache import invalidate_scrap
+from gallery.counters import bump, refresh_likes
+from gallery.models import Scrap, Comment, Tag
+from gallery.scores import refresh_scores
+from gallery.search import needs_reindex, remember_indexed, update_search_index
+from gallery.timeline import follow, publish, unfollow
+from profiles.models import Follow
+
+
+@receiver(post_save, sender=Comment)
+def post_save_count_comment(sender, instance, created, **kwargs):
+    if created:
+        bump(Scrap, instance.scrap_id, "num_comments", 1)
+        bump(Comment, instance.reply_to_id, "num_replies", 1)
+        refresh_scores([instance.scrap_id], create=False)
+
+
+@receiver(post_delete, sender=Comment)
+def post_delete_count_comment(sender, instance, **kwargs):
+    bump(Scrap, instance.scrap_id, "num_comments", -1)
+    bump(Comment, instance.reply_to_id, "num_replies", -1)
+    refresh_scores([instance.scrap_id], create=False)
+
+
+# hot feed scores, see gallery/scores.py
+# (likes and comments refresh them along with the counters)
+@receiver(post_save, sender=Scrap)
+def post_save_score_scrap(sender, instance, created, **kwargs):
+    if created:
+        refresh_scores([instance.pk])
+
+
+# full-text search index, see gallery/search.py
+@receiver(post_init, sender=Scrap)
+def post_init_index_scrap(sender, instance, **kwargs):
+    remember_indexed(instance)
+
+
+@receiver(post_save, sender=Scrap)
+def post_save_index_scrap(sender, instance, created, update_fields, **kwargs):
+    if created:
+        update_search_index(instance, read_file=True)
+    elif needs_reindex(instance, update_fields):
+        update_search_index(instance)
+
+
+# home timelines, see gallery/timeline.py
+@receiver(post_save, sender=Scrap)
+def post_save_publish_scrap(sender, instance, created, **kwargs):
+    if created:
+        publish(instance)
+
+
+@receiver(post_save, sender=Follow)
+def post_save_follow(sender, instance, created, **kwargs):
+    if created:
+        follow(instance.follower_id, instance.followee_id)
+
+
+@receiver(post_delete, sender=Follow)
+def post_delete_follow(sender, instance, **kwargs):
+    unfollow(instance.follower_id, instance.followee_id)
+
+
+# response cache invalidation, see gallery/cache.py
+@receiver(post_save, sender=Scrap)
+@receiver(post_delete, sender=Scrap)
+def invalidate_cached_scrap(sender, instance, **kwargs):
+    invalidate_scrap(instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_cached_tag(sender, instance, **kwargs):
+    # bulk deletes (views.remove_tags) invalidate once for all their rows
+    if isinstance(kwargs.get("origin"), QuerySet):
+        return
+    invalidate_scrap(instance.scrap_id, [instance.label.name])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_cached_comment(sender, instance, **kwargs):
+    # num_comments shows up everywhere the scrap does
+    invalidate_scrap(instance.scrap_id)
+
+
+@receiver(m2m_changed, sender=Scrap.likers.through)
+@receiver(m2m_changed, sender=Comment.likers.through)
+def m2m_changed_likes(sender, instance, action, reverse, model, pk_set, **kwargs):
+    liked = Scrap if sender is Scrap.likers.through else Comment
+    stash = f"_cleared_{liked.__name__.lower()}_likes"
+
+    if action == "pre_clear" and reverse:
+        # user.scrap_likes.clear() doesn't say which rows it touches
+        setattr(instance, stash, list(
+            sender.objects.filter(user=instance).values_list(
+                f"{liked.__name__.lower()}_id", flat=True)
+        ))
+        return
+    elif action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        # scrap.likers.add(user)
+        pks = [instance.pk]
+    elif action == "post_clear":
+        pks = instance.__dict__.pop(stash, [])
+    else:
+        # user.scrap_likes.add(scrap)
+        pks = list(pk_set)
+
+    refresh_likes(liked, pks)
+
+    if liked is Scrap:
+        refresh_scores(pks, create=False)
+        sids = pks
+    else:
+        sids = Comment.objects.filter(pk__in=pks).values_list("scrap_id", flat=True)
+    for sid in set(sids):
+        invalidate_scrap(sid)
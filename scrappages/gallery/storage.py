@@ -0,0 +1,101 @@
+import hashlib
+import os
+import uuid
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import F
+
+# content-addressed, deduplicating media storage (MEDIA_DEDUP = True)
+#
+# uploads are hashed (sha256, streamed chunk by chunk) and stored once under
+#   blobs/<h[:2]>/<h[2:4]>/<h>.<ext>
+# however many scraps/profiles use the same bytes; gallery.models.Blob counts
+# the references and the file is only removed when the last one is deleted
+#
+# since a name always means the same bytes, these URLs never go stale
+
+BLOB_DIR = "blobs"
+
+
+def blob_name(digest, ext):
+    return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + "/")
+
+
+class DedupFileSystemStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # the final name comes from the content, see _save()
+        return name
+
+    def _hash(self, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _write(self, name, content):
+        # write to a temporary file next to the blob, then rename it into
+        # place, so a concurrent reader never sees half a blob
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        ext = os.path.splitext(name)[1].lower()
+        name = blob_name(self._hash(content), ext)
+
+        with transaction.atomic():
+            blob, created = Blob.objects.select_for_update().get_or_create(
+                name=name, defaults={"size": content.size})
+            # a duplicate upload costs a hash, not a write
+            if created or not self.exists(name):
+                self._write(name, content)
+            Blob.objects.filter(name=name).update(refs=F("refs") + 1)
+        return name
+
+    def delete(self, name):
+        if not is_blob(name):
+            # stored before MEDIA_DEDUP was turned on
+            return super().delete(name)
+
+        from .models import Blob
+
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refs > 1:
+                Blob.objects.filter(name=name).update(refs=F("refs") - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+
+def select_media_storage():
+    """
+    storage for uploaded media: deduplicating if MEDIA_DEDUP is on
+    """
+    if getattr(settings, "MEDIA_DEDUP", False):
+        return DedupFileSystemStorage()
+    return default_storage
@@ -0,0 +1,64 @@
+import itertools
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+# streaming mode for the list endpoints (?stream=1)
+#
+# instead of building the whole list and rendering it in one go, the rows
+# are read from the database chunk by chunk (QuerySet.iterator) and written
+# out as elements of a JSON array, so memory stays flat however long the
+# list is and the first bytes go out right away
+#
+# streamed lists are not paginated
+
+
+def wants_stream(request):
+    return request.query_params.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def get_chunk_size():
+    return getattr(settings, "STREAM_CHUNK_SIZE", 500)
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _render_array(rows, serialize, chunk_size, prepare=None):
+    # same encoder and separators as the regular JSONRenderer responses
+    renderer = JSONRenderer()
+    yield b"["
+    first = True
+    for chunk in _chunks(rows, chunk_size):
+        if prepare is not None:
+            chunk = prepare(chunk)
+
+        buffer = []
+        for row in chunk:
+            if not first:
+                buffer.append(b",")
+            buffer.append(renderer.render(serialize(row)))
+            first = False
+        yield b"".join(buffer)
+    yield b"]"
+
+
+def stream_json(queryset, serialize, prepare=None):
+    """
+    StreamingHttpResponse with the JSON array [serialize(row) for row in queryset]
+    the queryset should already be ordered
+    prepare(rows), if given, is called on every chunk of rows before they're
+    serialized (e.g. gallery.likes.mark_liked) and returns the rows to use
+    """
+    chunk_size = get_chunk_size()
+    rows = queryset.iterator(chunk_size=chunk_size)
+    return StreamingHttpResponse(
+        _render_array(rows, serialize, chunk_size, prepare),
+        content_type="application/json"
+    )
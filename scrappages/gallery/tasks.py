@@ -0,0 +1,40 @@
+from PIL import Image
+from jobs.queue import task
+from .imaging import generate_variants
+from .models import Scrap
+from .timeline import fan_out
+
+
+@task("gallery.process_scrap_upload")
+def process_scrap_upload(scrap_id):
+    """
+    full decode of an uploaded image, then its resized variants
+    """
+    scrap = Scrap.objects.filter(id=scrap_id).first()
+    if scrap is None:
+        # deleted before we got to it
+        return
+
+    try:
+        with scrap.file.open("rb") as f:
+            with Image.open(f) as im:
+                im.verify()
+        # verify() doesn't decode the pixel data, rendering the variants does
+        generate_variants(scrap)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        scrap.status = "failed"
+        scrap.save(update_fields=["status", "time_updated"])
+        return
+
+    scrap.status = "ready"
+    scrap.save(update_fields=["status", "time_updated"])
+
+
+@task("gallery.fan_out_scrap")
+def fan_out_scrap(scrap_id):
+    """
+    copies a new scrap into the home timelines of its author's followers
+    """
+    scrap = Scrap.objects.filter(id=scrap_id).first()
+    if scrap is not None:
+        fan_out(scrap)
@@ -3,7 +3,14 @@ from PIL import Image
 from io import BytesIO
 import os
 import pytest
-from gallery.models import Scrap, Comment, Tag
+from gallery.cache import get_cache
+from gallery.models import Scrap, Comment, Tag, get_tag_label
+
+@pytest.fixture(autouse=True)
+def clear_gallery_cache():
+    # ids get reused between tests, cached responses must not be
+    get_cache().clear()
+    yield
 
 @pytest.fixture
 def new_user(db, django_user_model):
@@ -48,7 +55,7 @@ def new_reply(db, new_user, new_comment):
 @pytest.fixture
 def new_tag(db, new_scrap):
     tag = Tag.objects.create(
-        name="Oregon",
+        label=get_tag_label("Oregon"),
         scrap=new_scrap
     )
     yield tag
@@ -196,11 +203,11 @@ def tags1(scrap1):
     tags = []
 
     tags.append(Tag.objects.create(
-        name="yellow",
+        label=get_tag_label("yellow"),
         scrap=scrap1
     ))
     tags.append(Tag.objects.create(
-        name="pic",
+        label=get_tag_label("pic"),
         scrap=scrap1
     ))
     
@@ -210,15 +217,15 @@ def tags1(scrap1):
 def tags2(scrap2):
     tags = []
     tags.append(Tag.objects.create(
-        name="pic",
+        label=get_tag_label("pic"),
         scrap=scrap2
     ))
     tags.append(Tag.objects.create(
-        name="cyan",
+        label=get_tag_label("cyan"),
         scrap=scrap2
     ))
     tags.append(Tag.objects.create(
-        name="aqua",
+        label=get_tag_label("aqua"),
         scrap=scrap2
     ))
     
@@ -1,13 +1,32 @@
 from django.conf import settings
+from django.core.management import call_command
 from django.core.files.base import ContentFile
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.test.client import encode_multipart, BOUNDARY, MULTIPART_CONTENT
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.http import HttpResponse
 from PIL import Image
+from io import BytesIO
+import asyncio
+import base64
+import datetime
 import json
 import os
 import pytest
-from gallery.models import Scrap, Comment, Tag
+from asgiref.sync import async_to_sync
+from gallery import async_views, timeline
+from gallery.likes import like
+from gallery.models import Scrap, Comment, Tag, ScrapScore, get_tag_label
+from jobs.models import Job
+from profiles.models import Follow
+from jobs.queue import run_pending
+from django.db import connections
+from gallery.cache import get_cache
+from scrappages.replicas import (
+    FILL_PIN_KEY, PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter, acache_fills_pinned, get_pin_cache,
+    pin_cache_fills, pin_user, primary_reads, routing_for)
 
 # scraps (GET, POST)
 def test_scraps_get(client, scrap1, scrap2, scrap3):
@@ -71,6 +90,128 @@ def test_scraps_get_with_comments_and_tags(client, like_scrap1, comment1, commen
     assert {'name': 'pic','scrap_id': like_scrap1.id} in results[0]['tags']
     assert {'name': 'yellow','scrap_id': like_scrap1.id} in results[0]['tags']
 
+def get_link(response, rel):
+    # pull the URL for rel out of the Link header
+    if not response.has_header('Link'):
+        return None
+    for link in response['Link'].split(', '):
+        url, link_rel = link.split('; ')
+        if link_rel == f'rel="{rel}"':
+            return url[1:-1]
+    return None
+
+def test_scraps_get_paginated(client, scrap1, scrap2, scrap3):
+    response = client.get(
+        reverse(
+            'scraps'
+        ),
+        {'page_size': 2}
+    )
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in results] == [scrap3.id, scrap2.id]
+    assert get_link(response, 'prev') is None
+
+    next_url = get_link(response, 'next')
+    assert next_url is not None
+    response = client.get(next_url)
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in results] == [scrap1.id]
+    assert get_link(response, 'next') is None
+
+    prev_url = get_link(response, 'prev')
+    assert prev_url is not None
+    response = client.get(prev_url)
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in results] == [scrap3.id, scrap2.id]
+    assert get_link(response, 'prev') is None
+    assert get_link(response, 'next') is not None
+
+def test_scraps_get_same_time_updated(client, scrap1, scrap2, scrap3):
+    # ties on time_updated are broken by id
+    Scrap.objects.update(time_updated=scrap1.time_updated)
+
+    seen = []
+    url = reverse('scraps') + '?page_size=1'
+    while url is not None:
+        response = client.get(url)
+        assert response.status_code == 200
+        seen += [r['id'] for r in json.loads(response.content.decode('utf-8'))]
+        url = get_link(response, 'next')
+    assert seen == [scrap3.id, scrap2.id, scrap1.id]
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('params, message', [
+    ({'page_size': 0}, 'Invalid; page_size must be a positive integer'),
+    ({'page_size': 'lots'}, 'Invalid; page_size must be a positive integer'),
+    ({'cursor': 'not-a-cursor'}, 'Invalid; malformed cursor'),
+])
+def test_scraps_get_invalid_pagination(client, params, message):
+    response = client.get(
+        reverse(
+            'scraps'
+        ),
+        params
+    )
+    assert response.status_code == 400
+    assert json.loads(response.content.decode('utf-8')) == message
+
+def make_scraps(user, n):
+    # n text scraps, each with a couple of tags, a comment and a like
+    scraps = []
+    for i in range(n):
+        scrap = Scrap.objects.create(
+            user=user,
+            title=f"scrap {i}",
+            file=ContentFile(f"scrap {i}", f"scrap{i}.txt"),
+            file_type="text"
+        )
+        Tag.objects.create(label=get_tag_label("bulk"), scrap=scrap)
+        Tag.objects.create(label=get_tag_label(f"bulk{i}"), scrap=scrap)
+        Comment.objects.create(user=user, scrap=scrap, content="hi")
+        scrap.likers.add(user)
+        scraps.append(scrap)
+    return scraps
+
+def count_queries(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(queries)
+
+@pytest.mark.parametrize('url_name, kwargs', [
+    ('scraps', {}),
+    ('tagged_scraps', {'tname': 'bulk'}),
+])
+def test_scraps_get_constant_queries(client, user1, url_name, kwargs,
+                                    django_capture_on_commit_callbacks):
+    url = reverse(url_name, kwargs=kwargs)
+    scraps = make_scraps(user1, 1)
+    few = count_queries(client, url)
+
+    # cache invalidation waits for the commit
+    with django_capture_on_commit_callbacks(execute=True):
+        scraps += make_scraps(user1, 5)
+    many = count_queries(client, url)
+    assert few == many
+
+    for scrap in scraps:
+        os.unlink(scrap.file.path)
+
+def test_scrap_comments_get_constant_queries(client, user1, user2, scrap1,
+                                            django_capture_on_commit_callbacks):
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id})
+    Comment.objects.create(user=user1, scrap=scrap1, content="one")
+    few = count_queries(client, url)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        for i in range(5):
+            Comment.objects.create(user=user2, scrap=scrap1, content=f"more {i}")
+    many = count_queries(client, url)
+    assert few == many
+
 def test_scraps_post(client, new_user, violet_jpg):
     logged_in = client.login(username='bison', password='calf123!')
     assert logged_in
@@ -106,10 +247,67 @@ def test_scraps_post(client, new_user, violet_jpg):
         assert result['tags'][i]['name'] in ['violet', 'pic', 'helloworld']
         assert result['tags'][i]['scrap_id'] == result['id']
 
+    # the image is verified and resized by a background job
+    assert result['status'] == 'processing'
+    assert result['thumbnail_url'] is None
+    assert Job.objects.filter(name='gallery.process_scrap_upload', status=Job.QUEUED).count() == 1
+    assert run_pending() == 1
+
+    response = client.get(reverse('specific_scrap', kwargs={'sid': result['id']}))
+    result = json.loads(response.content.decode('utf-8'))
+    assert result['status'] == 'ready'
+    for variant in ['thumbnail_url', 'medium_url', 'webp_url']:
+        assert result[variant].startswith('http')
+        assert os.path.dirname(result[variant]) == os.path.dirname(result['file_url'])
+
     scrap = get_object_or_404(Scrap, id=result['id'])
-    os.unlink(scrap.file.path)
+    scrap.delete()
     
 
+def test_scraps_post_image_fails_verification(client, new_user):
+    logged_in = client.login(username='bison', password='calf123!')
+    assert logged_in
+
+    # a valid header with the image data cut off gets past the upload request
+    img_io = BytesIO()
+    Image.effect_noise((500, 500), 64).save(img_io, format="JPEG")
+    broken = ContentFile(img_io.getvalue()[:len(img_io.getvalue()) // 2], 'brokenfile.jpg')
+    response = client.post(
+        reverse(
+            'scraps'
+        ),
+        data={'title': 'broken', 'file': broken},
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert result['status'] == 'processing'
+
+    run_pending()
+    scrap = get_object_or_404(Scrap, id=result['id'])
+    assert scrap.status == 'failed'
+    assert not scrap.thumbnail
+    scrap.delete()
+
+def test_scraps_post_text_has_no_variants(client, new_user, txt_file):
+    logged_in = client.login(username='bison', password='calf123!')
+    assert logged_in
+
+    response = client.post(
+        reverse(
+            'scraps'
+        ),
+        data={'title': 'words', 'file': txt_file},
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert result['thumbnail_url'] is None
+    assert result['medium_url'] is None
+    assert result['webp_url'] is None
+
+    get_object_or_404(Scrap, id=result['id']).delete()
+
 @pytest.mark.django_db
 def test_scraps_post_not_logged_in(client, violet_jpg):
     assert '_auth_user_id' not in client.session
@@ -300,6 +498,28 @@ def test_specific_scrap_put(client, user1, scrap1):
         assert result['tags'][i]['name'] in ['purple', 'violet', 'pic']
         assert result['tags'][i]['scrap_id'] == scrap1.id
 
+def test_specific_scrap_put_keeps_job_fields(client, monkeypatch, user1, scrap1):
+    Scrap.objects.filter(id=scrap1.id).update(status="processing")
+
+    # the upload job finishes after the PUT loaded the scrap
+    def load_then_process(*args, **kwargs):
+        scrap = get_object_or_404(*args, **kwargs)
+        Scrap.objects.filter(id=scrap1.id).update(status="ready", thumbnail="thumb.jpg")
+        return scrap
+    monkeypatch.setattr("gallery.views.get_object_or_404", load_then_process)
+
+    client.force_login(user1)
+    response = client.put(
+        reverse('specific_scrap', kwargs={'sid': scrap1.id}),
+        data={'title': 'violet'},
+        content_type='application/json'
+    )
+    assert response.status_code == 200
+
+    scrap = Scrap.objects.get(id=scrap1.id)
+    assert scrap.title == 'violet'
+    assert scrap.status == 'ready' and scrap.thumbnail == 'thumb.jpg'
+
 @pytest.mark.parametrize("title, message", [
     ('', 'Invalid; Title too short; minimum length = 1'),
     ('my title was rejected yet again so i must now recover my lost sense of pride and go to deviantart in order to finally get the respect that i deserve, and i cannot live with the man whom i cannot respect bc he does not like airplanes',
@@ -429,6 +649,103 @@ def test_scrap_comments_does_not_exist(client):
     )
     assert response.status_code == 404
 
+def test_scrap_comments_get_tree(client, user1, user2, scrap1, comment1, comment2, reply1):
+    nested = Comment.objects.create(user=user1, scrap=scrap1, content="deeper", reply_to=reply1)
+    response = client.get(
+        reverse('scrap_comments', kwargs={'sid': scrap1.id}),
+        {'tree': 1}
+    )
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+
+    # oldest first at every level
+    assert [c['id'] for c in results] == [comment1.id, comment2.id]
+    assert results[0]['user'] == 'pooky' and results[0]['num_replies'] == 1
+    assert [c['id'] for c in results[0]['replies']] == [reply1.id]
+    assert [c['id'] for c in results[0]['replies'][0]['replies']] == [nested.id]
+    assert results[0]['replies'][0]['replies'][0]['replies'] == []
+    assert results[1]['replies'] == []
+    assert not results[0]['more_replies'] and not results[1]['more_replies']
+
+def test_scrap_comments_get_tree_depth_and_parent(client, scrap1, comment1, comment2, reply1):
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id})
+    response = client.get(url, {'tree': 1, 'depth': 0})
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [comment1.id, comment2.id]
+    assert results[0]['replies'] == [] and results[0]['more_replies']
+
+    # the part that was left out
+    response = client.get(url, {'tree': 1, 'parent': comment1.id})
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [reply1.id]
+
+def test_scrap_comments_get_tree_paginated(client, user1, scrap1):
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id})
+    top = [Comment.objects.create(user=user1, scrap=scrap1, content=f"top {i}") for i in range(3)]
+    replies = [
+        Comment.objects.create(user=user1, scrap=scrap1, content=f"reply {i}", reply_to=top[0])
+        for i in range(3)
+    ]
+
+    response = client.get(url, {'tree': 1, 'page_size': 2})
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [top[0].id, top[1].id]
+    assert [c['id'] for c in results[0]['replies']] == [replies[0].id, replies[1].id]
+    assert results[0]['more_replies']
+    assert 'after=2' in response['Link'] and 'rel="next"' in response['Link']
+
+    response = client.get(url, {'tree': 1, 'page_size': 2, 'after': 2})
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [top[2].id]
+    assert not response.has_header('Link')
+
+    response = client.get(url, {'tree': 1, 'page_size': 2, 'after': 2, 'parent': top[0].id})
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [replies[2].id]
+
+def test_scrap_comments_get_tree_page_ends_before_replies(client, scrap1, comment1, comment2, reply1):
+    # the first comment on the next page has replies
+    nested = Comment.objects.create(user=reply1.user, scrap=scrap1, content="deeper", reply_to=reply1)
+    Comment.objects.filter(id=comment1.id).update(time_posted=comment2.time_posted + datetime.timedelta(seconds=1))
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id})
+
+    response = client.get(url, {'tree': 1, 'page_size': 1})
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [comment2.id]
+    assert 'after=1' in response['Link']
+
+    response = client.get(url, {'tree': 1, 'page_size': 1, 'after': 1})
+    results = json.loads(response.content.decode('utf-8'))
+    assert [c['id'] for c in results] == [comment1.id]
+    assert [c['id'] for c in results[0]['replies'][0]['replies']] == [nested.id]
+
+def test_scrap_comments_get_tree_constant_queries(client, user1, user2, scrap1):
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id}) + '?tree=1'
+    # logged in, so the response isn't served from the cache
+    client.force_login(user1)
+    parent = Comment.objects.create(user=user1, scrap=scrap1, content="one")
+    few = count_queries(client, url)
+
+    for i in range(5):
+        parent = Comment.objects.create(user=user2, scrap=scrap1, content=f"more {i}", reply_to=parent)
+    many = count_queries(client, url)
+    assert few == many
+
+@pytest.mark.parametrize('params, message', [
+    ({'depth': -1}, 'Invalid; depth must be a non-negative integer'),
+    ({'after': 'x'}, 'Invalid; after must be a non-negative integer'),
+    ({'parent': 'x'}, 'Invalid; parent must be a comment on this scrap'),
+    ({'parent': 1000}, 'Invalid; parent must be a comment on this scrap'),
+])
+def test_scrap_comments_get_tree_invalid(client, scrap1, params, message):
+    response = client.get(
+        reverse('scrap_comments', kwargs={'sid': scrap1.id}),
+        {'tree': 1, **params}
+    )
+    assert response.status_code == 400
+    assert json.loads(response.content.decode('utf-8')) == message
+
 def test_scrap_comments_post(client, user1, scrap1):
     logged_in = client.login(username='pooky', password='pooky123')
     assert logged_in
@@ -1151,3 +1468,768 @@ def test_tagged_scraps_tag_does_not_exist(client, scrap1, scrap2, scrap3):
     assert response.status_code == 200
     results = json.loads(response.content.decode('utf-8'))
     assert len(results) == 0
+
+def test_tagged_scraps_get_paginated(client, scrap1, scrap2, scrap3, tags1, tags2):
+    response = client.get(
+        reverse(
+            'tagged_scraps',
+            kwargs={'tname': 'pic'}
+        ),
+        {'page_size': 1}
+    )
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in results] == [scrap2.id]
+
+    response = client.get(get_link(response, 'next'))
+    assert response.status_code == 200
+    results = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in results] == [scrap1.id]
+    assert get_link(response, 'next') is None
+
+# response cache
+def test_scraps_get_cached(client, scrap1, scrap2):
+    url = reverse('scraps')
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response['X-Cache'] == 'MISS'
+    first = json.loads(response.content.decode('utf-8'))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response['X-Cache'] == 'HIT'
+    assert len(queries) == 0
+    assert json.loads(response.content.decode('utf-8')) == first
+
+def test_specific_scrap_cached(client, scrap1):
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    assert client.get(url)['X-Cache'] == 'MISS'
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response['X-Cache'] == 'HIT'
+    assert len(queries) == 0
+
+def test_cache_keyed_by_host(client, settings, scrap1):
+    settings.ALLOWED_HOSTS = ['testserver', '127.0.0.1']
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    response = client.get(url)
+    assert json.loads(response.content.decode('utf-8'))['file_url'].startswith('http://testserver/')
+
+    # the body holds absolute URLs
+    response = client.get(url, secure=True, HTTP_HOST='127.0.0.1')
+    assert response['X-Cache'] == 'MISS'
+    assert json.loads(response.content.decode('utf-8'))['file_url'].startswith('https://127.0.0.1/')
+
+@pytest.mark.parametrize('url_name', ['scraps', 'specific_scrap', 'scrap_comments', 'tagged_scraps'])
+def test_cached_responses_invalidated(client, user1, scrap1, comment1, tags1, url_name,
+                                      django_capture_on_commit_callbacks):
+    committed = lambda: django_capture_on_commit_callbacks(execute=True)
+    kwargs = {'tname': 'pic'} if url_name == 'tagged_scraps' else {'sid': scrap1.id}
+    if url_name == 'scraps':
+        kwargs = {}
+    url = reverse(url_name, kwargs=kwargs)
+
+    assert client.get(url)['X-Cache'] == 'MISS'
+    assert client.get(url)['X-Cache'] == 'HIT'
+
+    # like
+    with committed():
+        scrap1.likers.add(user1)
+    assert client.get(url)['X-Cache'] == 'MISS'
+    assert client.get(url)['X-Cache'] == 'HIT'
+
+    # comment
+    with committed():
+        Comment.objects.create(user=user1, scrap=scrap1, content="again")
+    assert client.get(url)['X-Cache'] == 'MISS'
+    assert client.get(url)['X-Cache'] == 'HIT'
+
+    # tag
+    with committed():
+        Tag.objects.create(label=get_tag_label("again"), scrap=scrap1)
+    assert client.get(url)['X-Cache'] == 'MISS'
+    assert client.get(url)['X-Cache'] == 'HIT'
+
+    # scrap
+    scrap1.title = "again"
+    with committed():
+        scrap1.save()
+    response = client.get(url)
+    assert response['X-Cache'] == 'MISS'
+
+def test_cache_invalidated_on_commit(client, user1, scrap1, django_capture_on_commit_callbacks):
+    # until the writer commits, readers still see the old rows
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    assert client.get(url)['X-Cache'] == 'MISS'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        scrap1.likers.add(user1)
+        assert client.get(url)['X-Cache'] == 'HIT'
+    assert client.get(url)['X-Cache'] == 'MISS'
+
+def test_cached_responses_untouched_by_other_scraps(client, user1, scrap1, scrap2):
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    assert client.get(url)['X-Cache'] == 'MISS'
+
+    scrap2.likers.add(user1)
+    Tag.objects.create(label=get_tag_label("elsewhere"), scrap=scrap2)
+    assert client.get(url)['X-Cache'] == 'HIT'
+
+def test_cache_skipped_when_logged_in(client, user1, scrap1):
+    logged_in = client.login(username='pooky', password='pooky123')
+    assert logged_in
+
+    response = client.get(reverse('scraps'))
+    assert response.status_code == 200
+    assert not response.has_header('X-Cache')
+
+def test_cache_stats(client, admin_client, scrap1):
+    client.get(reverse('scraps'))
+    client.get(reverse('scraps'))
+    client.get(reverse('scraps'))
+
+    response = admin_client.get(reverse('cache_stats'))
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert result['hits'] == 2
+    assert result['misses'] == 1
+
+    response = client.get(reverse('cache_stats'))
+    assert response.status_code in [401, 403]
+
+# conditional GET
+def test_specific_scrap_not_modified(client, user1, scrap1):
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response['ETag']
+    last_modified = response['Last-Modified']
+
+    # the version came with the cached response
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert len(queries) == 0
+    assert response.content == b''
+
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 304
+
+def test_specific_scrap_etag_changes(client, user1, scrap1, django_capture_on_commit_callbacks):
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    etag = client.get(url)['ETag']
+
+    # the version is cached along with the responses
+    with django_capture_on_commit_callbacks(execute=True):
+        scrap1.likers.add(user1)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    etag = response['ETag']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Comment.objects.create(user=user1, scrap=scrap1, content="new")
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    logged_in = client.login(username='pooky', password='pooky123')
+    assert logged_in
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(
+            reverse('scrap_tags', kwargs={'sid': scrap1.id}),
+            data={'tag': 'fresh'}
+        )
+    assert response.status_code == 200
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert {'name': 'fresh', 'scrap_id': scrap1.id} in json.loads(response.content.decode('utf-8'))['tags']
+
+# streaming lists
+@pytest.mark.parametrize('url_name, kwargs', [
+    ('scraps', {}),
+    ('tagged_scraps', {'tname': 'pic'}),
+])
+def test_scraps_get_stream(client, settings, scrap1, scrap2, scrap3, tags1, tags2, url_name, kwargs):
+    settings.STREAM_CHUNK_SIZE = 1
+    url = reverse(url_name, kwargs=kwargs)
+
+    response = client.get(url, {'stream': 1, 'page_size': 1})
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Type'] == 'application/json'
+    streamed = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    # not paginated, same elements as the regular response
+    regular = json.loads(client.get(url).content.decode('utf-8'))
+    assert streamed == regular
+
+def test_scrap_comments_get_stream(client, scrap1, comment1, comment2, reply1):
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id})
+    response = client.get(url, {'stream': 'true'})
+    assert response.status_code == 200
+    assert response.streaming
+    streamed = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+    assert [c['id'] for c in streamed] == [reply1.id, comment2.id, comment1.id]
+    assert streamed == json.loads(client.get(url).content.decode('utf-8'))
+
+@pytest.mark.django_db
+def test_scraps_get_stream_empty(client):
+    response = client.get(reverse('scraps'), {'stream': 1})
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == b'[]'
+
+# liked_by_me, see gallery/likes.py
+@pytest.mark.parametrize('url_name, kwargs', [
+    ('scraps', {}),
+    ('tagged_scraps', {'tname': 'pic'}),
+])
+def test_scraps_get_liked_by_me(client, settings, user1, user2, scrap1, scrap2, scrap3, tags1, tags2, url_name, kwargs):
+    url = reverse(url_name, kwargs=kwargs)
+    scrap1.likers.add(user1)
+    scrap2.likers.add(user2)
+
+    results = json.loads(client.get(url).content.decode('utf-8'))
+    assert results and not any(r['liked_by_me'] for r in results)
+
+    client.force_login(user1)
+    results = json.loads(client.get(url).content.decode('utf-8'))
+    assert [r['id'] for r in results if r['liked_by_me']] == [scrap1.id]
+
+    settings.STREAM_CHUNK_SIZE = 1
+    response = client.get(url, {'stream': 1})
+    assert json.loads(b''.join(response.streaming_content).decode('utf-8')) == results
+
+def test_scrap_comments_get_liked_by_me(client, user1, scrap1, comment1, comment2, reply1):
+    url = reverse('scrap_comments', kwargs={'sid': scrap1.id})
+    comment2.likers.add(user1)
+    reply1.likers.add(user1)
+    client.force_login(user1)
+
+    results = json.loads(client.get(url).content.decode('utf-8'))
+    assert {r['id']: r['liked_by_me'] for r in results} == {
+        comment1.id: False, comment2.id: True, reply1.id: True}
+
+    results = json.loads(client.get(url, {'tree': 1}).content.decode('utf-8'))
+    assert [r['liked_by_me'] for r in results] == [False, True]
+    assert results[0]['replies'][0]['liked_by_me']
+
+def test_scraps_get_liked_by_me_one_query(client, user1, scrap1, scrap2, scrap3):
+    for scrap in [scrap1, scrap2, scrap3]:
+        scrap.likers.add(user1)
+    client.force_login(user1)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('scraps'))
+    assert all(r['liked_by_me'] for r in json.loads(response.content.decode('utf-8')))
+    assert len([q for q in queries if 'likers' in q['sql']]) == 1
+
+# media serving, see gallery/media.py
+def test_media_serve(client, scrap3):
+    response = client.get(scrap3.file.url)
+    assert response.status_code == 200
+    assert b"".join(response.streaming_content) == b"black"
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Cache-Control'] == 'public, no-cache'
+
+    response = client.get(scrap3.file.url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+    response = client.get('/media/../manage.py')
+    assert response.status_code == 404
+
+def test_media_range(client, scrap3):
+    response = client.get(scrap3.file.url, HTTP_RANGE='bytes=1-3')
+    assert response.status_code == 206
+    assert b"".join(response.streaming_content) == b"lac"
+    assert response['Content-Range'] == 'bytes 1-3/5'
+    assert response['Content-Length'] == '3'
+
+    response = client.get(scrap3.file.url, HTTP_RANGE='bytes=-2')
+    assert b"".join(response.streaming_content) == b"ck"
+
+    response = client.get(scrap3.file.url, HTTP_RANGE='bytes=9-')
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */5'
+
+    # stale If-Range gets the whole file
+    response = client.get(scrap3.file.url, HTTP_RANGE='bytes=1-3', HTTP_IF_RANGE='"old"')
+    assert response.status_code == 200
+
+def test_media_immutable_urls(client, settings, scrap3):
+    settings.MEDIA_IMMUTABLE_URLS = True
+    response = client.get(reverse('specific_scrap', kwargs={'sid': scrap3.id}))
+    file_url = json.loads(response.content.decode('utf-8'))['file_url']
+    assert '?v=' in file_url
+
+    response = client.get(file_url)
+    assert response.status_code == 200
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    # any other version revalidates
+    response = client.get(scrap3.file.url + '?v=1')
+    assert response['Cache-Control'] == 'public, no-cache'
+
+    # the version changes with the scrap
+    scrap3.title = "Blacker"
+    scrap3.save()
+    scrap = get_object_or_404(Scrap, id=scrap3.id)
+    assert scrap.serialize()['file_url'] != file_url.split('testserver')[-1]
+    response = client.get(file_url)
+    assert response['Cache-Control'] == 'public, no-cache'
+
+def test_media_accel(client, settings, scrap3):
+    settings.MEDIA_ACCEL = 'nginx'
+    response = client.get(scrap3.file.url)
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response['X-Accel-Redirect'] == '/protected-media/' + scrap3.file.name
+
+    # the path is URL-quoted
+    name = os.path.join(os.path.dirname(scrap3.file.path), 'black 100%.txt')
+    with open(name, 'wb') as f:
+        f.write(b"black")
+    response = client.get(os.path.dirname(scrap3.file.url) + '/black%20100%25.txt')
+    assert response['X-Accel-Redirect'] == (
+        '/protected-media/' + os.path.dirname(scrap3.file.name) + '/black%20100%25.txt')
+    os.unlink(name)
+
+    settings.MEDIA_ACCEL = 'sendfile'
+    response = client.get(scrap3.file.url)
+    assert response['X-Sendfile'] == scrap3.file.path
+
+# bulk tags
+def test_scrap_tags_post_bulk(client, scrap1, tags1):
+    logged_in = client.login(username='pooky', password='pooky123')
+    assert logged_in
+
+    url = reverse('scrap_tags', kwargs={'sid': scrap1.id})
+    response = client.post(url, data={'tags': ['pic', 'new tag', 'new_tag', 'blue']},
+                           content_type='application/json')
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert sorted(t['name'] for t in result) == ['blue', 'new_tag', 'pic', 'yellow']
+
+    response = client.post(url, data={'tags': 'pic'}, content_type='application/json')
+    assert response.status_code == 400
+    assert json.loads(response.content.decode('utf-8')) == 'Invalid; tags must be a list'
+
+def test_scrap_tags_put(client, scrap1, tags1):
+    logged_in = client.login(username='pooky', password='pooky123')
+    assert logged_in
+
+    # the anonymous tag page is cached before the change
+    response = client.get(reverse('tagged_scraps', kwargs={'tname': 'yellow'}))
+    assert len(json.loads(response.content.decode('utf-8'))) == 1
+
+    url = reverse('scrap_tags', kwargs={'sid': scrap1.id})
+    response = client.put(url, data={'tags': ['pic', 'lemon']},
+                          content_type='application/json')
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert sorted(t['name'] for t in result) == ['lemon', 'pic']
+
+    client.logout()
+    response = client.get(reverse('tagged_scraps', kwargs={'tname': 'yellow'}))
+    assert json.loads(response.content.decode('utf-8')) == []
+    response = client.get(reverse('tagged_scraps', kwargs={'tname': 'lemon'}))
+    assert len(json.loads(response.content.decode('utf-8'))) == 1
+
+def test_scrap_tags_put_wrong_user(client, user2, scrap1, tags1):
+    logged_in = client.login(username='silver', password='silver123')
+    assert logged_in
+
+    response = client.put(reverse('scrap_tags', kwargs={'sid': scrap1.id}),
+                          data={'tags': []}, content_type='application/json')
+    assert response.status_code == 400
+    assert Tag.objects.filter(scrap=scrap1).count() == 2
+
+def test_scrap_tags_delete_bulk(client, scrap1, tags1):
+    logged_in = client.login(username='pooky', password='pooky123')
+    assert logged_in
+
+    response = client.delete(reverse('scrap_tags', kwargs={'sid': scrap1.id}),
+                             data={'tags': ['pic', 'yellow', 'missing']},
+                             content_type='application/json')
+    assert response.status_code == 200
+    assert not Tag.objects.filter(scrap=scrap1).exists()
+
+def test_scrap_put_tags_constant_queries(client, scrap1):
+    logged_in = client.login(username='pooky', password='pooky123')
+    assert logged_in
+
+    url = reverse('specific_scrap', kwargs={'sid': scrap1.id})
+    counts = []
+    for n in [1, 30]:
+        tags = [f"tag{n}_{i}" for i in range(n)]
+        with CaptureQueriesContext(connection) as queries:
+            response = client.put(url, data={'tags': tags}, content_type='application/json')
+        assert response.status_code == 200
+        counts.append(len(queries))
+    assert counts[0] == counts[1]
+    assert Tag.objects.filter(scrap=scrap1).count() == 31
+
+# tag search
+def search(client, **params):
+    response = client.get(reverse('search_scraps'), params)
+    assert response.status_code == 200
+    return [scrap['id'] for scrap in json.loads(response.content.decode('utf-8'))]
+
+def test_search_scraps(client, scrap1, scrap2, scrap3, tags1, tags2):
+    # scrap1: yellow, pic    scrap2: pic, cyan, aqua    scrap3: none
+    Tag.objects.create(label=get_tag_label("cyan"), scrap=scrap3)
+
+    assert search(client, tags='pic') == [scrap2.id, scrap1.id]
+    assert search(client, tags='pic,cyan') == [scrap2.id]
+    assert search(client, tags='pic,cyan,yellow') == []
+    assert search(client, tags='pic,nobody') == []
+    assert search(client, any='yellow,aqua') == [scrap2.id, scrap1.id]
+    assert search(client, any='nobody') == []
+    assert search(client, tags='cyan', exclude='pic') == [scrap3.id]
+    assert search(client, exclude='pic') == [scrap3.id]
+    assert search(client, tags='pic', any='cyan,yellow', exclude='aqua') == [scrap1.id]
+
+    response = client.get(reverse('search_scraps'), {'tags': 'pic'})
+    result = json.loads(response.content.decode('utf-8'))
+    assert result[0]['num_likes'] == 0 and result[0]['num_comments'] == 0
+    assert len(result[0]['tags']) == 3
+
+def test_search_scraps_invalid(client):
+    response = client.get(reverse('search_scraps'))
+    assert response.status_code == 400
+    assert json.loads(response.content.decode('utf-8')) == 'Required: q, tags, any or exclude'
+
+    response = client.get(reverse('search_scraps'), {'any': ','.join(f't{i}' for i in range(21))})
+    assert response.status_code == 400
+
+def test_search_scraps_paginated_constant_queries(client, user1):
+    scraps = make_scraps(user1, 5)
+    url = reverse('search_scraps') + '?tags=bulk&page_size=2'
+
+    response = client.get(url)
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [scraps[4].id, scraps[3].id]
+    assert get_link(response, 'next') is not None
+
+    # logged in, so the response cache stays out of it
+    client.force_login(user1)
+    few = count_queries(client, reverse('search_scraps') + '?tags=bulk,bulk0')
+    many = count_queries(client, url)
+    assert few == many
+
+def test_search_scraps_text(client, user1, scrap1, scrap2, tags1, tags2):
+    poem = Scrap.objects.create(
+        user=user1,
+        title="Poem",
+        description="about bears",
+        file=ContentFile("the lemon tree sways", "poem.txt"),
+        file_type="text"
+    )
+    assert Scrap.objects.get(id=poem.id).text_content == "the lemon tree sways"
+
+    # scrap1 is "Yellow fellow", scrap2 "Cyan I can"
+    assert search(client, q='yellow') == [scrap1.id]
+    assert search(client, q='lemon') == [poem.id]
+    assert search(client, q='cyan can') == [scrap2.id]
+    assert search(client, q='cyan lemon') == []
+    assert search(client, q='yellow', tags='cyan') == []
+
+    # title matches outrank description matches
+    scrap2.description = "poem"
+    scrap2.save()
+    assert search(client, q='poem') == [poem.id, scrap2.id]
+
+    response = client.get(reverse('search_scraps'), {'q': 'poem', 'page_size': 1})
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [poem.id]
+    response = client.get(get_link(response, 'next'))
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [scrap2.id]
+
+    response = client.get(reverse('search_scraps'), {'q': 'x' * 201})
+    assert response.status_code == 400
+    poem.delete()
+
+# hot feed
+def test_scraps_get_hot(client, user1, user2):
+    old, new = make_scraps(user1, 2)
+    Scrap.objects.filter(id=old.id).update(time_posted=new.time_posted - datetime.timedelta(hours=12))
+    call_command('refresh_scores')
+
+    # same engagement, newer first
+    response = client.get(reverse('scraps'), {'sort': 'hot'})
+    assert response.status_code == 200
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [new.id, old.id]
+
+    # half a day older needs twice the engagement, 1 + likes + 2 * comments
+    # goes from 4 to 9 here
+    old.likers.add(user2)
+    comments = [Comment.objects.create(user=user2, scrap=old, content="hot") for i in range(2)]
+    response = client.get(reverse('scraps'), {'sort': 'hot', 'page_size': 1})
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [old.id]
+    response = client.get(get_link(response, 'next'))
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [new.id]
+
+    # and drops back when it goes
+    for comment in comments:
+        comment.delete()
+    response = client.get(reverse('scraps'), {'sort': 'hot'})
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [new.id, old.id]
+
+    response = client.get(reverse('scraps'), {'sort': 'top'})
+    assert response.status_code == 400
+    assert json.loads(response.content.decode('utf-8')) == 'Invalid; sort must be new or hot'
+
+def test_scraps_get_hot_new_scrap(client, scrap1):
+    assert ScrapScore.objects.filter(scrap=scrap1).exists()
+    response = client.get(reverse('scraps'), {'sort': 'hot', 'stream': 1})
+    assert [s['id'] for s in json.loads(b''.join(response.streaming_content))] == [scrap1.id]
+
+# home timeline
+def home(client, **params):
+    response = client.get(reverse('home_scraps'), params)
+    assert response.status_code == 200
+    return [scrap['id'] for scrap in json.loads(response.content.decode('utf-8'))]
+
+def test_home_timeline(client, user1, user2, scrap1, scrap3):
+    # scrap1 is user1's, scrap3 user2's
+    response = client.get(reverse('home_scraps'))
+    assert response.status_code == 401
+
+    client.force_login(user2)
+    assert home(client) == [scrap3.id]
+
+    # following backfills, the new scraps are fanned out by a job
+    Follow.objects.create(follower=user2.profile, followee=user1.profile)
+    assert home(client) == [scrap3.id, scrap1.id]
+
+    new = make_scraps(user1, 1)[0]
+    assert Job.objects.filter(name='gallery.fan_out_scrap', status=Job.QUEUED).count() == 1
+    assert home(client) == [scrap3.id, scrap1.id]
+    assert run_pending() == 1
+    assert home(client) == [new.id, scrap3.id, scrap1.id]
+
+    response = client.get(reverse('home_scraps'), {'page_size': 2})
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [new.id, scrap3.id]
+    response = client.get(get_link(response, 'next'))
+    assert [s['id'] for s in json.loads(response.content.decode('utf-8'))] == [scrap1.id]
+
+    Follow.objects.get(follower=user2.profile).delete()
+    assert home(client) == [scrap3.id]
+
+def test_home_timeline_fan_out_on_read(client, settings, user1, user2, scrap3):
+    # user1 counts as a big account: their scraps are pulled in on read
+    settings.TIMELINE_FANOUT_MAX_FOLLOWERS = 0
+    settings.TIMELINE_PULL_LAG = 0
+    Follow.objects.create(follower=user2.profile, followee=user1.profile)
+
+    new = make_scraps(user1, 2)
+    assert not Job.objects.filter(name='gallery.fan_out_scrap').exists()
+
+    client.force_login(user2)
+    assert home(client) == [new[1].id, new[0].id, scrap3.id]
+    assert Follow.objects.get(follower=user2.profile).synced_until == new[1].time_posted
+
+    newer = make_scraps(user1, 1)[0]
+    assert home(client, page_size=1) == [newer.id]
+
+def test_home_timeline_pull_burst(client, settings, monkeypatch, user1, user2):
+    # more new scraps than one batch: none of the older ones are skipped
+    settings.TIMELINE_FANOUT_MAX_FOLLOWERS = 0
+    settings.TIMELINE_PULL_LAG = 0
+    monkeypatch.setattr(timeline, "BATCH_SIZE", 2)
+    Follow.objects.create(follower=user2.profile, followee=user1.profile)
+    scraps = make_scraps(user1, 5)
+
+    client.force_login(user2)
+    assert home(client) == [scrap.id for scrap in reversed(scraps)]
+    assert Follow.objects.get(follower=user2.profile).synced_until == scraps[-1].time_posted
+
+    for scrap in scraps:
+        os.unlink(scrap.file.path)
+
+def test_home_timeline_pull_late_commit(client, settings, user1, user2):
+    settings.TIMELINE_FANOUT_MAX_FOLLOWERS = 0
+    Follow.objects.create(follower=user2.profile, followee=user1.profile)
+    scraps = make_scraps(user1, 1)
+
+    client.force_login(user2)
+    assert home(client) == [scraps[0].id]
+    assert Follow.objects.get(follower=user2.profile).synced_until < scraps[0].time_posted
+
+    # saved before the pull, committed after it
+    late = make_scraps(user1, 1)[0]
+    Scrap.objects.filter(id=late.id).update(time_posted=scraps[0].time_posted - datetime.timedelta(seconds=1))
+    assert set(home(client)) == {scraps[0].id, late.id}
+
+    for scrap in scraps + [late]:
+        os.unlink(scrap.file.path)
+
+def test_home_timeline_pull_skipped(client, user1, user2, scrap1):
+    # following no big account: one query, no transaction
+    client.force_login(user2)
+    with CaptureQueriesContext(connection) as queries:
+        timeline.pull(user2)
+    assert len(queries) == 1
+
+# read replicas, see scrappages/replicas.py
+# a second alias for the test database stands in for the replica, as
+# TEST MIRROR does for the real ones; the tests can't run inside a
+# transaction, reads in one always go to the primary
+@pytest.fixture
+def replica(settings):
+    alias = "replica_test"
+    connections.settings[alias] = {
+        **connections["default"].settings_dict, "TEST": {"MIRROR": "default"}}
+    settings.REPLICA_DATABASES = [alias]
+    yield alias
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+    get_pin_cache().clear()
+
+@pytest.mark.django_db(transaction=True, databases='__all__')
+def test_replica_reads(client, user1, scrap1, replica):
+    def read_from():
+        # the aliases the feed was read from
+        get_cache().clear()
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections[replica]) as replicated:
+            response = client.get(reverse('scraps'))
+        assert [s['title'] for s in json.loads(response.content.decode('utf-8'))] == ["Yellow"]
+        return {alias for alias, queries in (("default", primary), (replica, replicated))
+                if any('"gallery_scrap"' in q['sql'] for q in queries)}
+
+    assert read_from() == {replica}
+
+    # after their own write, the client reads from the primary
+    client.force_login(user1)
+    response = client.post(reverse('scrap_like', kwargs={'sid': scrap1.id}))
+    assert response.status_code == 200
+    assert PIN_COOKIE in response.cookies
+    assert read_from() == {"default"}
+
+    # (logging out drops the cookies)
+    # the like dropped the cached feed, whoever refills it reads the primary
+    client.logout()
+    assert read_from() == {"default"}
+
+    # until the pin runs out
+    get_pin_cache().delete(FILL_PIN_KEY)
+    assert read_from() == {replica}
+
+@pytest.mark.django_db(transaction=True, databases='__all__')
+def test_replica_router(rf, user1, replica):
+    router = ReplicaRouter()
+    assert router.db_for_read(Scrap) == "default"
+    assert router.db_for_write(Scrap) == "default"
+
+    request = rf.get('/scraps/')
+    with routing_for(request):
+        assert router.db_for_read(Scrap) == replica
+    with routing_for(rf.post('/scraps/')):
+        assert router.db_for_read(Scrap) == "default"
+
+    # clients that don't keep cookies are pinned by user
+    request.user = user1
+    with routing_for(request):
+        assert router.db_for_read(Scrap) == replica
+    pin_user(user1)
+    with routing_for(request):
+        assert router.db_for_read(Scrap) == "default"
+
+    # refilling the response cache after an invalidation
+    request = rf.get('/scraps/')
+    pin_cache_fills()
+    with routing_for(request):
+        assert router.db_for_read(Scrap) == replica
+        with primary_reads(async_to_sync(acache_fills_pinned)()):
+            assert router.db_for_read(Scrap) == "default"
+        assert router.db_for_read(Scrap) == replica
+    get_pin_cache().delete(FILL_PIN_KEY)
+    with routing_for(request), primary_reads(async_to_sync(acache_fills_pinned)()):
+        assert router.db_for_read(Scrap) == replica
+
+@pytest.mark.django_db
+def test_replica_pin_middleware_async(async_rf, settings):
+    settings.REPLICA_DATABASES = ["replica_1"]
+
+    async def view(request):
+        return HttpResponse()
+    middleware = ReplicaPinMiddleware(view)
+    assert asyncio.iscoroutinefunction(middleware)
+    assert PIN_COOKIE in async_to_sync(middleware)(async_rf.post('/scraps/')).cookies
+    assert PIN_COOKIE not in async_to_sync(middleware)(async_rf.get('/scraps/')).cookies
+
+# native async views, see gallery/async_views.py
+def basic_auth(username, password):
+    token = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+    return f"Basic {token}"
+
+def compare_async(client, async_rf, view, url, auth=None, **kwargs):
+    # the sync view's response and the async view's, which must match
+    # (the async factory takes plain header names)
+    expected = client.get(url, **({"HTTP_AUTHORIZATION": auth} if auth else {}))
+    get_cache().clear()
+    request = async_rf.get(url, **({"authorization": auth} if auth else {}))
+    response = async_to_sync(view)(request, **kwargs)
+    get_cache().clear()
+    assert response.status_code == expected.status_code
+    assert json.loads(response.content) == json.loads(expected.content)
+    for header in ["Link", "ETag", "Last-Modified", "WWW-Authenticate"]:
+        assert response.get(header) == expected.get(header)
+    return response
+
+def test_async_scraps_view(client, async_rf, user1, scrap1, scrap2, scrap3):
+    like(scrap2, user1)
+    url = reverse('scraps')
+    view = async_views.scraps_view
+
+    compare_async(client, async_rf, view, url)
+    compare_async(client, async_rf, view, url + "?page_size=2")
+    compare_async(client, async_rf, view, url + "?sort=hot")
+    compare_async(client, async_rf, view, url + "?sort=old")
+    compare_async(client, async_rf, view, url + "?page_size=0")
+
+    response = compare_async(client, async_rf, view, url, basic_auth("pooky", "pooky123"))
+    assert [s['liked_by_me'] for s in json.loads(response.content)] == [False, True, False]
+
+    # bad credentials
+    response = compare_async(client, async_rf, view, url, basic_auth("pooky", "wrong"))
+    assert response.status_code == 401
+
+def test_async_cache_shared(client, async_rf, scrap1):
+    url = reverse('scraps')
+    assert client.get(url)['X-Cache'] == "MISS"
+    response = async_to_sync(async_views.scraps_view)(async_rf.get(url))
+    assert response['X-Cache'] == "HIT"
+    assert json.loads(response.content) == json.loads(client.get(url).content)
+
+def test_async_specific_scrap_view(client, async_rf, scrap1, new_tag):
+    url = reverse('specific_scrap', kwargs={'sid': new_tag.scrap_id})
+    view = async_views.specific_scrap_view
+    response = compare_async(client, async_rf, view, url, sid=new_tag.scrap_id)
+    assert json.loads(response.content)['tags'][0]['name'] == "Oregon"
+
+    response = async_to_sync(view)(
+        async_rf.get(url, if_none_match=response["ETag"]), sid=new_tag.scrap_id)
+    assert response.status_code == 304
+
+    url = reverse('specific_scrap', kwargs={'sid': 9999})
+    response = compare_async(client, async_rf, view, url, sid=9999)
+    assert response.status_code == 404
+
+def test_async_scrap_comments_view(client, async_rf, user1, comment1, comment2, reply1):
+    sid = comment1.scrap_id
+    url = reverse('scrap_comments', kwargs={'sid': sid})
+    view = async_views.scrap_comments_view
+
+    compare_async(client, async_rf, view, url, basic_auth("pooky", "pooky123"), sid=sid)
+    response = compare_async(client, async_rf, view, url + "?tree=1", sid=sid)
+    assert len(json.loads(response.content)) == 2
+    compare_async(client, async_rf, view, url + "?tree=1&depth=x", sid=sid)
+
+    # writes go to the sync view
+    request = async_rf.post(url, {"content": "async"}, content_type="application/json",
+                            authorization=basic_auth("pooky", "pooky123"))
+    response = async_to_sync(view)(request, sid=sid)
+    assert response.status_code == 200
+    assert Comment.objects.filter(scrap_id=sid, content="async").exists()
@@ -1,11 +1,28 @@
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.shortcuts import get_object_or_404
-from django.db import IntegrityError
+from django.db import IntegrityError, connection, transaction
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.contrib.postgres.search import SearchQuery
+from django.test.utils import CaptureQueriesContext
+from django.db.utils import load_backend
+from PIL import Image
+from io import BytesIO
+from gallery import signals
+from gallery.imaging import generate_variants
+from gallery.likes import like, unlike
+from gallery.search import get_search_config
+from gallery.storage import DedupFileSystemStorage
+from scrappages.postgresql_pool.base import ConnectionPool, DatabaseWrapper as PooledDatabaseWrapper
+import copy
 import os
+import psycopg2.extensions
 import pytest
+import threading
+import time
 import base64
-from gallery.models import get_sentinel_user, Scrap, Comment, Tag
+from gallery.models import get_sentinel_user, get_tag_label, get_tag_labels, Scrap, Comment, Tag, TagLabel, Blob
 
 @pytest.mark.django_db
 def test_get_sentinel_user():
@@ -89,8 +106,8 @@ def test_change_comment(new_comment):
     assert comment.time_posted != comment.time_updated
 
 def test_create_tag(new_scrap, new_tag):
-    assert Tag.objects.filter(name=new_tag.name, scrap=new_tag.scrap).exists()
-    tag = Tag.objects.filter(name=new_tag.name, scrap=new_tag.scrap)[0]
+    assert Tag.objects.filter(label__name="Oregon", scrap=new_tag.scrap).exists()
+    tag = Tag.objects.filter(label__name="Oregon", scrap=new_tag.scrap)[0]
 
     context = tag.serialize()
     assert "name" in context and context["name"] == "Oregon"
@@ -98,9 +115,426 @@ def test_create_tag(new_scrap, new_tag):
 
     assert new_scrap.get_tags() == [context]
 
+def test_tag_labels_shared(new_user, new_scrap, new_tag):
+    other = Scrap.objects.create(
+        user=new_user,
+        title="Bear 2",
+        file=ContentFile("Bears!", "newfile2.txt"),
+        file_type="text"
+    )
+    Tag.objects.create(label=get_tag_label("Oregon"), scrap=other)
+    Tag.objects.create(label=get_tag_label("Idaho"), scrap=other)
+
+    # one vocabulary row per distinct name
+    assert TagLabel.objects.filter(name="Oregon").count() == 1
+    assert TagLabel.objects.get(name="Oregon").tags.count() == 2
+    assert get_tag_labels(["Oregon", "Montana"])["Oregon"] == new_tag.label
+    assert TagLabel.objects.count() == 3
+
+    assert set(Tag.objects.filter(label__name__in=["Idaho", "Oregon"]).values_list("scrap_id", flat=True)) == {new_scrap.id, other.id}
+    assert not Tag.objects.exclude(label__name="Oregon").filter(scrap=new_scrap).exists()
+    assert list(new_scrap.tags.values_list("label__name", flat=True)) == ["Oregon"]
+    assert set(Scrap.objects.filter(tags__label__name="Oregon")) == {new_scrap, other}
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Tag.objects.create(label=get_tag_label("Oregon"), scrap=other)
+    other.delete()
+
 def test_delete_user(new_scrap, new_comment):
     new_scrap.user.delete() # same user
     scrap = get_object_or_404(Scrap, id=new_scrap.id)
     assert scrap.user == get_sentinel_user()
     comment = get_object_or_404(Comment, id=new_comment.id)
-    assert comment.user == get_sentinel_user()
\ No newline at end of file
+    assert comment.user == get_sentinel_user()
+
+def test_comment_counters(new_scrap, new_comment, new_reply):
+    new_scrap.refresh_from_db()
+    new_comment.refresh_from_db()
+    assert new_scrap.num_comments == 2
+    assert new_comment.num_replies == 1
+
+    new_reply.delete()
+    new_scrap.refresh_from_db()
+    new_comment.refresh_from_db()
+    assert new_scrap.num_comments == 1
+    assert new_comment.num_replies == 0
+
+def test_comment_paths(new_user, new_scrap, new_comment, new_reply):
+    deeper = Comment.objects.create(user=new_user, scrap=new_scrap, content="deeper", reply_to=new_reply)
+    new_comment.refresh_from_db()
+    new_reply.refresh_from_db()
+
+    assert new_comment.depth == 0 and new_reply.depth == 1 and deeper.depth == 2
+    assert new_reply.path.startswith(new_comment.path)
+    assert Comment.objects.get(id=deeper.id).path == deeper.path
+    assert deeper.path.startswith(new_reply.path)
+    assert set(new_comment.descendants()) == {new_reply, deeper}
+    assert new_comment.subtree_size() == 3
+    assert new_reply.subtree_size() == 2
+
+def test_delete_comment_thread(new_user, new_scrap, new_comment, new_reply):
+    deeper = Comment.objects.create(user=new_user, scrap=new_scrap, content="deeper", reply_to=new_reply)
+    other = Comment.objects.create(user=new_user, scrap=new_scrap, content="other")
+    deeper.likers.add(new_user)
+
+    # the comment, its replies and their likes, one DELETE each
+    with CaptureQueriesContext(connection) as queries:
+        deleted = new_comment.delete()
+    assert deleted == (4, {"gallery.Comment": 3, "gallery.Comment_likers": 1})
+    assert len([q for q in queries if q["sql"].startswith("DELETE")]) == 2
+
+    assert list(Comment.objects.filter(scrap=new_scrap)) == [other]
+    new_scrap.refresh_from_db()
+    assert new_scrap.num_comments == 1
+
+def test_delete_subtree_relations():
+    # delete_subtree() skips Django's cascades, it deletes these by hand
+    related = {
+        (field.related_model._meta.label, field.field.name)
+        for field in Comment._meta.get_fields(include_hidden=True)
+        if field.auto_created and not field.concrete
+    }
+    assert related == {("gallery.Comment", "reply_to"), ("gallery.Comment_likers", "comment")}
+
+def test_like_counters(new_user, new_scrap, new_comment, django_user_model):
+    other = django_user_model.objects.create_user(username="moose", password="moose123")
+
+    new_scrap.likers.add(new_user, other)
+    new_comment.likers.add(other)
+    new_scrap.refresh_from_db()
+    new_comment.refresh_from_db()
+    assert new_scrap.num_likes == 2
+    assert new_comment.num_likes == 1
+
+    # removing a like that isn't there changes nothing
+    new_comment.likers.remove(new_user)
+    other.scrap_likes.remove(new_scrap)
+    new_scrap.refresh_from_db()
+    new_comment.refresh_from_db()
+    assert new_scrap.num_likes == 1
+    assert new_comment.num_likes == 1
+
+    other.comment_likes.clear()
+    new_scrap.likers.clear()
+    new_scrap.refresh_from_db()
+    new_comment.refresh_from_db()
+    assert new_scrap.num_likes == 0
+    assert new_comment.num_likes == 0
+
+def test_like_unlike(new_user, new_scrap, new_comment):
+    assert like(new_scrap, new_user)
+    assert not like(new_scrap, new_user)
+    assert like(new_comment, new_user)
+    new_scrap.refresh_from_db()
+    new_comment.refresh_from_db()
+    assert new_scrap.num_likes == 1 and new_comment.num_likes == 1
+
+    assert unlike(new_scrap, new_user)
+    assert not unlike(new_scrap, new_user)
+    new_scrap.refresh_from_db()
+    assert new_scrap.num_likes == 0
+    assert not new_scrap.likers.exists()
+
+# SQLite serializes writers with table locks instead of row locks, so this
+# one only means something on Postgres
+@pytest.mark.skipif(connection.vendor == "sqlite", reason="needs concurrent writers")
+@pytest.mark.django_db(transaction=True)
+def test_like_concurrent(new_scrap, new_user):
+    # the same user tapping like (and unlike) on several devices at once
+    taps, rounds = 8, 5
+    barrier = threading.Barrier(taps, timeout=30)
+    results = []
+    errors = []
+
+    def tap(i):
+        try:
+            for r in range(rounds):
+                barrier.wait()
+                results.append((r, "like", like(new_scrap, new_user)))
+                barrier.wait()
+                results.append((r, "unlike", unlike(new_scrap, new_user)))
+            # and like racing unlike
+            barrier.wait()
+            (like if i % 2 else unlike)(new_scrap, new_user)
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=tap, args=(i,)) for i in range(taps)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # no IntegrityError, and every change went through exactly once
+    assert errors == []
+    for r in range(rounds):
+        for action in ["like", "unlike"]:
+            done = [changed for n, a, changed in results if n == r and a == action]
+            assert len(done) == taps and done.count(True) == 1
+
+    new_scrap.refresh_from_db()
+    assert new_scrap.num_likes == new_scrap.likers.count()
+    assert new_scrap.num_likes in (0, 1)
+
+def test_save_keeps_counters(new_user, new_scrap):
+    stale = Scrap.objects.get(id=new_scrap.id)
+    new_scrap.likers.add(new_user)
+
+    stale.title = "Moose"
+    stale.save()
+    scrap = Scrap.objects.get(id=new_scrap.id)
+    assert scrap.title == "Moose"
+    assert scrap.num_likes == 1
+
+def test_reconcile_counters(new_user, new_scrap, new_comment, new_reply, capsys):
+    new_scrap.likers.add(new_user)
+    Scrap.objects.filter(id=new_scrap.id).update(num_likes=7, num_comments=0)
+    Comment.objects.filter(id=new_comment.id).update(num_replies=3)
+
+    call_command("reconcile_counters")
+    assert "Reconciled 1 scrap(s) and 1 comment(s)" in capsys.readouterr().out
+
+    scrap = Scrap.objects.get(id=new_scrap.id)
+    assert scrap.num_likes == 1
+    assert scrap.num_comments == 2
+    assert Comment.objects.get(id=new_comment.id).num_replies == 1
+    assert Comment.objects.get(id=new_reply.id).num_replies == 0
+
+# connection pool, see scrappages/postgresql_pool/base.py
+class IdleConnection:
+    closed = 0
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+def test_connection_pool_reuses_connections():
+    made = []
+
+    def connect():
+        made.append(IdleConnection())
+        return made[-1]
+    pool = ConnectionPool(connect, min_size=1, max_size=4, timeout=10)
+
+    threads_count = 8
+    barrier = threading.Barrier(threads_count, timeout=10)
+    used = []
+
+    def requests():
+        barrier.wait()
+        for i in range(20):
+            connection = pool.getconn()
+            used.append(connection)
+            time.sleep(0.001)
+            pool.putconn(connection)
+
+    threads = [threading.Thread(target=requests) for i in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # never more than max_size, and all of them kept open for reuse
+    assert len(used) == threads_count * 20
+    assert 1 <= len(made) <= 4
+    assert not any(connection.closed for connection in made)
+    assert sorted(map(id, pool.idle)) == sorted(map(id, made))
+
+    # a dropped connection is replaced, not handed out
+    for connection in made:
+        connection.closed = 1
+    connection = pool.getconn(lambda connection: not connection.closed)
+    assert not connection.closed and connection is made[-1]
+    pool.putconn(connection)
+    pool.closeall()
+    assert pool.idle == []
+
+@pytest.mark.skipif(connection.vendor != "postgresql", reason="needs PostgreSQL")
+@pytest.mark.django_db(transaction=True)
+def test_pooled_backend_reuses_connections():
+    settings_dict = {
+        **copy.deepcopy(connection.settings_dict),
+        "ENGINE": "scrappages.postgresql_pool",
+        "CONN_MAX_AGE": 0,
+    }
+    settings_dict["OPTIONS"]["pool"] = {"min_size": 1, "max_size": 3}
+    pids = []
+
+    def requests():
+        wrapper = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(
+            settings_dict, alias="pool_test")
+        for i in range(10):
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                pids.append(cursor.fetchone()[0])
+            # the end of a request
+            wrapper.close()
+
+    threads = [threading.Thread(target=requests) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    PooledDatabaseWrapper.close_pools()
+
+    assert len(pids) == 60
+    assert len(set(pids)) <= 3
+
+# full-text search index, see gallery/search.py
+def test_search_reindex_only_when_indexed_fields_change(new_scrap, monkeypatch):
+    calls = []
+    update_search_index = signals.update_search_index
+
+    def counting(scrap, **kwargs):
+        calls.append(scrap.pk)
+        update_search_index(scrap, **kwargs)
+    monkeypatch.setattr(signals, "update_search_index", counting)
+
+    scrap = Scrap.objects.get(id=new_scrap.id)
+    scrap.status = "ready"
+    scrap.save()
+    assert calls == []
+
+    scrap.title = "Bear 3"
+    scrap.save()
+    scrap.save()
+    assert calls == [scrap.pk]
+
+@pytest.mark.skipif(connection.vendor != "postgresql", reason="tsvector needs Postgres")
+def test_search_vector_indexes_text_content(new_user):
+    poem = Scrap.objects.create(
+        user=new_user,
+        title="Poem",
+        file=ContentFile("the lemon tree sways", "poem.txt"),
+        file_type="text"
+    )
+    query = SearchQuery("lemon", config=get_search_config())
+    assert Scrap.objects.filter(id=poem.id, search_vector=query).exists()
+    poem.delete()
+
+@pytest.mark.django_db
+def test_benchmark_connections(capsys):
+    call_command("benchmark_connections", requests=5, warmup=1)
+    out = capsys.readouterr().out
+    assert "new: mean" in out and "persistent: mean" in out
+    if connection.vendor == "sqlite":
+        assert "pooled: skipped" in out
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_asgi(capsys):
+    call_command("benchmark_asgi", requests=6, concurrency=3, threads=2, host="testserver")
+    out = capsys.readouterr().out
+    assert "wsgi: " in out and "asgi: " in out
+    assert "0 errors" in out
+
+@pytest.fixture
+def big_scrap(new_user):
+    img_io = BytesIO()
+    Image.new("RGBA", (2000, 1000), (0, 100, 200, 128)).save(img_io, format="PNG")
+    scrap = Scrap.objects.create(
+        user=new_user,
+        title="Big",
+        file=ContentFile(img_io.getvalue(), "bigfile.png"),
+        file_type="image"
+    )
+    yield scrap
+    scrap.delete()
+
+def test_generate_variants(big_scrap):
+    assert generate_variants(big_scrap) == ["thumbnail", "medium", "webp"]
+
+    scrap = get_object_or_404(Scrap, id=big_scrap.id)
+    expected = {
+        "thumbnail": ((256, 128), "JPEG"),
+        "medium": ((1024, 512), "JPEG"),
+        "webp": ((1600, 800), "WEBP"),
+    }
+    for variant, (size, fmt) in expected.items():
+        field = getattr(scrap, variant)
+        assert os.path.dirname(field.name) == os.path.dirname(scrap.file.name)
+        with field.open("rb") as f, Image.open(f) as im:
+            assert im.size == size
+            assert im.format == fmt
+
+    context = scrap.serialize()
+    assert context["thumbnail_url"] == scrap.thumbnail.url
+    assert context["webp_url"] == scrap.webp.url
+
+def test_generate_variants_gif_first_frame(new_user):
+    img_io = BytesIO()
+    frames = [Image.new("RGB", (300, 300), colour) for colour in [(255, 0, 0), (0, 0, 255)]]
+    frames[0].save(img_io, format="GIF", save_all=True, append_images=frames[1:])
+    scrap = Scrap.objects.create(
+        user=new_user,
+        title="Blink",
+        file=ContentFile(img_io.getvalue(), "blinkfile.gif"),
+        file_type="image"
+    )
+
+    generate_variants(scrap)
+    with scrap.thumbnail.open("rb") as f, Image.open(f) as im:
+        assert im.format == "JPEG"
+        assert getattr(im, "n_frames", 1) == 1
+        red, green, blue = im.convert("RGB").getpixel((128, 128))
+        assert red > 200 and blue < 50
+
+    paths = [scrap.file.path, scrap.thumbnail.path, scrap.medium.path, scrap.webp.path]
+    scrap.delete()
+    for path in paths:
+        assert not os.path.exists(path)
+
+def test_generate_variants_text(new_scrap):
+    assert generate_variants(new_scrap) == []
+    assert not new_scrap.thumbnail
+    assert new_scrap.serialize()["thumbnail_url"] is None
+
+@pytest.fixture
+def dedup_storage(tmp_path):
+    return DedupFileSystemStorage(location=tmp_path, base_url="/media/")
+
+@pytest.mark.django_db
+def test_dedup_storage(dedup_storage):
+    first = dedup_storage.save("uploads/user__a/meme.PNG", ContentFile(b"same bytes"))
+    second = dedup_storage.save("uploads/user__b/copy.png", ContentFile(b"same bytes"))
+    other = dedup_storage.save("uploads/user__b/other.png", ContentFile(b"other bytes"))
+
+    assert first == second != other
+    assert first.startswith("blobs/") and first.endswith(".png")
+    assert Blob.objects.get(name=first).refs == 2
+    assert Blob.objects.get(name=first).size == len(b"same bytes")
+    with dedup_storage.open(first, "rb") as f:
+        assert f.read() == b"same bytes"
+
+    dedup_storage.delete(first)
+    assert dedup_storage.exists(first)
+    assert Blob.objects.get(name=first).refs == 1
+
+    dedup_storage.delete(second)
+    assert not dedup_storage.exists(first)
+    assert not Blob.objects.filter(name=first).exists()
+    assert dedup_storage.exists(other)
+
+def test_dedup_storage_scraps(new_user, dedup_storage, monkeypatch):
+    for name in ["file", "thumbnail", "medium", "webp"]:
+        monkeypatch.setattr(Scrap._meta.get_field(name), "storage", dedup_storage)
+
+    scraps = [
+        Scrap.objects.create(
+            user=new_user,
+            title=f"Meme {i}",
+            file=ContentFile(b"Bears!", "meme.txt"),
+            file_type="text"
+        ) for i in range(2)
+    ]
+    assert scraps[0].file.name == scraps[1].file.name
+    path = scraps[0].file.path
+
+    scraps[0].delete()
+    assert os.path.exists(path)
+    scraps[1].delete()
+    assert not os.path.exists(path)
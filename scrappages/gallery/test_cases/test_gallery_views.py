@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.urls import reverse
+import os
 import pytest
 
 # test access to views
@@ -34,3 +35,19 @@ def test_scrap_tags_access():
 def test_tagged_scraps_access():
     url = reverse("tagged_scraps", kwargs={"tname": "barbara"})
     assert url == "/scraps/tagged/barbara"
+
+def test_cache_stats_access():
+    url = reverse("cache_stats")
+    assert url == "/scraps/cache-stats"
+
+def test_media_access():
+    url = reverse("media", kwargs={"path": "uploads/user__bison/newfile.txt"})
+    assert url == os.path.join(settings.MEDIA_URL, "uploads/user__bison/newfile.txt")
+
+def test_search_scraps_access():
+    url = reverse("search_scraps")
+    assert url == "/scraps/search"
+
+def test_home_scraps_access():
+    url = reverse("home_scraps")
+    assert url == "/scraps/home"
@@ -0,0 +1,181 @@
+from django.db import transaction
+from django.utils.http import int_to_base36
+from .cache import invalidate_scrap
+from .counters import bump
+from .likes import mark_liked
+from .models import Scrap, Comment
+from .pagination import get_page_size
+from .scores import refresh_scores
+
+# threaded comments, GET /scraps/<sid>/comments?tree=1
+#
+# the whole thread (or the part below ?parent=<cid>) comes out of a single
+# recursive CTE:
+#   ranked   numbers every comment of the scrap among its siblings,
+#            oldest first (ROW_NUMBER() OVER (PARTITION BY reply_to_id ...))
+#   thread   walks down from the top level, one level per iteration, taking
+#            at most page_size replies of every comment and stopping at
+#            ?depth= levels below the top
+# the rows come back ordered by (level, position), which is all build_tree()
+# needs to nest them in one pass
+#
+# every level pages on its own: the top level with ?after=<n> (the Link
+# header points at the next page), deeper levels by asking for the replies
+# of one comment, ?parent=<cid>&after=<n>
+# a comment has "more_replies" when some of its replies were left out
+#
+# every comment also stores its materialized path (Comment.path), so a whole
+# subtree is one indexed prefix scan: path LIKE '1a/2f/%'
+# that's what Comment.descendants(), Comment.subtree_size() and deleting a
+# comment together with its replies (delete_subtree) run on
+
+# deepest level ever returned below the top one, and the deepest a reply
+# can be (which keeps Comment.path within its max_length)
+MAX_DEPTH = 100
+
+THREAD_SQL = """
+WITH RECURSIVE ranked AS (
+    SELECT id, reply_to_id,
+           ROW_NUMBER() OVER (PARTITION BY reply_to_id ORDER BY time_posted, id) AS pos
+    FROM gallery_comment
+    WHERE scrap_id = %s
+), thread (id, level, pos) AS (
+    SELECT id, 0, pos FROM ranked
+    WHERE {top} AND pos > %s AND pos <= %s
+    UNION ALL
+    SELECT ranked.id, thread.level + 1, ranked.pos
+    FROM ranked JOIN thread ON ranked.reply_to_id = thread.id
+    WHERE thread.level < %s AND ranked.pos <= %s
+)
+SELECT gallery_comment.*, thread.level, thread.pos
+FROM thread JOIN gallery_comment ON gallery_comment.id = thread.id
+ORDER BY thread.level, thread.pos
+"""
+
+
+def comment_path(comment):
+    parent = comment.reply_to.path if comment.reply_to_id is not None else ""
+    return f"{parent}{int_to_base36(comment.pk)}/"
+
+
+def delete_subtree(comment):
+    """
+    deletes comment and every reply below it with one DELETE (plus one for
+    their likes) instead of collecting the thread level by level
+    subtree.delete() would send post_delete for every comment, so this is a
+    raw DELETE: no signals and no cascades
+    what the post_delete handlers keep (counters, scores, the response
+    cache) is updated here once for the whole thread, and only the likes
+    and the replies point at comments (test_delete_subtree_relations checks
+    that, a new relation has to be deleted here too)
+    returns (total, {model label: count}) like Model.delete()
+    """
+    subtree = Comment.objects.filter(path__startswith=comment.path)
+    likes = Comment.likers.through.objects.filter(comment__in=subtree)
+
+    with transaction.atomic():
+        num_likes = likes.delete()[0]
+        num_comments = subtree._raw_delete(subtree.db)
+
+        bump(Scrap, comment.scrap_id, "num_comments", -num_comments)
+        bump(Comment, comment.reply_to_id, "num_replies", -1)
+        refresh_scores([comment.scrap_id], create=False)
+    invalidate_scrap(comment.scrap_id)
+
+    deleted = {Comment._meta.label: num_comments}
+    if num_likes:
+        deleted[Comment.likers.through._meta.label] = num_likes
+    return num_likes + num_comments, deleted
+
+
+def wants_tree(request):
+    return request.query_params.get("tree") in ("1", "true")
+
+
+def _non_negative(request, name, default):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid; {name} must be a non-negative integer")
+    if value < 0:
+        raise ValueError(f"Invalid; {name} must be a non-negative integer")
+    return value
+
+
+def fetch_thread(scrap_id, parent_id=None, after=0, page_size=50, depth=MAX_DEPTH):
+    """
+    the comments of a thread, each with .level (0 for the top level) and .pos
+    (1-based among its siblings), ordered by (level, pos)
+    the top level holds up to page_size + 1 comments, so callers can tell
+    whether there is another page
+    """
+    if parent_id is None:
+        top, params = "reply_to_id IS NULL", []
+    else:
+        top, params = "reply_to_id = %s", [parent_id]
+
+    sql = THREAD_SQL.format(top=top)
+    params = [scrap_id] + params + [after, after + page_size + 1, depth, page_size]
+    return list(Comment.objects.raw(sql, params).prefetch_related("user"))
+
+
+def build_tree(comments, serialize):
+    """
+    nests comments ordered by (level, pos) in one pass
+    """
+    roots = []
+    nodes = {}
+    for comment in comments:
+        node = serialize(comment)
+        node["replies"] = []
+        nodes[comment.id] = node
+
+        if comment.level == 0:
+            roots.append(node)
+        else:
+            nodes[comment.reply_to_id]["replies"].append(node)
+
+    for node in nodes.values():
+        node["more_replies"] = node["num_replies"] > len(node["replies"])
+    return roots
+
+
+def thread_page(request, scrap, serialize):
+    """
+    (nested comments, response headers) for a ?tree=1 request
+    raises ValueError on bad parameters
+    """
+    page_size = get_page_size(request)
+    after = _non_negative(request, "after", 0)
+    depth = min(_non_negative(request, "depth", MAX_DEPTH), MAX_DEPTH)
+
+    parent_id = request.query_params.get("parent")
+    if parent_id is not None:
+        if not parent_id.isdigit() or not scrap.comments.filter(id=parent_id).exists():
+            raise ValueError("Invalid; parent must be a comment on this scrap")
+        parent_id = int(parent_id)
+
+    comments = fetch_thread(scrap.id, parent_id, after, page_size, depth)
+
+    # the extra top level comment (and its replies) only says there's more
+    top = [comment for comment in comments if comment.level == 0]
+    headers = {}
+    if len(top) > page_size:
+        # parents come before their replies
+        dropped = {top[-1].id}
+        kept = []
+        for comment in comments:
+            if comment.id in dropped or (comment.level > 0 and comment.reply_to_id in dropped):
+                dropped.add(comment.id)
+            else:
+                kept.append(comment)
+        comments = kept
+        params = request.query_params.copy()
+        params["after"] = after + page_size
+        url = request.build_absolute_uri(request.path + "?" + params.urlencode())
+        headers["Link"] = f'<{url}>; rel="next"'
+
+    return build_tree(mark_liked(request, comments), serialize), headers
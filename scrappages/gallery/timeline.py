@@ -0,0 +1,162 @@
+import datetime
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from jobs.queue import enqueue
+from .models import Scrap, TimelineEntry
+
+# home timelines, GET /scraps/home
+#
+# every user's timeline is materialized in TimelineEntry: their own scraps
+# plus those of everyone they follow, so reading it is one range scan over
+# the (user, time_posted, scrap) index
+#
+# fan-out on write: a new scrap gets an entry for its author right away and
+# the gallery.fan_out_scrap job copies it to every follower
+# accounts with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are not
+# fanned out to, instead pull() copies their new scraps into a follower's
+# timeline when the follower reads it (fan-out on read), oldest first from
+# Follow.synced_until so a burst of posts is never skipped
+# time_posted is set when a scrap is saved, not when its transaction
+# commits, so a scrap can show up after newer ones were pulled: the
+# watermark stays TIMELINE_PULL_LAG seconds behind the present, the scraps
+# newer than that are copied again on every pull (which leaves the existing
+# entries alone) until it passes them
+#
+# following someone copies their newest TIMELINE_BACKFILL scraps in,
+# unfollowing removes them again
+
+# entries written per query
+BATCH_SIZE = 1000
+
+
+def get_fanout_limit():
+    return getattr(settings, "TIMELINE_FANOUT_MAX_FOLLOWERS", 10000)
+
+
+def get_backfill():
+    return getattr(settings, "TIMELINE_BACKFILL", 50)
+
+
+def get_pull_lag():
+    return getattr(settings, "TIMELINE_PULL_LAG", 60)
+
+
+def _watermark(time_posted):
+    # as far as synced_until may move, see above
+    return min(time_posted, timezone.now() - datetime.timedelta(seconds=get_pull_lag()))
+
+
+def add_entries(user_ids, scraps):
+    """
+    puts scraps, (id, time_posted) pairs, into the timelines of user_ids
+    returns the number of entries written (existing ones are left alone)
+    """
+    written = 0
+    batch = []
+    for user_id in user_ids:
+        for scrap_id, time_posted in scraps:
+            batch.append(TimelineEntry(user_id=user_id, scrap_id=scrap_id, time_posted=time_posted))
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            written += len(batch)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        written += len(batch)
+    return written
+
+
+def publish(scrap):
+    """
+    a new scrap: into its author's timeline now, its followers' later
+    """
+    from profiles.models import Profile
+
+    add_entries([scrap.user_id], [(scrap.id, scrap.time_posted)])
+
+    num_followers = Profile.objects.filter(user_id=scrap.user_id).values_list(
+        "num_followers", flat=True).first() or 0
+    if 0 < num_followers <= get_fanout_limit():
+        enqueue("gallery.fan_out_scrap", scrap_id=scrap.id)
+
+
+def fan_out(scrap):
+    from profiles.models import Follow
+
+    # Profile's primary key is its user's id
+    followers = Follow.objects.filter(followee_id=scrap.user_id).values_list(
+        "follower_id", flat=True).iterator(chunk_size=BATCH_SIZE)
+    return add_entries(followers, [(scrap.id, scrap.time_posted)])
+
+
+def _newest_scraps(user_id, after=None, limit=None):
+    scraps = Scrap.objects.filter(user_id=user_id)
+    if after is not None:
+        scraps = scraps.filter(time_posted__gt=after)
+    return list(scraps.order_by("-time_posted", "-id").values_list(
+        "id", "time_posted")[:limit or BATCH_SIZE])
+
+
+def _scraps_since(user_id, after=None):
+    """
+    user_id's scraps posted after `after`, oldest first, as batches of
+    (id, time_posted) pairs
+    """
+    scraps = Scrap.objects.filter(user_id=user_id).order_by("time_posted", "id")
+    if after is not None:
+        scraps = scraps.filter(time_posted__gt=after)
+    scraps = scraps.values_list("id", "time_posted")
+
+    batch = list(scraps[:BATCH_SIZE])
+    while batch:
+        yield batch
+        if len(batch) < BATCH_SIZE:
+            return
+        last_id, last_time = batch[-1]
+        batch = list(scraps.filter(
+            Q(time_posted__gt=last_time) | Q(time_posted=last_time, id__gt=last_id))[:BATCH_SIZE])
+
+
+def follow(follower_id, followee_id):
+    from profiles.models import Follow
+
+    scraps = _newest_scraps(followee_id, limit=get_backfill())
+    add_entries([follower_id], scraps)
+    if scraps:
+        # pull() carries on from the newest one
+        Follow.objects.filter(follower_id=follower_id, followee_id=followee_id).update(
+            synced_until=_watermark(scraps[0][1]))
+
+
+def unfollow(follower_id, followee_id):
+    TimelineEntry.objects.filter(user_id=follower_id, scrap__user_id=followee_id).delete()
+
+
+def pull(user):
+    """
+    copies new scraps of the big accounts user follows into their timeline
+    returns the number of entries written
+    """
+    from profiles.models import Follow
+
+    follows = Follow.objects.filter(
+        follower_id=user.id, followee__num_followers__gt=get_fanout_limit())
+    # most users follow no big account, their GETs stay off the primary
+    # (a replica that's missing a new follow only delays the first pull)
+    if not follows.exists():
+        return 0
+
+    written = 0
+    # a write on a GET: the reads come from the primary too (reads inside a
+    # transaction always do, see scrappages/replicas.py), a lagging replica
+    # would move synced_until past scraps it doesn't have yet
+    with transaction.atomic():
+        for follow in follows:
+            for scraps in _scraps_since(follow.followee_id, after=follow.synced_until):
+                written += add_entries([user.id], scraps)
+                # only as far as what's been copied
+                Follow.objects.filter(pk=follow.pk).update(
+                    synced_until=_watermark(scraps[-1][1]))
+    return written
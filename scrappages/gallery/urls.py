@@ -1,13 +1,17 @@
+from django.conf import settings
 from django.urls import path
-from gallery import views
+from gallery import async_views, views
 from rest_framework.urlpatterns import format_suffix_patterns
 
+# native async GET views under ASGI, see gallery/async_views.py
+read_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.scraps_view,
+    path('', read_views.scraps_view,
          name='scraps'),
-    path('<int:sid>', views.specific_scrap_view,
+    path('<int:sid>', read_views.specific_scrap_view,
          name='specific_scrap'),
-    path('<int:sid>/comments', views.scrap_comments_view,
+    path('<int:sid>/comments', read_views.scrap_comments_view,
          name='scrap_comments'),
     path('<int:sid>/comments/<int:cid>', views.specific_scrap_comment_view,
          name='specific_scrap_comment'),
@@ -19,6 +23,12 @@ urlpatterns = [
          name='scrap_tags'),
     path('tagged/<str:tname>', views.tagged_scraps_view,
          name='tagged_scraps'),
+    path('search', views.search_scraps_view,
+         name='search_scraps'),
+    path('home', views.home_view,
+         name='home_scraps'),
+    path('cache-stats', views.cache_stats_view,
+         name='cache_stats'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
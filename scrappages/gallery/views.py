@@ -1,14 +1,23 @@
-from django.db.models import Count
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, renderer_classes
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from PIL import Image
+from jobs.queue import enqueue
 import json
-from .models import Scrap, Comment, Tag
+from .cache import cache_anonymous_get, cached_version, get_stats, invalidate_scrap
+from .conditional import conditional
+from .likes import like, mark_liked, unlike
+from .models import Scrap, Comment, Tag, TimelineEntry, get_tag_label, get_tag_labels
+from .pagination import FEED_KEYS, HOT_KEYS, TIMELINE_KEYS, paginate
+from .search import MAX_SEARCH_QUERY_LENGTH, MAX_SEARCH_TAGS, tag_search, text_search
+from .streaming import stream_json, wants_stream
+from .threads import MAX_DEPTH, thread_page, wants_tree
+from .timeline import pull
 
 # enforce tags are at max 64 characters
 # replace non-alphanumeric characters with underscores
@@ -21,25 +30,121 @@ def process_tag(tname):
             ret += c
     return ret
 
+# process_tag every name, dropping empty ones and repeats
+def normalize_tags(tnames):
+    ret = []
+    for tname in tnames:
+        tname = process_tag(str(tname))
+        if tname and tname not in ret:
+            ret.append(tname)
+    return ret
+
+# tag lists come as JSON lists, or JSON strings in multipart forms
+def tag_list(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = None
+    if not isinstance(value, list):
+        raise ValueError("Invalid; tags must be a list")
+    return normalize_tags(value)
+
+# set-based tag changes, a fixed number of queries however many tags
+# (bulk_create skips the post_save signals, and tag queryset deletes are
+# ignored by gallery/signals.py, so these invalidate the cache themselves)
+def add_tags(scrap, tnames):
+    labels = get_tag_labels(tnames)
+    Tag.objects.bulk_create(
+        [Tag(label=labels[tname], scrap=scrap) for tname in tnames],
+        ignore_conflicts=True
+    )
+    invalidate_scrap(scrap.id)
+
+def remove_tags(scrap, tnames):
+    Tag.objects.filter(scrap=scrap, label__name__in=tnames).delete()
+    invalidate_scrap(scrap.id, tnames)
+
+# (last modified, ETag parts) for conditional GETs, see gallery/conditional.py
+# tag changes touch time_updated, likes and comments bump the counters
+def scrap_version_query(sid):
+    return Scrap.objects.filter(id=sid).values_list(
+        "time_updated", "num_likes", "num_comments")
+
+@cached_version(lambda sid: [f"scrap:{sid}"])
+def scrap_version(sid):
+    row = scrap_version_query(sid).first()
+    if row is None:
+        return None
+    return row[0], row
+
+# Scrap.serialize() with absolute file/variant URLs
+def serialize_scrap(request, scrap):
+    context = scrap.serialize()
+    for url in ["file_url", "thumbnail_url", "medium_url", "webp_url"]:
+        if context[url] is not None:
+            context[url] = request.build_absolute_uri(context[url])
+    return context
+
+# a Scrap as the API returns it
+def scrap_context(request, scrap):
+    context = serialize_scrap(request, scrap)
+    context["num_comments"] = scrap.num_comments
+    context["num_likes"] = scrap.num_likes
+    # list endpoints, see gallery/likes.py
+    if hasattr(scrap, "liked_by_me"):
+        context["liked_by_me"] = scrap.liked_by_me
+    return context
+
+# a Comment as the API returns it
+def comment_context(comment):
+    context = comment.serialize()
+    context["num_replies"] = comment.num_replies
+    context["num_likes"] = comment.num_likes
+    if hasattr(comment, "liked_by_me"):
+        context["liked_by_me"] = comment.liked_by_me
+    return context
+
+# the GET /scraps/ queryset and its pagination keys for ?sort=
+def feed_query(sort):
+    scraps = Scrap.objects.for_serialization()
+    if sort == "hot":
+        # precomputed, see gallery/scores.py
+        # (the isnull filter makes it an inner join, driven by the score index)
+        return scraps.select_related("score").filter(score__isnull=False), HOT_KEYS
+    elif sort == "new":
+        return scraps, FEED_KEYS
+    raise ValueError("Invalid; sort must be new or hot")
+
 # Create your views here.
 @api_view(["GET", "POST"])
 @csrf_exempt
 @permission_classes([IsAuthenticatedOrReadOnly])
 @renderer_classes([JSONRenderer])
+@cache_anonymous_get(lambda: ["feed"])
 def scraps_view(request):
     if request.method == "GET":
         context = []
 
-        scraps = Scrap.objects.annotate(
-            num_comments=Count('comments', distinct=True), num_likes=Count('likers', distinct=True)).order_by("-time_updated")
-        for scrap in scraps:
-            ans = scrap.serialize()
-            ans["file_url"] = request.build_absolute_uri(ans["file_url"])
-            ans["num_comments"] = scrap.num_comments
-            ans["num_likes"] = scrap.num_likes
-            context.append(ans)
+        try:
+            scraps, keys = feed_query(request.query_params.get("sort", "new"))
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        if wants_stream(request):
+            return stream_json(scraps.order_by(*[f"-{key}" for key in keys]),
+                               lambda scrap: scrap_context(request, scrap),
+                               lambda scraps: mark_liked(request, scraps))
 
-        return Response(data=context)
+        try:
+            scraps, headers = paginate(request, scraps, keys)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        for scrap in mark_liked(request, scraps):
+            context.append(scrap_context(request, scrap))
+
+        return Response(data=context, headers=headers)
 
     elif request.method == "POST":
         # request.data should contain JSON data
@@ -61,9 +166,10 @@ def scraps_view(request):
         # TODO: validate file (currently just using the content_type header)
         file_type = "text"
         if file.content_type in ["image/jpg", "image/png", "image/gif", "image/jpeg"]:
+            # only the image header is read here, the full decode and the
+            # resized variants are left to the gallery.process_scrap_upload job
             try:
-                im = Image.open(file)
-                im.verify()
+                Image.open(file)
             except:
                 return Response("Invalid; image file could not be verified",
                                 status=status.HTTP_400_BAD_REQUEST)
@@ -80,41 +186,44 @@ def scraps_view(request):
         if "description" in request.data:
             description = request.data["description"]
 
+        tnames = []
+        if "tags" in request.data:
+            try:
+                tnames = tag_list(request.data["tags"])
+            except ValueError as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
         # make new Scrap
         scrap= Scrap(
             user=request.user,
             title=title,
             description=description,
             file=file,
-            file_type=file_type
+            file_type=file_type,
+            status="processing" if file_type == "image" else "ready"
         )
         scrap.save()
 
-        if "tags" in request.data:
-            alltags = json.loads(request.data["tags"])
-            for tname in alltags:
-                tname = process_tag(tname)
-                prevtag = Tag.objects.filter(name=tname, scrap__id=scrap.id)
-                if not prevtag:
-                    tag = Tag(name=tname, scrap=scrap)
-                    tag.save()
-
-        context = scrap.serialize()
-        context["file_url"] = request.build_absolute_uri(context["file_url"])
+        if tnames:
+            add_tags(scrap, tnames)
+
+        if file_type == "image":
+            enqueue("gallery.process_scrap_upload", scrap_id=scrap.id)
+
+        context = serialize_scrap(request, scrap)
         return Response(context)
 
+@conditional(scrap_version)
 @api_view(["GET", "PUT", "DELETE"])
 @csrf_exempt
 @permission_classes([IsAuthenticatedOrReadOnly])
 @renderer_classes([JSONRenderer])
+@cache_anonymous_get(lambda sid: [f"scrap:{sid}"])
 def specific_scrap_view(request, sid):
     scrap = get_object_or_404(Scrap, id=sid)
 
     if request.method == "GET":
-        context = scrap.serialize()
-        context["file_url"] = request.build_absolute_uri(context["file_url"])
-        context["num_comments"] = scrap.comments.count()
-        context["num_likes"] = scrap.likers.count()
+        context = scrap_context(request, scrap)
 
         return Response(data=context)
 
@@ -133,21 +242,21 @@ def specific_scrap_view(request, sid):
         
         if "description" in request.data:
             scrap.description = request.data["description"]
+
+        if "tags" in request.data:
+            try:
+                tnames = tag_list(request.data["tags"])
+            except ValueError as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         
-        scrap.save()
+        # the upload job owns status and the variants, it may have written
+        # them since the scrap was loaded
+        scrap.save(update_fields=["title", "description", "time_updated"])
 
         if "tags" in request.data:
-            for tname in request.data["tags"]:
-                tname = process_tag(tname)
-                prevtag = Tag.objects.filter(name=tname, scrap__id=scrap.id)
-                if not prevtag:
-                    tag = Tag(name=tname, scrap=scrap)
-                    tag.save()
+            add_tags(scrap, tnames)
         
-        context = scrap.serialize()
-        context["file_url"] = request.build_absolute_uri(context["file_url"])
-        context["num_comments"] = scrap.comments.count()
-        context["num_likes"] = scrap.likers.count()
+        context = scrap_context(request, scrap)
 
         return Response(data=context)
 
@@ -164,21 +273,28 @@ def specific_scrap_view(request, sid):
 @csrf_exempt
 @permission_classes([IsAuthenticatedOrReadOnly])
 @renderer_classes([JSONRenderer])
+@cache_anonymous_get(lambda sid: [f"scrap:{sid}"])
 def scrap_comments_view(request, sid):
     scrap = get_object_or_404(Scrap, id=sid)
 
     if request.method == "GET":
         context = []
 
-        comments = scrap.comments.annotate(
-            num_likes=Count('likers', distinct=True),
-            num_replies=Count('replies', distinct=True)
-        ).order_by("-time_updated")
-        for comment in comments:
-            ans = comment.serialize()
-            ans["num_replies"] = comment.num_replies
-            ans["num_likes"] = comment.num_likes
-            context.append(ans)
+        # nested replies, see gallery/threads.py
+        if wants_tree(request):
+            try:
+                context, headers = thread_page(request, scrap, comment_context)
+            except ValueError as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+            return Response(data=context, headers=headers)
+
+        comments = scrap.comments.select_related("user").order_by("-time_updated", "-id")
+        if wants_stream(request):
+            return stream_json(comments, comment_context,
+                               lambda comments: mark_liked(request, comments))
+
+        for comment in mark_liked(request, comments):
+            context.append(comment_context(comment))
 
         return Response(data=context)
 
@@ -197,7 +313,9 @@ def scrap_comments_view(request, sid):
             scrap=scrap,
             reply_to=None
         )
-        comment.save()
+        # the comment and the counters it bumps land together
+        with transaction.atomic():
+            comment.save()
 
         return Response(comment.serialize())
 
@@ -212,9 +330,7 @@ def specific_scrap_comment_view(request, sid, cid):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if request.method == "GET":
-        context = comment.serialize()
-        context["num_replies"] = comment.replies.count()
-        context["num_likes"] = comment.likers.count()
+        context = comment_context(comment)
 
         return Response(data=context)
 
@@ -226,6 +342,10 @@ def specific_scrap_comment_view(request, sid, cid):
 
         content = request.data["content"]
 
+        if comment.depth >= MAX_DEPTH:
+            return Response("Invalid; Thread is too deep",
+                            status=status.HTTP_400_BAD_REQUEST)
+
         # make new Scrap
         new_comment = Comment(
             user=request.user,
@@ -233,7 +353,8 @@ def specific_scrap_comment_view(request, sid, cid):
             scrap=scrap,
             reply_to=comment
         )
-        new_comment.save()
+        with transaction.atomic():
+            new_comment.save()
 
         return Response(new_comment.serialize())
 
@@ -250,9 +371,7 @@ def specific_scrap_comment_view(request, sid, cid):
             comment.content = request.data["content"]
             comment.save()
         
-        context = comment.serialize()
-        context["num_replies"] = comment.replies.count()
-        context["num_likes"] = comment.likers.count()
+        context = comment_context(comment)
 
         return Response(data=context)
 
@@ -277,21 +396,13 @@ def scrap_like_view(request, sid):
         """
         adds a like
         """
-        if scrap.likers.filter(pk=request.user.pk).exists():
-            return Response(False)
-        
-        scrap.likers.add(request.user)
-        return Response(True)
+        return Response(like(scrap, request.user))
 
     elif request.method == "DELETE":
         """
         removes a like
         """
-        if not scrap.likers.filter(pk=request.user.pk).exists():
-            return Response(False)
-        
-        scrap.likers.remove(request.user)
-        return Response(True)
+        return Response(unlike(scrap, request.user))
 
 @api_view(["POST", "DELETE"])
 @csrf_exempt
@@ -307,23 +418,17 @@ def comment_like_view(request, sid, cid):
         """
         adds a like
         """
-        if comment.likers.filter(pk=request.user.pk).exists():
-            return Response(False)
-        
-        comment.likers.add(request.user)
-        return Response(True)
+        return Response(like(comment, request.user))
 
     elif request.method == "DELETE":
         """
         removes a like
         """
-        if not comment.likers.filter(pk=request.user.pk).exists():
-            return Response(False)
-        
-        comment.likers.remove(request.user)
-        return Response(True)
+        return Response(unlike(comment, request.user))
 
-@api_view(["GET", "POST", "DELETE"])
+# POST/DELETE take a single "tag", or a "tags" list to add/remove in bulk
+# PUT replaces the scrap's whole tag set with "tags"
+@api_view(["GET", "POST", "PUT", "DELETE"])
 @csrf_exempt
 @permission_classes([IsAuthenticatedOrReadOnly])
 @renderer_classes([JSONRenderer])
@@ -334,56 +439,184 @@ def scrap_tags_view(request, sid):
         return Response(data=scrap.get_tags())
 
     elif request.method == "POST":
-        if "tag" not in request.data:
+        if "tag" not in request.data and "tags" not in request.data:
             return Response("Invalid: need tag",
                             status=status.HTTP_400_BAD_REQUEST)
         elif scrap.user.username != request.user.username:
             return Response("Invalid: cannot alter tags of another user's post",
                             status=status.HTTP_400_BAD_REQUEST)
 
+        if "tags" in request.data:
+            try:
+                tnames = tag_list(request.data["tags"])
+            except ValueError as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+            add_tags(scrap, tnames)
+            scrap.save(update_fields=["time_updated"])
+            return Response(scrap.get_tags())
+
         tname = process_tag(request.data["tag"])
-        prevtag = Tag.objects.filter(name=tname, scrap__id=scrap.id)
+        prevtag = Tag.objects.filter(label__name=tname, scrap__id=scrap.id)
         if prevtag:
             return Response("Invalid; Tag already exists",
                             status=status.HTTP_400_BAD_REQUEST)
         else:
-            tag = Tag(name=tname, scrap=scrap)
+            tag = Tag(label=get_tag_label(tname), scrap=scrap)
             tag.save()
+            # the scrap's ETag has to change with its tags
+            scrap.save(update_fields=["time_updated"])
             return Response(tag.serialize())
-        
+
+    elif request.method == "PUT":
+        if request.user != scrap.user:
+            return Response("Invalid; Cannot alter another user's post",
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if "tags" not in request.data:
+            return Response("Invalid; need tags",
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            tnames = tag_list(request.data["tags"])
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        current = set(scrap.tags.values_list("label__name", flat=True))
+        with transaction.atomic():
+            removed = [tname for tname in current if tname not in tnames]
+            if removed:
+                remove_tags(scrap, removed)
+            added = [tname for tname in tnames if tname not in current]
+            if added:
+                add_tags(scrap, added)
+            scrap.save(update_fields=["time_updated"])
+        return Response(scrap.get_tags())
 
     elif request.method == "DELETE":
         if request.user != scrap.user:
             return Response("Invalid; Cannot alter another user's post",
                             status=status.HTTP_400_BAD_REQUEST)
+
+        if "tags" in request.data:
+            try:
+                tnames = tag_list(request.data["tags"])
+            except ValueError as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+            remove_tags(scrap, tnames)
+            scrap.save(update_fields=["time_updated"])
+            return Response(True)
         
         if "tag" not in request.data:
             return Response("Invalid; no tag to delete identified",
                             status=status.HTTP_400_BAD_REQUEST)
         
-        tag = get_object_or_404(Tag, name=request.data["tag"], scrap__id=scrap.id)
+        tag = get_object_or_404(Tag, label__name=request.data["tag"], scrap__id=scrap.id)
         try:
             tag.delete()
+            scrap.save(update_fields=["time_updated"])
             return Response(True)
         except:
             return Response(False)
 
+# scraps of the people the user follows (and their own), newest first
+# see gallery/timeline.py
+@api_view(["GET"])
+@csrf_exempt
+@permission_classes([IsAuthenticated])
+@renderer_classes([JSONRenderer])
+def home_view(request):
+    entries = TimelineEntry.objects.filter(user=request.user)
+    if pull(request.user):
+        # the new entries aren't on the replicas yet
+        entries = entries.using(DEFAULT_DB_ALIAS)
+
+    entries = entries.select_related(
+        "scrap__user").prefetch_related("scrap__tags").defer(
+        "scrap__text_content", "scrap__search_vector")
+    try:
+        entries, headers = paginate(request, entries, TIMELINE_KEYS)
+    except ValueError as e:
+        return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+    context = []
+
+    for scrap in mark_liked(request, [entry.scrap for entry in entries]):
+        context.append(scrap_context(request, scrap))
+
+    return Response(data=context, headers=headers)
+
+# GET /scraps/search?q=words&tags=a,b&any=c&exclude=d, see gallery/search.py
+# text matches come best first, tag-only searches newest first
+# any scrap change invalidates the feed, so results are cached with it
+@api_view(["GET"])
+@csrf_exempt
+@renderer_classes([JSONRenderer])
+@cache_anonymous_get(lambda: ["feed"])
+def search_scraps_view(request):
+    params = {}
+    for param, arg in [("tags", "all_of"), ("any", "any_of"), ("exclude", "none_of")]:
+        params[arg] = normalize_tags(request.query_params.get(param, "").split(","))
+        if len(params[arg]) > MAX_SEARCH_TAGS:
+            return Response(f"Invalid; at most {MAX_SEARCH_TAGS} tags per parameter",
+                            status=status.HTTP_400_BAD_REQUEST)
+    q = request.query_params.get("q", "").strip()
+    if len(q) > MAX_SEARCH_QUERY_LENGTH:
+        return Response(f"Invalid; q is limited to {MAX_SEARCH_QUERY_LENGTH} characters",
+                        status=status.HTTP_400_BAD_REQUEST)
+    if not q and not any(params.values()):
+        return Response("Required: q, tags, any or exclude",
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    scraps = tag_search(**params).for_serialization()
+    keys = FEED_KEYS
+    if q:
+        scraps = text_search(scraps, q)
+        keys = ("rank", "id")
+
+    if wants_stream(request):
+        return stream_json(scraps.order_by(*[f"-{key}" for key in keys]),
+                           lambda scrap: scrap_context(request, scrap),
+                           lambda scraps: mark_liked(request, scraps))
+
+    try:
+        scraps, headers = paginate(request, scraps, keys)
+    except ValueError as e:
+        return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+    context = []
+
+    for scrap in mark_liked(request, scraps):
+        context.append(scrap_context(request, scrap))
+
+    return Response(data=context, headers=headers)
+
 @api_view(["GET"])
 @csrf_exempt
 @renderer_classes([JSONRenderer])
+@cache_anonymous_get(lambda tname: [f"tag:{tname}"])
 def tagged_scraps_view(request, tname):
-    scraps = Scrap.objects.all().filter(tags__name=tname).annotate(
-        num_comments=Count('comments'),
-        num_likes=Count('likers')
-    ).order_by('-time_updated')
+    scraps = Scrap.objects.for_serialization().filter(tags__label__name=tname)
+    if wants_stream(request):
+        return stream_json(scraps.order_by("-time_updated", "-id"),
+                           lambda scrap: scrap_context(request, scrap),
+                           lambda scraps: mark_liked(request, scraps))
+
+    try:
+        scraps, headers = paginate(request, scraps)
+    except ValueError as e:
+        return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
     context = []
 
-    for scrap in scraps:
-        ans = scrap.serialize()
-        ans["file_url"] = request.build_absolute_uri(ans["file_url"])
-        ans["num_comments"] = scrap.num_comments
-        ans["num_likes"] = scrap.num_likes
-        context.append(ans)
+    for scrap in mark_liked(request, scraps):
+        context.append(scrap_context(request, scrap))
+
+    return Response(data=context, headers=headers)
 
-    return Response(data=context)
\ No newline at end of file
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+@renderer_classes([JSONRenderer])
+def cache_stats_view(request):
+    """
+    hit/miss counters of the gallery response cache
+    """
+    return Response(data=get_stats())
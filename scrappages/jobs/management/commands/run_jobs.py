@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from jobs.queue import requeue_stale, run_pending
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs (see jobs/queue.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="run every due job, then exit instead of waiting for more",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=600,
+            help="requeue jobs that have been running for this many seconds",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                requeue_stale(options["stale_after"])
+                ran = run_pending()
+                if ran:
+                    self.stdout.write(f"Ran {ran} job(s)")
+                if options["once"]:
+                    break
+                if not ran:
+                    time.sleep(options["sleep"])
+        except KeyboardInterrupt:
+            pass
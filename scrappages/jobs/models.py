@@ -0,0 +1,72 @@
+from django.db import models
+from django.utils import timezone
+
+# Create your models here.
+
+
+class Job(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    # registered task name, see jobs/queue.py
+    name = models.CharField(
+        max_length=100
+    )
+
+    # keyword arguments for the task, must be JSON-serializable
+    kwargs = models.JSONField(
+        default=dict
+    )
+
+    status = models.CharField(
+        max_length=7,
+        default=QUEUED
+    )
+
+    attempts = models.IntegerField(
+        default=0
+    )
+
+    max_attempts = models.IntegerField(
+        default=3
+    )
+
+    # not picked up before this time (used to back off retries)
+    run_after = models.DateTimeField(
+        default=timezone.now
+    )
+
+    # traceback of the last failed attempt
+    error = models.TextField(
+        default=""
+    )
+
+    time_posted = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    time_updated = models.DateTimeField(
+        auto_now=True
+    )
+
+    # workers look for the oldest due queued job
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "run_after", "id"], name="job_due_idx"
+            )
+        ]
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "kwargs": self.kwargs,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "time_posted": self.time_posted,
+            "time_updated": self.time_updated,
+        }
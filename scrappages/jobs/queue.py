@@ -0,0 +1,115 @@
+import datetime
+import logging
+import traceback
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Job
+
+# a small database-backed job queue
+#
+#   @task("gallery.process_scrap_upload")
+#   def process_scrap_upload(scrap_id): ...
+#
+#   enqueue("gallery.process_scrap_upload", scrap_id=scrap.id)
+#
+# tasks live in <app>/tasks.py (picked up by JobsConfig.ready) and take
+# JSON-serializable keyword arguments; jobs are run by `manage.py run_jobs`,
+# or straight away inside enqueue() when JOBS_EAGER is set (development/tests)
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+
+
+def task(name):
+    def decorator(func):
+        _tasks[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, /, **kwargs):
+    """
+    queues the task called name; the rows it needs must already be committed,
+    a worker may pick the job up straight away
+    """
+    if name not in _tasks:
+        raise KeyError(f"Unknown task: {name}")
+
+    job = Job.objects.create(name=name, kwargs=kwargs)
+    if getattr(settings, "JOBS_EAGER", False):
+        job.status = Job.RUNNING
+        job.attempts = 1
+        run_job(job)
+    return job
+
+
+def _retry_delay(attempts):
+    # exponential backoff: base, 2 * base, 4 * base, ...
+    base = getattr(settings, "JOBS_RETRY_DELAY", 10)
+    return datetime.timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def claim_next():
+    """
+    marks the oldest due job as running and returns it (None if there is none)
+    several workers can claim at once, SKIP LOCKED keeps them apart
+    """
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.QUEUED, run_after__lte=timezone.now()
+        ).order_by("run_after", "id").first()
+        if job is None:
+            return None
+
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.save(update_fields=["status", "attempts", "time_updated"])
+    return job
+
+
+def run_job(job):
+    try:
+        func = _tasks.get(job.name)
+        if func is None:
+            raise KeyError(f"Unknown task: {job.name}")
+        func(**job.kwargs)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            logger.error("Job %s (%s) failed: %s", job.id, job.name, job.error)
+        else:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + _retry_delay(job.attempts)
+    else:
+        job.status = Job.DONE
+        job.error = ""
+
+    job.save(update_fields=["status", "error", "run_after", "time_updated"])
+    return job
+
+
+def run_pending(limit=None):
+    """
+    runs due jobs until there are none left (or limit jobs have run)
+    returns the number of jobs run
+    """
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def requeue_stale(seconds):
+    """
+    puts jobs back in the queue whose worker died while running them
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=seconds)
+    return Job.objects.filter(status=Job.RUNNING, time_updated__lt=cutoff).update(
+        status=Job.QUEUED, time_updated=timezone.now())
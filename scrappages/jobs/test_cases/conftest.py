@@ -0,0 +1,21 @@
+import pytest
+from jobs.queue import task
+
+calls = []
+
+
+@task("test.record")
+def record(**kwargs):
+    calls.append(kwargs)
+
+
+@task("test.explode")
+def explode():
+    raise RuntimeError("boom")
+
+
+@pytest.fixture
+def recorded():
+    calls.clear()
+    yield calls
+    calls.clear()
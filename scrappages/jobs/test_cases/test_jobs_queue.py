@@ -0,0 +1,81 @@
+from django.core.management import call_command
+from django.utils import timezone
+import datetime
+import pytest
+from jobs.models import Job
+from jobs.queue import enqueue, run_pending, requeue_stale
+
+@pytest.mark.django_db
+def test_enqueue_and_run(recorded):
+    job = enqueue("test.record", name="bison", n=3)
+    assert job.status == Job.QUEUED
+    assert recorded == []
+
+    assert run_pending() == 1
+    assert recorded == [{"name": "bison", "n": 3}]
+
+    job.refresh_from_db()
+    assert job.status == Job.DONE
+    assert job.attempts == 1
+    assert run_pending() == 0
+
+@pytest.mark.django_db
+def test_enqueue_unknown_task():
+    with pytest.raises(KeyError):
+        enqueue("test.nope")
+    assert not Job.objects.exists()
+
+@pytest.mark.django_db
+def test_jobs_run_in_order(recorded):
+    for i in range(3):
+        enqueue("test.record", i=i)
+    assert run_pending(limit=2) == 2
+    assert recorded == [{"i": 0}, {"i": 1}]
+    assert run_pending() == 1
+    assert recorded == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+@pytest.mark.django_db
+def test_failed_job_retried_with_backoff(settings):
+    settings.JOBS_RETRY_DELAY = 10
+    job = enqueue("test.explode")
+
+    assert run_pending() == 1
+    job.refresh_from_db()
+    assert job.status == Job.QUEUED
+    assert "RuntimeError: boom" in job.error
+    assert job.run_after > timezone.now() + datetime.timedelta(seconds=5)
+
+    # not due yet
+    assert run_pending() == 0
+
+    for attempt in range(2):
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        assert run_pending() == 1
+    job.refresh_from_db()
+    assert job.status == Job.FAILED
+    assert job.attempts == 3
+
+@pytest.mark.django_db
+def test_eager_jobs(settings, recorded):
+    settings.JOBS_EAGER = True
+    job = enqueue("test.record", eager=True)
+    assert recorded == [{"eager": True}]
+    assert Job.objects.get(id=job.id).status == Job.DONE
+
+@pytest.mark.django_db
+def test_requeue_stale(recorded):
+    job = enqueue("test.record")
+    Job.objects.filter(id=job.id).update(
+        status=Job.RUNNING, time_updated=timezone.now() - datetime.timedelta(hours=1))
+
+    assert requeue_stale(600) == 1
+    assert run_pending() == 1
+    assert recorded == [{}]
+
+@pytest.mark.django_db
+def test_run_jobs_command(recorded, capsys):
+    enqueue("test.record", a=1)
+    enqueue("test.record", b=2)
+    call_command("run_jobs", "--once")
+    assert "Ran 2 job(s)" in capsys.readouterr().out
+    assert recorded == [{"a": 1}, {"b": 2}]
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from rest_framework.response import Response
+from gallery.async_views import async_api_view, not_found
+from gallery.conditional import aconditional
+from . import views
+
+# native async version of GET /users/<username>, see gallery/async_views.py
+
+
+async def profile_version(username, format=None):
+    row = await views.profile_version_query(username).afirst()
+    if row is None:
+        return None
+    return row[0], row
+
+
+@aconditional(profile_version)
+@async_api_view(views.specific_user_profile_view)
+async def specific_user_profile_view(request, username, format=None):
+    user = await User.objects.select_related("profile").filter(
+        username=username.lower()).afirst()
+    if user is None:
+        return not_found()
+
+    context = user.profile.serialize()
+    context["profile_picture_url"] = request.build_absolute_uri(
+        context["profile_picture_url"])
+    context["num_scraps"] = await user.scraps.acount()
+
+    return Response(data=context)
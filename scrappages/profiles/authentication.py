@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+# HTTP Basic auth without hashing the password on every request
+#
+# checking a password runs the full PBKDF2 hash (hundreds of ms of CPU),
+# which made it the most expensive part of a scripted client's GET
+# once a username/password pair has been verified, the
+#   HMAC(SECRET_KEY, username + password) -> (user id, fingerprint)
+# entry lets the same pair through for AUTH_CACHE_TIMEOUT seconds without
+# hashing again; the key can't be turned back into the password, and the
+# fingerprint is an HMAC of the user's stored password hash, so set_password()
+# (or anything else that changes the hash) invalidates every cached pair
+# of that user on the next request
+#
+# wrong passwords are never cached, they always pay for the hash
+#
+# token auth without the Token + User join on every request
+#
+# CachedTokenAuthentication keeps token key -> (user id, username, is_active) in a
+# process-local LRU (TOKEN_CACHE_SIZE entries, each trusted for
+# TOKEN_CACHE_LOCAL_TIMEOUT seconds), backed by the auth cache when
+# TOKEN_CACHE_SHARED is on, so other processes skip the join as well
+# a hit costs no query: request.user is a User with only id, username and
+# is_active loaded, anything else (email, is_staff, ...) is fetched the
+# first time it's read
+# profiles/signals.py forgets a token once the transaction that deletes it
+# (deleting a user deletes their tokens) or deactivates its user commits;
+# before the commit, a request elsewhere would just cache the old row again
+# other processes' LRUs find out within TOKEN_CACHE_LOCAL_TIMEOUT seconds
+
+
+def get_auth_cache():
+    return caches[getattr(settings, "AUTH_CACHE_ALIAS", "default")]
+
+
+def get_auth_cache_timeout():
+    return getattr(settings, "AUTH_CACHE_TIMEOUT", 300)
+
+
+def credentials_key(username, password):
+    digest = salted_hmac(
+        "profiles.authentication.credentials", f"{username}\0{password}",
+        algorithm="sha256").hexdigest()
+    return "basic:" + digest
+
+
+def password_fingerprint(user):
+    return salted_hmac(
+        "profiles.authentication.password", user.password,
+        algorithm="sha256").hexdigest()
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    def authenticate_credentials(self, userid, password, request=None):
+        cache = get_auth_cache()
+        key = credentials_key(userid, password)
+
+        entry = cache.get(key)
+        if entry is not None:
+            user_id, fingerprint = entry
+            user = User.objects.filter(pk=user_id, is_active=True).first()
+            if user is not None and constant_time_compare(
+                    fingerprint, password_fingerprint(user)):
+                return (user, None)
+            cache.delete(key)
+
+        # raises AuthenticationFailed for bad credentials
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, password_fingerprint(user)), get_auth_cache_timeout())
+        return (user, auth)
+
+
+class LRUCache:
+    """
+    thread-safe, size-bounded, least recently used entries go first
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_tokens = LRUCache(getattr(settings, "TOKEN_CACHE_SIZE", 10000))
+
+
+def _token_cache_key(key):
+    return "token:" + salted_hmac(
+        "profiles.authentication.token", key, algorithm="sha256").hexdigest()
+
+
+def _shared():
+    return getattr(settings, "TOKEN_CACHE_SHARED", False)
+
+
+def remember_token(key, principal):
+    local_tokens.set(key, principal, getattr(settings, "TOKEN_CACHE_LOCAL_TIMEOUT", 30))
+    if _shared():
+        get_auth_cache().set(_token_cache_key(key), principal, get_auth_cache_timeout())
+
+
+def lookup_token(key):
+    """
+    (user id, username, is_active) for a cached token key, None on a miss
+    """
+    principal = local_tokens.get(key)
+    if principal is None and _shared():
+        principal = get_auth_cache().get(_token_cache_key(key))
+        if principal is not None:
+            local_tokens.set(key, principal, getattr(settings, "TOKEN_CACHE_LOCAL_TIMEOUT", 30))
+    return principal
+
+
+def forget_token(key):
+    local_tokens.delete(key)
+    if _shared():
+        get_auth_cache().delete(_token_cache_key(key))
+
+
+def forget_tokens_on_commit(keys):
+    keys = list(keys)
+
+    def forget():
+        for key in keys:
+            forget_token(key)
+
+    if keys:
+        transaction.on_commit(forget)
+
+
+def deferred_user(user_id, username, is_active):
+    # a User as if loaded with .only("id", "username", "is_active")
+    return User.from_db(
+        User.objects.db, ["id", "username", "is_active"], [user_id, username, is_active])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        principal = lookup_token(key)
+        if principal is not None:
+            user = deferred_user(*principal)
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+            token = Token.from_db(Token.objects.db, ["key", "user_id"], [key, user.pk])
+            token.user = user
+            return (user, token)
+
+        # raises AuthenticationFailed for unknown keys and inactive users
+        user, token = super().authenticate_credentials(key)
+        remember_token(key, (user.pk, user.username, user.is_active))
+        return (user, token)
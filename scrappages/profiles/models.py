@@ -2,6 +2,9 @@ import os
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
+from gallery.media import media_url
+from gallery.models import save_keeping_counters
+from gallery.storage import select_media_storage
 
 # Create your models here.
 
@@ -48,13 +51,32 @@ class Profile(models.Model):
     # ensure only PNG and JPG are allowed
     profile_picture = models.ImageField(
         upload_to=profile_picture_path,
+        storage=select_media_storage,
         blank=True,
         null=True
     )
 
+    # Last-Modified / ETag of the profile endpoint
+    time_updated = models.DateTimeField(
+        auto_now=True
+    )
+
+    # home timelines, see gallery/timeline.py
+    following = models.ManyToManyField(
+        "self",
+        through="Follow",
+        symmetrical=False,
+        related_name="followers"
+    )
+
+    # denormalized, kept up to date by profiles/signals.py
+    num_followers = models.IntegerField(
+        default=0
+    )
+
     def get_profile_picture_url(self):
         if self.profile_picture:
-            return self.profile_picture.url
+            return media_url(self.profile_picture, self.time_updated)
 
         # TODO: set up default image + image path
         return os.path.join(settings.MEDIA_URL, "profile_pictures/default.jpg")
@@ -84,6 +106,7 @@ class Profile(models.Model):
             pass
 
         # call superclass's save()
+        args, kwargs = save_keeping_counters(self, ("num_followers",), args, kwargs)
         super(Profile, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
@@ -98,3 +121,35 @@ class Profile(models.Model):
 
         # call superclass's delete()
         super(Profile, self).delete(*args, **kwargs)
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name="follows"
+    )
+
+    followee = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name="followed_by"
+    )
+
+    time_posted = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    # newest scrap of followee copied into follower's timeline at read time,
+    # for accounts with too many followers to fan out to (gallery/timeline.py)
+    synced_until = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follower", "followee"], name="unique_follow"
+            )
+        ]
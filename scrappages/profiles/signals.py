@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save, pre_delete
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from profiles.models import Profile
+from rest_framework.authtoken.models import Token
+from profiles.authentication import forget_tokens_on_commit
+from profiles.models import Follow, Profile
 
 
 @receiver(post_save, sender=User)
@@ -18,3 +21,29 @@ def post_save_save_profile(sender, instance, **kwargs):
 @receiver(pre_delete, sender=User)
 def pre_delete_remove_profile_picture(sender, instance, **kwargs):
     instance.profile.delete()
+
+
+@receiver(post_save, sender=Follow)
+def post_save_count_follow(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.filter(pk=instance.followee_id).update(
+            num_followers=F("num_followers") + 1)
+
+
+@receiver(post_delete, sender=Follow)
+def post_delete_count_follow(sender, instance, **kwargs):
+    Profile.objects.filter(pk=instance.followee_id).update(
+        num_followers=F("num_followers") - 1)
+
+
+# cached tokens, see profiles/authentication.py
+# (deleting a user deletes their tokens, which lands here too)
+@receiver(post_delete, sender=Token)
+def post_delete_forget_token(sender, instance, **kwargs):
+    forget_tokens_on_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def post_save_forget_inactive_tokens(sender, instance, **kwargs):
+    if not instance.is_active:
+        forget_tokens_on_commit(Token.objects.filter(user=instance).values_list("key", flat=True))
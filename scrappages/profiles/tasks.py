@@ -0,0 +1,23 @@
+from PIL import Image
+from jobs.queue import task
+from .models import Profile
+
+
+@task("profiles.verify_profile_picture")
+def verify_profile_picture(username, picture):
+    """
+    full decode of an uploaded profile picture, dropped if it doesn't verify
+    """
+    profile = Profile.objects.filter(user__username=username).first()
+    if profile is None or profile.profile_picture.name != picture:
+        # user deleted or picture replaced since
+        return
+
+    try:
+        with profile.profile_picture.open("rb") as f:
+            with Image.open(f) as im:
+                im.verify()
+    except Exception:
+        # back to the default picture, Profile.save() removes the file
+        profile.profile_picture = None
+        profile.save()
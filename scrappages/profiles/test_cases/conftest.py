@@ -4,6 +4,13 @@ from PIL import Image
 from io import BytesIO
 import os
 import pytest
+from profiles.authentication import get_auth_cache, local_tokens
+
+@pytest.fixture(autouse=True)
+def clear_auth_cache():
+    get_auth_cache().clear()
+    local_tokens.clear()
+    yield
 
 @pytest.fixture
 def red_image():
@@ -2,12 +2,23 @@ from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.test.client import encode_multipart, BOUNDARY, MULTIPART_CONTENT
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.files.base import ContentFile
 from PIL import Image
+from io import BytesIO
+from asgiref.sync import async_to_sync
+import base64
 import json
 import os
 import pytest
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from profiles import async_views
+from profiles.authentication import local_tokens, lookup_token
 from profiles.models import Profile
-from gallery.models import Scrap
+from gallery.models import Scrap, Tag, get_tag_label
+from jobs.queue import run_pending
 
 # user_profiles
 # GET, POST
@@ -359,3 +370,288 @@ def test_specific_user_scraps(client, red_profile, blue_profile, red_image, gree
     s1.delete()
     s2.delete()
     s3.delete()
+
+def test_specific_user_scraps_paginated(client, red_profile, red_image, green_image):
+    s1 = Scrap.objects.create(
+        user=red_profile,
+        title="red",
+        description="red image",
+        file=red_image,
+        file_type="image"
+    )
+    s2 = Scrap.objects.create(
+        user=red_profile,
+        title="green",
+        description="green image",
+        file=green_image,
+        file_type="image"
+    )
+
+    response = client.get(
+        reverse(
+            'specific_user_scraps',
+            kwargs={'username': red_profile.username}
+        ),
+        {'page_size': 1}
+    )
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in result] == [s2.id]
+    assert 'rel="next"' in response['Link']
+
+    next_url = response['Link'].split(';')[0][1:-1]
+    response = client.get(next_url)
+    assert response.status_code == 200
+    result = json.loads(response.content.decode('utf-8'))
+    assert [r['id'] for r in result] == [s1.id]
+    assert 'rel="next"' not in response['Link']
+
+    s1.delete()
+    s2.delete()
+
+def test_specific_user_scraps_constant_queries(client, red_profile, red_image, green_image, blue_image):
+    url = reverse('specific_user_scraps', kwargs={'username': red_profile.username})
+
+    def count_queries():
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        assert response.status_code == 200
+        return len(queries)
+
+    scraps = []
+    for image in [red_image, green_image, blue_image]:
+        scrap = Scrap.objects.create(
+            user=red_profile,
+            title=image.name,
+            file=image,
+            file_type="image"
+        )
+        Tag.objects.create(label=get_tag_label("colour"), scrap=scrap)
+        scraps.append(scrap)
+        if len(scraps) == 1:
+            few = count_queries()
+    assert count_queries() == few
+
+    for scrap in scraps:
+        scrap.delete()
+
+def test_specific_user_profile_not_modified(client, red_profile, green_image):
+    url = reverse('specific_user_profile', kwargs={'username': red_profile.username})
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert response.has_header('Last-Modified')
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert len(queries) == 1
+
+    scrap = Scrap.objects.create(
+        user=red_profile,
+        title="green",
+        file=green_image,
+        file_type="image"
+    )
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert json.loads(response.content.decode('utf-8'))['num_scraps'] == 1
+    assert response['ETag'] != etag
+
+    scrap.delete()
+
+def test_user_profiles_get_stream(client, red_profile, blue_profile):
+    response = client.get(reverse("user_profiles"), {"stream": 1})
+    assert response.status_code == 200
+    assert response.streaming
+    streamed = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+    assert [p["username"] for p in streamed] == ["blueman", "redman"]
+    assert streamed == json.loads(client.get(reverse("user_profiles")).content.decode("utf-8"))
+
+def test_specific_user_profile_put_picture_fails_verification(client, red_profile):
+    logged_in = client.login(username="redman", password="red12345")
+    assert logged_in
+
+    # a valid header with the image data cut off gets past the upload request
+    img_io = BytesIO()
+    Image.effect_noise((500, 500), 64).save(img_io, format="PNG")
+    broken = ContentFile(img_io.getvalue()[:len(img_io.getvalue()) // 2], "brokenfile.png")
+
+    response = client.put(
+        reverse(
+            'specific_user_profile',
+            kwargs={'username': red_profile.username}
+        ),
+        data=encode_multipart(BOUNDARY, {'profile_picture': broken}),
+        content_type=MULTIPART_CONTENT
+    )
+    assert response.status_code == 200
+    path = get_object_or_404(Profile, user=red_profile).profile_picture.path
+    assert os.path.exists(path)
+
+    assert run_pending() == 1
+    profile = get_object_or_404(Profile, user=red_profile)
+    assert not profile.profile_picture
+    assert not os.path.exists(path)
+
+# follow
+# POST, DELETE
+def test_follow(client, red_profile, blue_profile):
+    url = reverse("follow", kwargs={"username": blue_profile.username})
+    response = client.post(url)
+    assert response.status_code == 401
+
+    logged_in = client.login(username="redman", password="red12345")
+    assert logged_in
+
+    response = client.post(url)
+    assert response.status_code == 200
+    assert json.loads(response.content.decode("utf-8")) == True
+    response = client.post(url)
+    assert json.loads(response.content.decode("utf-8")) == False
+
+    blue = get_object_or_404(Profile, user=blue_profile)
+    assert blue.num_followers == 1
+    assert list(blue.followers.all()) == [red_profile.profile]
+    assert list(red_profile.profile.following.all()) == [blue]
+
+    # a plain save of a stale profile keeps the counter
+    red_profile.profile.save()
+    blue_profile.save()
+    assert get_object_or_404(Profile, user=blue_profile).num_followers == 1
+
+    response = client.delete(url)
+    assert json.loads(response.content.decode("utf-8")) == True
+    response = client.delete(url)
+    assert json.loads(response.content.decode("utf-8")) == False
+    assert get_object_or_404(Profile, user=blue_profile).num_followers == 0
+
+def test_follow_yourself(client, red_profile):
+    logged_in = client.login(username="redman", password="red12345")
+    assert logged_in
+
+    response = client.post(reverse("follow", kwargs={"username": "redman"}))
+    assert response.status_code == 400
+    assert json.loads(response.content.decode("utf-8")) == "Invalid; cannot follow yourself"
+
+# cached Basic auth, see profiles/authentication.py
+def basic_auth(username, password):
+    token = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+    return {"HTTP_AUTHORIZATION": f"Basic {token}"}
+
+def count_password_checks(monkeypatch):
+    checks = []
+    check_password = User.check_password
+
+    def counting(user, raw_password):
+        checks.append(raw_password)
+        return check_password(user, raw_password)
+    monkeypatch.setattr(User, "check_password", counting)
+    return checks
+
+def test_basic_auth_cached(client, red_profile, monkeypatch):
+    checks = count_password_checks(monkeypatch)
+    url = reverse("home_scraps")
+
+    for i in range(3):
+        response = client.get(url, **basic_auth("redman", "red12345"))
+        assert response.status_code == 200
+    assert len(checks) == 1
+
+    # wrong passwords are checked every time
+    for i in range(2):
+        response = client.get(url, **basic_auth("redman", "wrong"))
+        assert response.status_code == 401
+    assert len(checks) == 3
+
+def test_basic_auth_cache_set_password(client, red_profile, monkeypatch):
+    url = reverse("home_scraps")
+    assert client.get(url, **basic_auth("redman", "red12345")).status_code == 200
+
+    red_profile.set_password("new12345")
+    red_profile.save()
+    checks = count_password_checks(monkeypatch)
+
+    assert client.get(url, **basic_auth("redman", "red12345")).status_code == 401
+    assert client.get(url, **basic_auth("redman", "new12345")).status_code == 200
+    assert len(checks) == 2
+
+# cached token auth
+def token_auth(token):
+    return {"HTTP_AUTHORIZATION": f"Token {token.key}"}
+
+def auth_queries(queries):
+    return [q for q in queries if "authtoken_token" in q["sql"] or 'FROM "auth_user"' in q["sql"]]
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_token_auth_cached(client, settings, red_profile, blue_profile, shared):
+    settings.TOKEN_CACHE_SHARED = shared
+    token = Token.objects.create(user=red_profile)
+    scrap = Scrap.objects.create(
+        user=blue_profile, title="Blue", file=ContentFile("blue", "blue.txt"), file_type="text")
+    url = reverse("scrap_like", kwargs={"sid": scrap.id})
+
+    with CaptureQueriesContext(connection) as queries:
+        assert client.post(url, **token_auth(token)).status_code == 200
+    assert len(auth_queries(queries)) == 1
+
+    # the like and the comment are made from the cached principal alone
+    if shared:
+        local_tokens.clear()
+    with CaptureQueriesContext(connection) as queries:
+        assert client.delete(url, **token_auth(token)).status_code == 200
+        response = client.post(
+            reverse("scrap_comments", kwargs={"sid": scrap.id}),
+            {"content": "hi"}, **token_auth(token))
+    assert response.status_code == 200
+    assert json.loads(response.content.decode("utf-8"))["user"] == "redman"
+    assert auth_queries(queries) == []
+    os.unlink(scrap.file.path)
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_token_auth_revoked(client, settings, red_profile, django_capture_on_commit_callbacks, shared):
+    settings.TOKEN_CACHE_SHARED = shared
+    url = reverse("home_scraps")
+    token = Token.objects.create(user=red_profile)
+    assert client.get(url, **token_auth(token)).status_code == 200
+
+    with django_capture_on_commit_callbacks(execute=True):
+        token.delete()
+    assert client.get(url, **token_auth(token)).status_code == 401
+
+    token = Token.objects.create(user=red_profile)
+    assert client.get(url, **token_auth(token)).status_code == 200
+    # forgotten once the deactivation commits, a request racing the
+    # transaction would have cached the user as active again
+    with django_capture_on_commit_callbacks() as callbacks:
+        red_profile.is_active = False
+        red_profile.save()
+    assert lookup_token(token.key) is not None
+    for callback in callbacks:
+        callback()
+    assert lookup_token(token.key) is None
+    assert client.get(url, **token_auth(token)).status_code == 401
+
+# native async view, see profiles/async_views.py
+def test_async_specific_user_profile_view(client, async_rf, red_profile):
+    view = async_to_sync(async_views.specific_user_profile_view)
+    etags = []
+    for username in ["RedMan", "nobody"]:
+        url = reverse("specific_user_profile", kwargs={"username": username})
+        expected = client.get(url)
+        response = view(async_rf.get(url), username=username)
+        assert response.status_code == expected.status_code
+        assert json.loads(response.content) == json.loads(expected.content)
+        assert response.get("ETag") == expected.get("ETag")
+        etags.append(response.get("ETag"))
+
+    url = reverse("specific_user_profile", kwargs={"username": "redman"})
+    response = view(async_rf.get(url, if_none_match=etags[0]), username="redman")
+    assert response.status_code == 304
+
+    # writes go to the sync view
+    token = Token.objects.create(user=red_profile)
+    response = view(async_rf.put(url, {"description": "async"}, content_type="application/json",
+                                 authorization=f"Token {token.key}"), username="redman")
+    assert response.status_code == 200
+    assert get_object_or_404(Profile, user=red_profile).description == "async"
@@ -15,3 +15,7 @@ def test_specific_user_profile_access():
 def test_specific_user_scraps_access():
     url = reverse("specific_user_scraps", kwargs={"username": "bison"})
     assert url == "/profiles/bison/scraps"
+
+def test_follow_access():
+    url = reverse("follow", kwargs={"username": "bison"})
+    assert url == "/profiles/bison/follow"
@@ -1,13 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from profiles import views
+from profiles import async_views, views
 from rest_framework.urlpatterns import format_suffix_patterns
 
+# native async GET views under ASGI, see gallery/async_views.py
+read_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     path('', views.user_profiles_view, name='user_profiles'),
-    path('<str:username>', views.specific_user_profile_view,
+    path('<str:username>', read_views.specific_user_profile_view,
          name='specific_user_profile'),
     path('<str:username>/scraps', views.specific_user_scraps_view,
          name='specific_user_scraps'),
+    path('<str:username>/follow', views.follow_view,
+         name='follow'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -6,11 +6,19 @@ from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.decorators import api_view, parser_classes, permission_classes, renderer_classes
 from rest_framework.parsers import JSONParser
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from PIL import Image
-from .models import Profile
+from jobs.queue import enqueue
+from gallery.conditional import conditional
+from gallery.counters import count_of
+from gallery.models import Scrap
+from gallery.pagination import paginate
+from gallery.streaming import stream_json, wants_stream
+from gallery.likes import mark_liked
+from gallery.views import scrap_context
+from .models import Follow, Profile
 
 
 def validate_username(username):
@@ -18,6 +26,29 @@ def validate_username(username):
     return bool(re.match("^[A-Za-z0-9_-]*$", username))
 
 
+# (last modified, ETag parts) for conditional GETs, see gallery/conditional.py
+def profile_version_query(username):
+    return Profile.objects.filter(user__username=username.lower()).annotate(
+        num_scraps=count_of(Scrap, "user")).values_list(
+        "time_updated", "num_scraps")
+
+
+def profile_version(username, format=None):
+    row = profile_version_query(username).first()
+    if row is None:
+        return None
+    return row[0], row
+
+
+# a listed profile as the API returns it
+def profile_context(request, user):
+    context = user.profile.serialize()
+    context["profile_picture_url"] = request.build_absolute_uri(
+        context["profile_picture_url"])
+    context["num_scraps"] = user.num_scraps
+    return context
+
+
 # Create your views here.
 @api_view(["GET", "POST"])
 @csrf_exempt
@@ -27,14 +58,13 @@ def user_profiles_view(request, format=None):
     if request.method == "GET":
         context = []
 
-        users = User.objects.annotate(
+        users = User.objects.select_related("profile").annotate(
             num_scraps=Count('scraps')).order_by("username")
+        if wants_stream(request):
+            return stream_json(users, lambda user: profile_context(request, user))
+
         for user in users:
-            ans = user.profile.serialize()
-            ans["profile_picture_url"] = request.build_absolute_uri(
-                ans["profile_picture_url"])
-            ans["num_scraps"] = user.num_scraps
-            context.append(ans)
+            context.append(profile_context(request, user))
 
         return Response(data=context)
 
@@ -99,6 +129,7 @@ def user_profiles_view(request, format=None):
         return Response(user.profile.serialize())
 
 
+@conditional(profile_version)
 @api_view(["GET", "PUT", "DELETE"])
 @csrf_exempt
 @permission_classes([IsAuthenticatedOrReadOnly])
@@ -149,9 +180,10 @@ def specific_user_profile_view(request, username, format=None):
             if request.data['profile_picture'].content_type not in ['image/png', 'image/jpg', 'image/jpeg']:
                 return Response("Invalid file type; only accepts PNG and JPG",
                                 status=status.HTTP_400_BAD_REQUEST)
+            # only the header is read here, the full decode is left to the
+            # profiles.verify_profile_picture job
             try:
-                im = Image.open(request.data["profile_picture"])
-                im.verify()
+                Image.open(request.data["profile_picture"])
             except:
                 return Response("Invalid image file",
                                 status=status.HTTP_400_BAD_REQUEST)
@@ -160,6 +192,10 @@ def specific_user_profile_view(request, username, format=None):
 
         user.save()
 
+        if "profile_picture" in request.data:
+            enqueue("profiles.verify_profile_picture",
+                    username=username, picture=profile.profile_picture.name)
+
         context = profile.serialize()
         context["profile_picture_url"] = request.build_absolute_uri(
             context["profile_picture_url"])
@@ -193,16 +229,47 @@ def specific_user_scraps_view(request, username, format=None):
     - list of Tags
     """
     user = get_object_or_404(User, username=username)
-    scraps = user.scraps.annotate(
-        num_comments=Count('comments', distinct=True),
-        num_likes=Count('likers', distinct=True)).order_by('-time_updated')
+    scraps = user.scraps.for_serialization()
+    if wants_stream(request):
+        return stream_json(scraps.order_by("-time_updated", "-id"),
+                           lambda scrap: scrap_context(request, scrap),
+                           lambda scraps: mark_liked(request, scraps))
+
+    try:
+        scraps, headers = paginate(request, scraps)
+    except ValueError as e:
+        return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
     context = []
-    for scrap in scraps:
-        ans = scrap.serialize()
-        ans["file_url"] = request.build_absolute_uri(ans["file_url"])
-        ans["num_comments"] = scrap.num_comments
-        ans["num_likes"] = scrap.num_likes
-        context.append(ans)
-
-    return Response(data=context)
+    for scrap in mark_liked(request, scraps):
+        context.append(scrap_context(request, scrap))
+
+    return Response(data=context, headers=headers)
+
+
+@api_view(["POST", "DELETE"])
+@csrf_exempt
+@permission_classes([IsAuthenticated])
+@renderer_classes([JSONRenderer])
+def follow_view(request, username, format=None):
+    """
+    follows/unfollows a user, their scraps show up in GET /scraps/home
+    """
+    user = get_object_or_404(User, username=username.lower())
+    if user == request.user:
+        return Response("Invalid; cannot follow yourself",
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if request.method == "POST":
+        _, created = Follow.objects.get_or_create(
+            follower_id=request.user.id, followee_id=user.id)
+        return Response(created)
+
+    elif request.method == "DELETE":
+        follow = Follow.objects.filter(
+            follower_id=request.user.id, followee_id=user.id).first()
+        if follow is None:
+            return Response(False)
+
+        follow.delete()
+        return Response(True)
@@ -0,0 +1,172 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+
+# load test of one GET endpoint through the WSGI and the ASGI handler
+#
+# --concurrency clients each send their share of --requests one after the
+# other; every response is read by a client taking --client-delay ms per
+# chunk, like a slow network would
+#   wsgi   --threads worker threads (gunicorn --threads), a slow client
+#          keeps its worker until it has read the whole response
+#   asgi   one event loop, a slow client only keeps a task waiting
+# the views served are the ones the URLconf picked: run it once with
+# ASYNC_VIEWS=False for the WSGI numbers and once with ASYNC_VIEWS=True
+# for the async views' ASGI numbers
+
+
+def _percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Compares the latency and throughput of a GET endpoint under WSGI and ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/scraps/")
+        parser.add_argument("--query", default="")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--client-delay", type=float, default=0.0)
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--token", default="",
+                            help="Token key to send, authenticated GETs skip the response cache")
+        parser.add_argument("--handlers", default="wsgi,asgi")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"ASYNC_VIEWS={settings.ASYNC_VIEWS}")
+        runs = {"wsgi": self.run_wsgi, "asgi": self.run_asgi}
+        for name in options["handlers"].split(","):
+            if name not in runs:
+                self.stderr.write(f"Unknown handler {name}")
+                continue
+
+            start = time.perf_counter()
+            results = runs[name](options)
+            elapsed = time.perf_counter() - start
+
+            timings = sorted(timing for timing, code in results)
+            errors = sum(1 for timing, code in results if code != 200)
+            self.stdout.write(
+                f"{name:>5}: {len(results) / elapsed:.1f} req/s, "
+                f"mean {statistics.mean(timings):.2f} ms, "
+                f"p50 {statistics.median(timings):.2f} ms, "
+                f"p95 {_percentile(timings, 0.95):.2f} ms, "
+                f"p99 {_percentile(timings, 0.99):.2f} ms, "
+                f"{errors} errors"
+            )
+
+    def _shares(self, options):
+        # requests per client
+        clients = max(1, min(options["concurrency"], options["requests"]))
+        share, extra = divmod(options["requests"], clients)
+        return [share + (1 if i < extra else 0) for i in range(clients)]
+
+    def run_wsgi(self, options):
+        application = get_wsgi_application()
+        workers = threading.BoundedSemaphore(options["threads"])
+        delay = options["client_delay"] / 1000
+        results = []
+
+        def request():
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": options["path"],
+                "QUERY_STRING": options["query"],
+                "SERVER_NAME": options["host"],
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "HTTP_HOST": options["host"],
+                "wsgi.input": io.BytesIO(),
+                "wsgi.errors": io.StringIO(),
+                "wsgi.url_scheme": "http",
+            }
+            if options["token"]:
+                environ["HTTP_AUTHORIZATION"] = f"Token {options['token']}"
+            code = []
+
+            def start_response(status, headers, exc_info=None):
+                code.append(int(status.split(" ", 1)[0]))
+
+            start = time.perf_counter()
+            with workers:
+                body = application(environ, start_response)
+                try:
+                    for chunk in body:
+                        if delay:
+                            time.sleep(delay)
+                finally:
+                    body.close()
+            results.append(((time.perf_counter() - start) * 1000, code[0]))
+
+        def client(count):
+            for i in range(count):
+                request()
+
+        clients = [threading.Thread(target=client, args=(count,))
+                   for count in self._shares(options)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return results
+
+    def run_asgi(self, options):
+        application = get_asgi_application()
+        delay = options["client_delay"] / 1000
+        headers = [(b"host", options["host"].encode("latin-1"))]
+        if options["token"]:
+            headers.append((b"authorization", f"Token {options['token']}".encode("latin-1")))
+        results = []
+
+        async def request():
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": options["path"],
+                "raw_path": options["path"].encode("utf-8"),
+                "query_string": options["query"].encode("latin-1"),
+                "root_path": "",
+                "headers": headers,
+                "client": ("127.0.0.1", 0),
+                "server": (options["host"], 80),
+            }
+            received = False
+            code = []
+
+            async def receive():
+                nonlocal received
+                if received:
+                    return {"type": "http.disconnect"}
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    code.append(message["status"])
+                elif delay:
+                    await asyncio.sleep(delay)
+
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            results.append(((time.perf_counter() - start) * 1000, code[0]))
+
+        async def client(count):
+            for i in range(count):
+                await request()
+
+        async def main():
+            await asyncio.gather(*[client(count) for count in self._shares(options)])
+
+        asyncio.run(main())
+        return results
@@ -0,0 +1,78 @@
+import copy
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.utils import load_backend
+from gallery.models import Scrap
+
+# per-request database latency with each way of managing connections
+#
+# every simulated request does what a real one does around the view:
+#   close_if_unusable_or_obsolete()   (request_started)
+#   one feed page query
+#   close_if_unusable_or_obsolete()   (request_finished)
+# so "new" pays for a connection (and a server fork) every time, while
+# "persistent" and "pooled" reuse one
+
+MODES = {
+    "new": {"CONN_MAX_AGE": 0},
+    "persistent": {"CONN_MAX_AGE": None, "CONN_HEALTH_CHECKS": True},
+    "pooled": {
+        "ENGINE": "scrappages.postgresql_pool",
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": True,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Measures per-request database latency with new, persistent and pooled connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--modes", default=",".join(MODES))
+
+    def handle(self, *args, **options):
+        base = connections[options["database"]]
+        sql = (f"SELECT id FROM {base.ops.quote_name(Scrap._meta.db_table)} "
+               f"ORDER BY time_updated DESC, id DESC LIMIT 50")
+
+        for mode in options["modes"].split(","):
+            if mode not in MODES:
+                self.stderr.write(f"Unknown mode {mode}")
+                continue
+            if mode == "pooled" and base.vendor != "postgresql":
+                self.stdout.write(f"{mode:>10}: skipped, needs PostgreSQL")
+                continue
+
+            settings_dict = {**copy.deepcopy(base.settings_dict), **MODES[mode]}
+            if mode != "pooled":
+                settings_dict["ENGINE"] = base.settings_dict["ENGINE"]
+            wrapper = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(
+                settings_dict, alias=f"benchmark_{mode}")
+
+            timings = []
+            try:
+                for i in range(options["warmup"] + options["requests"]):
+                    start = time.perf_counter()
+                    wrapper.close_if_unusable_or_obsolete()
+                    with wrapper.cursor() as cursor:
+                        cursor.execute(sql)
+                        cursor.fetchall()
+                    wrapper.close_if_unusable_or_obsolete()
+                    if i >= options["warmup"]:
+                        timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                wrapper.close()
+                if mode == "pooled":
+                    wrapper.close_pools()
+
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f"{mode:>10}: mean {statistics.mean(timings):.3f} ms, "
+                f"p50 {statistics.median(timings):.3f} ms, p95 {p95:.3f} ms"
+            )
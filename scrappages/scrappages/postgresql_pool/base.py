@@ -0,0 +1,150 @@
+import threading
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+# Postgres with an in-process connection pool (ENGINE = "scrappages.postgresql_pool")
+#
+# for threaded workers: instead of every thread opening (and the server
+# forking) a connection of its own, threads borrow one from a shared
+# ConnectionPool and hand it back when Django closes it, i.e. at the end of
+# every request (keep CONN_MAX_AGE at 0); returned connections stay open,
+# so once the pool has warmed up requests don't connect at all
+#
+# OPTIONS["pool"] = {"min_size": 1, "max_size": 10, "timeout": 10}
+#   min_size   connections opened up front
+#   max_size   connections open at most (borrowed + idle), further threads
+#              wait for one to come back
+#   timeout    seconds to wait before giving up with OperationalError
+# with CONN_HEALTH_CHECKS a borrowed connection is tested with SELECT 1
+# and replaced if the server has dropped it
+#
+# the pool is per process, created on first use (so after any fork)
+
+
+class ConnectionPool:
+    """
+    at most max_size connections made by connect(), kept open between uses
+    """
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10):
+        self.connect = connect
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle = [connect() for i in range(min(min_size, max_size))]
+
+    def getconn(self, usable=None):
+        """
+        an idle connection (one usable() accepts), or a new one
+        waits up to timeout seconds while max_size are borrowed
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError("connection pool exhausted")
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return self.connect()
+                if usable is None or usable(connection):
+                    return connection
+                # e.g. dropped by a server restart
+                connection.close()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        try:
+            if not close and not connection.closed:
+                status = connection.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    # anything left open is rolled back
+                    connection.rollback()
+            if close or connection.closed:
+                connection.close()
+            else:
+                with self.lock:
+                    self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # connection parameters -> ConnectionPool
+    pools = {}
+    pools_lock = threading.Lock()
+
+    def pool_options(self):
+        options = self.settings_dict["OPTIONS"].get("pool", {})
+        return {"min_size": 1, "max_size": 10, "timeout": 10, **options}
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    def get_pool(self, conn_params):
+        key = repr(sorted(conn_params.items()))
+        with self.pools_lock:
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(
+                    lambda: psycopg2.connect(**conn_params), **self.pool_options())
+            return self.pools[key]
+
+    @classmethod
+    def close_pools(cls):
+        with cls.pools_lock:
+            for pool in cls.pools.values():
+                pool.closeall()
+            cls.pools.clear()
+
+    def usable(self, connection):
+        if connection.closed:
+            return False
+        if not self.settings_dict["CONN_HEALTH_CHECKS"]:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            # don't leave a transaction open if autocommit is off
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        connection = pool.getconn(self.usable)
+        self.borrowed_from = pool
+
+        # the rest is what the postgresql backend does with a new connection
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # rolls back anything left open, broken connections are dropped
+        with self.wrap_database_errors:
+            self.borrowed_from.putconn(self.connection)
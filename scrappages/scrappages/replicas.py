@@ -0,0 +1,196 @@
+import asyncio
+import contextlib
+import contextvars
+import random
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import LazyObject, empty
+
+# read replicas (DB_REPLICA_HOSTS)
+#
+# ReplicaRouter sends the reads of safe (GET/HEAD/OPTIONS) requests to a
+# random replica in REPLICA_DATABASES; everything else goes to the primary:
+#   - writes, and reads of POST/PUT/DELETE requests
+#   - reads inside a transaction on the primary
+#   - reads outside any request (jobs, management commands), which usually
+#     act on rows that were just written
+#   - reads "pinned" to the primary for REPLICA_PIN_SECONDS after the
+#     client's own write, so nobody misses their own changes while the
+#     replicas catch up: ReplicaPinMiddleware sets a cookie on the response
+#     to every write, and for clients that don't keep cookies, remembers the
+#     authenticated user in the pin cache (REPLICA_PIN_CACHE_ALIAS)
+#   - the reads that refill the gallery response cache for REPLICA_PIN_SECONDS
+#     after it was invalidated, see pin_cache_fills(): a replica could still
+#     hand back the rows from before the write, to everyone, until the
+#     entry expires
+# a streamed response is read after the middleware has returned, so it
+# comes from the primary too
+#
+# the pin cache has to be shared by every process serving requests, a
+# client's next request may well land on another one
+
+PIN_COOKIE = "db_primary"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_current = contextvars.ContextVar("replica_request", default=None)
+
+
+def get_replicas():
+    return getattr(settings, "REPLICA_DATABASES", [])
+
+
+def get_pin_seconds():
+    return getattr(settings, "REPLICA_PIN_SECONDS", 15)
+
+
+def get_pin_cache():
+    return caches[getattr(settings, "REPLICA_PIN_CACHE_ALIAS", "replica_pins")]
+
+
+def _pin_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+FILL_PIN_KEY = "replica-pin:cache-fills"
+
+
+def _authenticated_user(request):
+    # only a user that's already been loaded, looking one up here would
+    # recurse straight back into the router
+    user = request.__dict__.get("user")
+    if isinstance(user, LazyObject):
+        user = None if user._wrapped is empty else user._wrapped
+    if user is None or not user.is_authenticated:
+        return None
+    return user
+
+
+def pin_user(user):
+    get_pin_cache().set(_pin_key(user.pk), True, get_pin_seconds())
+
+
+def pin_cache_fills():
+    # called once the gallery response cache has been invalidated
+    if get_replicas():
+        get_pin_cache().set(FILL_PIN_KEY, True, get_pin_seconds())
+
+
+def cache_fills_pinned():
+    return bool(get_replicas()) and bool(get_pin_cache().get(FILL_PIN_KEY))
+
+
+async def acache_fills_pinned():
+    return bool(get_replicas()) and bool(await get_pin_cache().aget(FILL_PIN_KEY))
+
+
+class RequestState:
+    def __init__(self, request):
+        self.request = request
+        self.pinned = request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+        self.user_checked = False
+
+    def use_primary(self):
+        if not self.pinned and not self.user_checked:
+            # DRF authenticates inside the view, before its first query
+            user = _authenticated_user(self.request)
+            if user is not None:
+                self.user_checked = True
+                self.pinned = bool(get_pin_cache().get(_pin_key(user.pk)))
+        return self.pinned
+
+
+@contextlib.contextmanager
+def routing_for(request):
+    """
+    routes the reads made inside the block as the reads of request
+    """
+    token = _current.set(RequestState(request))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def primary_reads(pinned=True):
+    """
+    routes the reads made inside the block to the primary, if pinned
+    """
+    if not pinned:
+        yield
+        return
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        state = _current.get()
+        if not replicas or state is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.use_primary():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # also for rows that were read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaPinMiddleware:
+    # async too, so the async views (ASYNC_VIEWS) don't get pushed back
+    # onto a thread under ASGI
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # the same check as django's MiddlewareMixin
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        else:
+            self._is_coroutine = None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+
+        with routing_for(request):
+            response = self.get_response(request)
+
+        user = self._pin(request, response)
+        if user is not None:
+            pin_user(user)
+        return response
+
+    async def __acall__(self, request):
+        # the context (and so the routing) is copied into the threads
+        # sync_to_async runs the queries on
+        with routing_for(request):
+            response = await self.get_response(request)
+
+        user = self._pin(request, response)
+        if user is not None:
+            await get_pin_cache().aset(_pin_key(user.pk), True, get_pin_seconds())
+        return response
+
+    def _pin(self, request, response):
+        # the user to pin, if any
+        if get_replicas() and request.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, "1", max_age=get_pin_seconds(),
+                                httponly=True, samesite="Lax")
+            return _authenticated_user(request)
+        return None
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,8 +43,11 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework.authtoken',
-    'gallery',
+    'gallery.apps.GalleryConfig',
     'profiles.apps.ProfilesConfig',
+    'jobs.apps.JobsConfig',
+    # project-wide management commands (benchmarks)
+    'scrappages',
 ]
 
 MIDDLEWARE = [
@@ -53,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'scrappages.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,10 +81,24 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'scrappages.wsgi.application'
 
+# serve the busiest GET endpoints from native async views, for ASGI servers
+# (scrappages/asgi.py), see gallery/async_views.py
+# off by default: on Django 4.1 they are no faster, see the numbers there
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# connections are kept open between requests for DB_CONN_MAX_AGE seconds
+# (0 closes them after every request, "None" keeps them forever) and
+# checked before being reused
+# DB_POOL instead borrows connections from an in-process pool shared by the
+# worker's threads, see scrappages/postgresql_pool/base.py
+# python manage.py benchmark_connections compares the options
+
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -89,9 +107,110 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        'CONN_MAX_AGE': config(
+            'DB_CONN_MAX_AGE', default=60,
+            cast=lambda value: None if value == 'None' else int(value)),
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
     }
 }
 
+if DB_POOL:
+    DATABASES['default'].update({
+        'ENGINE': 'scrappages.postgresql_pool',
+        # connections go back to the pool at the end of every request
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'min_size': config('DB_POOL_MIN_SIZE', default=1, cast=int),
+                'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+            },
+        },
+    })
+
+# read replicas, DB_REPLICA_HOSTS=replica1,replica2 (the other connection
+# settings are the primary's unless DB_REPLICA_PORT etc. say otherwise)
+# see scrappages/replicas.py
+
+REPLICA_DATABASES = []
+for i, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv())):
+    alias = f'replica_{i}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        'OPTIONS': dict(DATABASES['default'].get('OPTIONS', {})),
+        # tests run against the primary alone
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['scrappages.replicas.ReplicaRouter']
+
+# reads stay on the primary this long after a client's own write
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=15, cast=int)
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# the gallery response cache is a local-memory LRU unless a Redis URL is given
+
+GALLERY_CACHE_ALIAS = 'gallery'
+# verified credentials, see profiles/authentication.py
+AUTH_CACHE_ALIAS = 'auth'
+# who reads from the primary after a write, see scrappages/replicas.py
+REPLICA_PIN_CACHE_ALIAS = 'replica_pins'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    GALLERY_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'gallery',
+        'TIMEOUT': config('GALLERY_CACHE_TIMEOUT', default=300, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('GALLERY_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+    AUTH_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth',
+        'OPTIONS': {
+            'MAX_ENTRIES': config('AUTH_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+    REPLICA_PIN_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'replica_pins',
+    },
+}
+
+if config('GALLERY_CACHE_REDIS_URL', default=''):
+    CACHES[GALLERY_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('GALLERY_CACHE_REDIS_URL'),
+        'TIMEOUT': config('GALLERY_CACHE_TIMEOUT', default=300, cast=int),
+        'KEY_PREFIX': 'gallery',
+    }
+
+# a shared auth cache lets every process use verified credentials and tokens
+if config('AUTH_CACHE_REDIS_URL', default=''):
+    CACHES[AUTH_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('AUTH_CACHE_REDIS_URL'),
+        'KEY_PREFIX': 'auth',
+    }
+
+# with replicas and more than one process, the pins have to be shared
+if config('REPLICA_PIN_CACHE_REDIS_URL', default=''):
+    CACHES[REPLICA_PIN_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REPLICA_PIN_CACHE_REDIS_URL'),
+        'KEY_PREFIX': 'replica_pins',
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -132,6 +251,20 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 MEDIA_URL = '/media/'
 
+# store each unique upload once under media/blobs/, see gallery/storage.py
+MEDIA_DEDUP = config('MEDIA_DEDUP', default=False, cast=bool)
+
+# media serving, see gallery/media.py
+# MEDIA_IMMUTABLE_URLS versions the media URLs in API responses so they can
+# be cached forever, MEDIA_ACCEL ("nginx" or "sendfile") lets the front
+# server send the files
+MEDIA_IMMUTABLE_URLS = config('MEDIA_IMMUTABLE_URLS', default=False, cast=bool)
+MEDIA_ACCEL = config('MEDIA_ACCEL', default='')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+# without MEDIA_ACCEL, production media is sent by the front server straight
+# from MEDIA_ROOT, Django only serves it while developing
+MEDIA_SERVE = DEBUG or bool(MEDIA_ACCEL)
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
@@ -142,8 +275,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'profiles.authentication.CachedBasicAuthentication',
+        'profiles.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_RENDERER_CLASSES': (
@@ -151,3 +284,38 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.TemplateHTMLRenderer',
     ),
 }
+
+# verified Basic auth credentials, see profiles/authentication.py
+AUTH_CACHE_TIMEOUT = config('AUTH_CACHE_TIMEOUT', default=300, cast=int)
+# token key -> user, see profiles/authentication.py
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+TOKEN_CACHE_LOCAL_TIMEOUT = config('TOKEN_CACHE_LOCAL_TIMEOUT', default=30, cast=int)
+TOKEN_CACHE_SHARED = config('TOKEN_CACHE_SHARED', default=False, cast=bool)
+
+# Scrap feeds (keyset pagination)
+SCRAPS_PAGE_SIZE = config('SCRAPS_PAGE_SIZE', default=50, cast=int)
+SCRAPS_MAX_PAGE_SIZE = config('SCRAPS_MAX_PAGE_SIZE', default=200, cast=int)
+
+# rows fetched per database round trip by ?stream=1 list responses
+STREAM_CHUNK_SIZE = config('STREAM_CHUNK_SIZE', default=500, cast=int)
+
+# text search configuration of the scrap search index, see gallery/search.py
+SEARCH_CONFIG = config('SEARCH_CONFIG', default='english')
+
+# GET /scraps/?sort=hot: a scrap needs twice the likes/comments to keep up
+# with one posted this much later, see gallery/scores.py
+HOT_HALF_LIFE_HOURS = config('HOT_HALF_LIFE_HOURS', default=12, cast=float)
+
+# home timelines, see gallery/timeline.py
+# scraps of accounts with more followers than this are pulled in when a
+# follower reads their timeline instead of being copied to every follower
+TIMELINE_FANOUT_MAX_FOLLOWERS = config('TIMELINE_FANOUT_MAX_FOLLOWERS', default=10000, cast=int)
+TIMELINE_BACKFILL = config('TIMELINE_BACKFILL', default=50, cast=int)
+# longest a scrap's transaction may take to commit without it being missed
+# by the pull of a big account's scraps
+TIMELINE_PULL_LAG = config('TIMELINE_PULL_LAG', default=60, cast=int)
+
+# Background jobs (see jobs/queue.py), run with `manage.py run_jobs`
+# JOBS_EAGER runs each job inside enqueue() instead, for development
+JOBS_EAGER = config('JOBS_EAGER', default=False, cast=bool)
+JOBS_RETRY_DELAY = config('JOBS_RETRY_DELAY', default=10, cast=int)